@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Time population generation and the infection algorithms across sizes and shapes
+
+Run "make bench", or see ./benchmark.py --help. Every measurement runs in its
+own forked process, so peak RSS belongs to that measurement alone. Results are
+written as JSON; pass --baseline with an earlier results file to have any
+measurement that got slower by more than --tolerance reported, and the exit
+status set to 1.
+
+Plain User populations get slow and huge long before Graph-backed ones do, so
+benchmarks on them are skipped above --max-plain users.
+"""
+
+
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+from infection import limited_infection, total_infection, weighted_infection
+from population import Population
+
+
+SHAPES = {
+    'default': dict(coach_rate=0.1, classes_per_student=0),
+    'few_coaches': dict(coach_rate=0.01, classes_per_student=0),
+    'many_classes': dict(coach_rate=0.1, classes_per_student=4),
+    'all_coaches': dict(coach_rate=1, classes_per_student=1),
+}
+DEFAULT_SIZES = [1000, 10000, 100000]
+SEEDS = 20          # start users per infection benchmark
+
+
+def _random_users(population, count, seed):
+    rng = random.Random(seed)
+    return [population.population[rng.randrange(population.N)] for i in xrange(count)]
+
+def bench_randomize(size, shape, seed):
+    random.seed(seed)
+    yield Population().randomize, (size,), SHAPES[shape]
+
+def bench_update_user_relationships(size, shape, seed):
+    random.seed(seed)
+    p = Population()
+    p.randomize(size, **SHAPES[shape])
+    yield p.update_user_relationships, (SHAPES[shape]['classes_per_student'],), {}
+
+def bench_randomize_graph(size, shape, seed):
+    yield Population().randomize_graph, (size,), dict(SHAPES[shape], seed=seed)
+
+def _infections(function, graph, size, shape, seed, **kwargs):
+    p = Population()
+    if graph:
+        p.randomize_graph(size, seed=seed, **SHAPES[shape])
+    else:
+        random.seed(seed)
+        p.randomize(size, **SHAPES[shape])
+    for user in _random_users(p, SEEDS, seed):
+        yield function, (user,), kwargs
+
+def bench_total_infection(size, shape, seed):
+    return _infections(total_infection, False, size, shape, seed)
+
+def bench_total_infection_graph(size, shape, seed):
+    return _infections(total_infection, True, size, shape, seed)
+
+def bench_limited_infection(size, shape, seed):
+    return _infections(limited_infection, False, size, shape, seed,
+                       max_infections=max(1, size // 10))
+
+def bench_limited_infection_graph(size, shape, seed):
+    return _infections(limited_infection, True, size, shape, seed,
+                       max_infections=max(1, size // 10))
+
+def bench_weighted_infection_graph(size, shape, seed):
+    # unit weights, so the target matches limited_infection[graph]'s headcount
+    return _infections(weighted_infection, True, size, shape, seed,
+                       max_weight=max(1, size // 10), weights=[1] * size)
+
+BENCHMARKS = [
+    ('randomize', bench_randomize, True),
+    ('update_user_relationships', bench_update_user_relationships, True),
+    ('randomize_graph', bench_randomize_graph, False),
+    ('total_infection', bench_total_infection, True),
+    ('total_infection[graph]', bench_total_infection_graph, False),
+    ('limited_infection', bench_limited_infection, True),
+    ('limited_infection[graph]', bench_limited_infection_graph, False),
+    ('weighted_infection[graph]', bench_weighted_infection_graph, False),
+]
+
+
+def _measure(setup, size, shape, seed):
+    """Run every call setup yields, timing only the calls themselves"""
+    seconds = 0.0
+    calls = 0
+    gc.collect()
+    objects = len(gc.get_objects())
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for function, args, kwargs in setup(size, shape, seed):
+        if not calls:
+            # setup is done; measure from here
+            gc.collect()
+            objects = len(gc.get_objects())
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        function(*args, **kwargs)
+        seconds += time.time() - start
+        calls += 1
+    return {
+        'seconds': seconds,
+        'calls': calls,
+        'users_per_second': size * calls / seconds if seconds else None,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_rss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+        'new_objects': len(gc.get_objects()) - objects,
+    }
+
+def measure(setup, size, shape, seed):
+    """Run _measure() in a forked child so its memory use is its own"""
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        try:
+            result = _measure(setup, size, shape, seed)
+        except Exception as e:
+            result = {'error': repr(e)}
+        with os.fdopen(write_end, 'wb') as f:
+            json.dump(result, f)
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end, 'rb') as f:
+        result = json.load(f)
+    os.waitpid(pid, 0)
+    return result
+
+def run(sizes, shapes, names=None, max_plain=1000000, seed=0, log=sys.stderr):
+    """Return a list of result dicts, one per benchmark, size and shape"""
+    results = []
+    for size in sizes:
+        for shape in shapes:
+            for name, setup, plain in BENCHMARKS:
+                if names and name not in names:
+                    continue
+                if plain and size > max_plain:
+                    continue
+                result = dict(benchmark=name, size=size, shape=shape)
+                result.update(measure(setup, size, shape, seed))
+                results.append(result)
+                if log:
+                    log.write('{benchmark:28} {size:>9} {shape:13} {}\n'.format(
+                        result.get('error') or '{:.4f}s'.format(result['seconds']), **result))
+    return results
+
+def compare(results, baseline, tolerance=0.2):
+    """Return (result, baseline result, ratio) for every result slower than baseline
+
+    A result is slower if its time exceeds the baseline's by more than tolerance,
+    as a fraction of the baseline.
+    """
+    key = lambda r: (r['benchmark'], r['size'], r['shape'])
+    before = dict((key(r), r) for r in baseline if 'seconds' in r)
+    slower = []
+    for result in results:
+        old = before.get(key(result))
+        if old is None or 'seconds' not in result or not old['seconds']:
+            continue
+        ratio = result['seconds'] / old['seconds']
+        if ratio > 1 + tolerance:
+            slower.append((result, old, ratio))
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma-separated population sizes (default %(default)s)')
+    parser.add_argument('--shapes', default=','.join(sorted(SHAPES)),
+                        help='comma-separated shapes from: ' + ', '.join(sorted(SHAPES)))
+    parser.add_argument('--only', default='',
+                        help='comma-separated benchmark names to run (default all)')
+    parser.add_argument('--max-plain', type=int, default=1000000,
+                        help='largest size to run User-object benchmarks at')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    sizes = [int(float(size)) for size in args.sizes.split(',')]
+    shapes = args.shapes.split(',')
+    for shape in shapes:
+        if shape not in SHAPES:
+            parser.error('unknown shape {}'.format(shape))
+    names = set(filter(None, args.only.split(',')))
+
+    results = run(sizes, shapes, names, args.max_plain, args.seed)
+    with open(args.output, 'wb') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, 'rb') as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for result, old, ratio in slower:
+            sys.stderr.write('SLOWER {benchmark} {size} {shape}: {:.4f}s -> {:.4f}s ({:.0%})\n'.format(
+                old['seconds'], result['seconds'], ratio - 1, **result))
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
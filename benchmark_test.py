@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for the benchmark harness"""
+
+import unittest
+
+from benchmark import compare, run
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test_run(self):
+        results = run([200], ['default'], set(['randomize_graph', 'limited_infection']),
+                      log=None)
+        self.assertEqual(['randomize_graph', 'limited_infection'],
+                         [r['benchmark'] for r in results])
+        for result in results:
+            self.assertNotIn('error', result)
+            self.assertGreater(result['calls'], 0)
+            self.assertGreater(result['peak_rss_kb'], 0)
+
+    def test_max_plain(self):
+        results = run([200], ['default'], set(['randomize', 'randomize_graph']),
+                      max_plain=100, log=None)
+        self.assertEqual(['randomize_graph'], [r['benchmark'] for r in results])
+
+    def test_compare(self):
+        baseline = [dict(benchmark='a', size=1, shape='s', seconds=1.0),
+                    dict(benchmark='b', size=1, shape='s', seconds=1.0)]
+        results = [dict(benchmark='a', size=1, shape='s', seconds=1.1),
+                   dict(benchmark='b', size=1, shape='s', seconds=1.5),
+                   dict(benchmark='c', size=1, shape='s', seconds=9.0)]
+        slower = compare(results, baseline, tolerance=0.2)
+        self.assertEqual([('b', 1.5)], [(r['benchmark'], ratio) for r, old, ratio in slower])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Decide feature membership by hashing component labels, with nothing stored
+
+Infections only need whole components to agree. So rather than keep a set of
+infected users per feature, a user can have a feature exactly when the hash of
+(the feature's salt, their component's label) falls in the lowest rate of
+BUCKETS buckets. in_rollout() answers that from the label alone, anywhere the
+labels are known: a snapshot's or a lookup file's readers, say. Raising the
+rate only ever adds components, so every ramp stage contains the one before.
+
+Labels are those of a ComponentIndex, and two places agree on membership only
+if they agree on labels; a ComponentIndex built from scratch labels each
+component with its smallest id, but merges after that keep the label of the
+bigger side.
+
+ComponentBuckets puts this over a Population's components, for single and
+batch lookups and to say what share of users a rate actually reaches, which
+differs from the rate since components differ in size.
+"""
+
+
+from array import array
+from bisect import bisect_left
+import hashlib
+import struct
+
+from graph import ID_TYPE
+
+
+BUCKETS = 10000     # rates resolve to 0.01%
+_UNPACK = struct.Struct('<Q').unpack_from
+
+
+def bucket(salt, label):
+    """Return the bucket, 0 to BUCKETS - 1, of component label under salt"""
+    return _UNPACK(hashlib.md5('{}:{}'.format(salt, label)).digest())[0] % BUCKETS
+
+def threshold(rate):
+    """Return the number of buckets a rate, a fraction from 0 to 1, lets in"""
+    return int(round(min(max(rate, 0.0), 1.0) * BUCKETS))
+
+def in_rollout(salt, label, rate):
+    """Return True if component label has the feature salted salt at rate"""
+    return bucket(salt, label) < threshold(rate)
+
+
+class ComponentBuckets(object):
+    """Hash-bucketed membership for the components of a ComponentIndex
+
+    Buckets are worked out once per component label and remembered, so batch
+    lookups cost a hash per component rather than per user. coverage() and
+    rate_for() use a histogram of users per bucket, rebuilt on the next call
+    after the graph changes.
+    """
+
+    def __init__(self, index, salt):
+        self.index = index
+        self.salt = salt
+        self._buckets = {}
+        self._cumulative = None
+        index.graph.listeners.append(self)
+
+    def _label_bucket(self, label):
+        found = self._buckets.get(label)
+        if found is None:
+            found = self._buckets[label] = bucket(self.salt, label)
+        return found
+
+    def bucket_of(self, uid):
+        """Return the bucket of uid's component"""
+        return self._label_bucket(self.index.label(uid))
+
+    def has(self, uid, rate):
+        """Return True if uid has the feature at rate"""
+        return self.bucket_of(uid) < threshold(rate)
+
+    def has_many(self, uids, rate):
+        """Return a bytearray with 1 for each of uids that has the feature at rate"""
+        cutoff = threshold(rate)
+        labels = self.index.labels
+        buckets = self._buckets
+        salt = self.salt
+        found = bytearray(len(uids))
+        for i, uid in enumerate(uids):
+            label = labels[uid]
+            b = buckets.get(label)
+            if b is None:
+                b = buckets[label] = bucket(salt, label)
+            if b < cutoff:
+                found[i] = 1
+        return found
+
+    def labels(self, rate):
+        """Return an array of the labels of the components in at rate"""
+        cutoff = threshold(rate)
+        return array(ID_TYPE, [label for label, size in self.index.sizes()
+                               if self._label_bucket(label) < cutoff])
+
+    def users(self, rate):
+        """Return an array of the ids with the feature at rate"""
+        return self.index.component_members(self.labels(rate))
+
+    def _histogram(self):
+        # users with the feature at each threshold: _cumulative[t] for t buckets
+        if self._cumulative is None:
+            per_bucket = array('l', [0]) * BUCKETS
+            for label, size in self.index.sizes():
+                per_bucket[self._label_bucket(label)] += size
+            cumulative = array('l', [0]) * (BUCKETS + 1)
+            for b in xrange(BUCKETS):
+                cumulative[b + 1] = cumulative[b] + per_bucket[b]
+            self._cumulative = cumulative
+        return self._cumulative
+
+    def coverage(self, rate):
+        """Return the fraction of users who have the feature at rate"""
+        cumulative = self._histogram()
+        if not cumulative[BUCKETS]:
+            return 0.0
+        return float(cumulative[threshold(rate)]) / cumulative[BUCKETS]
+
+    def rate_for(self, fraction):
+        """Return the lowest rate at which at least fraction of users have the feature"""
+        cumulative = self._histogram()
+        wanted = fraction * cumulative[BUCKETS]
+        return float(min(bisect_left(cumulative, wanted), BUCKETS)) / BUCKETS
+
+    def users_added(self, first, count):
+        self._cumulative = None
+
+    def edge_added(self, coach, student):
+        self._cumulative = None
+
+    def edges_added(self, coaches, students):
+        self._cumulative = None
+
+    def edge_removed(self, coach, student):
+        self._cumulative = None
+
+    def edges_removed(self, coaches, students):
+        self._cumulative = None
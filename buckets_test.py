@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for hash-bucketed component membership"""
+
+import unittest
+
+from buckets import BUCKETS, ComponentBuckets, bucket, in_rollout, threshold
+from components import ComponentIndex
+from graph import Graph
+from population import Population
+from user import User
+
+
+class BucketTestCase(unittest.TestCase):
+    def test_bucket(self):
+        self.assertEqual(bucket('beta', 7), bucket('beta', 7))
+        self.assertTrue(0 <= bucket('beta', 7) < BUCKETS)
+        spread = set(bucket('beta', label) for label in range(1000))
+        self.assertGreater(len(spread), 900)
+        self.assertNotEqual([bucket('beta', label) for label in range(10)],
+                            [bucket('gamma', label) for label in range(10)])
+
+    def test_threshold(self):
+        self.assertEqual(0, threshold(0))
+        self.assertEqual(BUCKETS, threshold(1.0))
+        self.assertEqual(BUCKETS // 4, threshold(0.25))
+        self.assertEqual(BUCKETS, threshold(2))
+
+    def test_in_rollout(self):
+        """Every label in at a rate is in at any higher rate"""
+        for label in range(200):
+            self.assertFalse(in_rollout('beta', label, 0))
+            self.assertTrue(in_rollout('beta', label, 1.0))
+            was = False
+            for rate in (0.01, 0.05, 0.25, 0.5, 1.0):
+                now = in_rollout('beta', label, rate)
+                self.assertTrue(now or not was)
+                was = now
+
+
+class ComponentBucketsTestCase(unittest.TestCase):
+    def setUp(self):
+        # 500 pairs and 200 singletons
+        self.graph = Graph(1200)
+        self.graph.add_edges((2 * i, 2 * i + 1) for i in range(500))
+        self.index = ComponentIndex(self.graph)
+        self.buckets = ComponentBuckets(self.index, 'beta')
+
+    def test_whole_components(self):
+        for rate in (0.1, 0.5):
+            has = self.buckets.has_many(range(1000), rate)
+            for i in range(500):
+                self.assertEqual(has[2 * i], has[2 * i + 1])
+            self.assertEqual([self.buckets.has(uid, rate) for uid in range(1000)],
+                             [bool(b) for b in has])
+
+    def test_stateless(self):
+        """Membership agrees with in_rollout() on the label alone"""
+        for uid in range(0, 1200, 7):
+            self.assertEqual(in_rollout('beta', self.index.label(uid), 0.3),
+                             self.buckets.has(uid, 0.3))
+
+    def test_users(self):
+        small, big = set(self.buckets.users(0.2)), set(self.buckets.users(0.6))
+        self.assertLess(small, big)
+        self.assertEqual(set(self.index.component_members(list(big))), big)
+        has = self.buckets.has_many(range(1200), 0.6)
+        self.assertEqual(big, set(uid for uid in range(1200) if has[uid]))
+
+    def test_coverage(self):
+        self.assertEqual(0.0, self.buckets.coverage(0))
+        self.assertEqual(1.0, self.buckets.coverage(1.0))
+        for rate in (0.05, 0.25, 0.5):
+            coverage = self.buckets.coverage(rate)
+            self.assertEqual(len(self.buckets.users(rate)) / 1200.0, coverage)
+            self.assertAlmostEqual(rate, coverage, delta=0.1)
+        rate = self.buckets.rate_for(0.3)
+        self.assertGreaterEqual(self.buckets.coverage(rate), 0.3)
+        self.assertLess(self.buckets.coverage(rate - 1.0 / BUCKETS), 0.3)
+
+    def test_follows_graph(self):
+        before = self.buckets.coverage(1.0)
+        self.graph.add_edges((1000 + i, 1100 + i) for i in range(100))
+        self.assertEqual(1.0, self.buckets.coverage(1.0))
+        self.graph.add_users(100)
+        self.assertEqual(before, self.buckets.coverage(1.0))
+        self.assertEqual(len(self.buckets.users(0.5)) / 1300.0, self.buckets.coverage(0.5))
+
+
+class PopulationBucketsTestCase(unittest.TestCase):
+    def test_graph(self):
+        g = Graph(10)
+        g.add_edges([(0, 1), (1, 2)])
+        p = Population(graph=g)
+        self.assertIs(p.buckets('beta'), p.buckets('beta'))
+        buckets = p.buckets('beta')
+        self.assertEqual(buckets.has(0, 0.5), buckets.has(2, 0.5))
+        self.assertEqual(0, g.features.count('beta'))
+
+    def test_plain_users(self):
+        users = [User() for i in range(3)]
+        users[0].add_student(users[1])
+        p = Population(users)
+        buckets = p.buckets('beta')
+        ids = [p.id_of(u) for u in users]
+        self.assertEqual(buckets.bucket_of(ids[0]), buckets.bucket_of(ids[1]))
+        self.assertEqual(set(ids), set(buckets.users(1.0)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Implement GraphBuilder, for building one Graph from many threads at once
+
+Every edge added to a Graph rebuilds or patches its arrays and tells its
+listeners, so it can't take edges from several threads at once, and doing it
+one edge at a time is slow anyway. A GraphBuilder hands out user ids in blocks
+and collects edges in a buffer per thread, so ingest threads never wait on one
+another except to reserve a block. build() merges the buffers into a Graph
+with a single rebuild.
+"""
+
+
+from array import array
+import threading
+
+from graph import Graph, ID_TYPE
+
+
+BLOCK_SIZE = 4096   # ids a thread reserves at a time through new_user()
+
+
+class _Buffer(object):
+    """The edges and unused reserved ids of one thread"""
+    __slots__ = ('coaches', 'students', 'next_id', 'end_id')
+
+    def __init__(self):
+        self.coaches = array(ID_TYPE)
+        self.students = array(ID_TYPE)
+        self.next_id = self.end_id = 0
+
+
+class GraphBuilder(object):
+    """Collect users and edges from any number of threads, then build() a Graph
+
+    Ids come from reserve(), which takes a lock only once per block, or from
+    new_user(), which carves single ids out of a block kept per thread. Edges
+    go into the calling thread's own buffer without any lock at all. Edges may
+    also name ids that were never reserved; the built graph is made big enough
+    to hold them.
+
+    Ids are handed out from first_id upwards and keep counting across builds,
+    so passing the previous result to build() extends it. To add to an
+    existing Graph, start at first_id=len(graph).
+    """
+
+    def __init__(self, first_id=0, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._buffers = []
+        self._reserved = first_id   # the next id to hand out
+        self._size = first_id       # one past the highest id reserve() gave out
+
+    def _buffer(self):
+        buf = getattr(self._local, 'buffer', None)
+        if buf is None:
+            buf = self._local.buffer = _Buffer()
+            with self._lock:
+                self._buffers.append(buf)
+        return buf
+
+    def _reserve(self, count):
+        with self._lock:
+            first = self._reserved
+            self._reserved += count
+        return first
+
+    def reserve(self, count):
+        """Reserve count consecutive new user ids and return the first of them"""
+        first = self._reserve(count)
+        with self._lock:
+            self._size = max(self._size, first + count)
+        return first
+
+    def new_user(self):
+        """Return a new user id from this thread's current block
+
+        Ids left over in a block when build() runs are never handed out, and
+        don't become users unless a later id does.
+        """
+        buf = self._buffer()
+        if buf.next_id == buf.end_id:
+            buf.next_id = self._reserve(self.block_size)
+            buf.end_id = buf.next_id + self.block_size
+        uid = buf.next_id
+        buf.next_id += 1
+        return uid
+
+    def add_edge(self, coach, student):
+        """Record that coach coaches student"""
+        buf = self._buffer()
+        buf.coaches.append(coach)
+        buf.students.append(student)
+
+    def add_edges(self, pairs):
+        """Record every (coach, student) pair in pairs"""
+        buf = self._buffer()
+        coaches, students = buf.coaches, buf.students
+        for coach, student in pairs:
+            coaches.append(coach)
+            students.append(student)
+
+    def add_edge_arrays(self, coaches, students):
+        """Like add_edges(), but for parallel sequences of coach and student ids"""
+        if len(coaches) != len(students):
+            raise ValueError, "coaches and students must be the same length"
+        buf = self._buffer()
+        buf.coaches.extend(coaches)
+        buf.students.extend(students)
+
+    def build(self, graph=None):
+        """Return a Graph holding every user and edge added so far, and start afresh
+
+        With graph given, everything added here is added to it instead. Call
+        this once the adding threads are done; edges they add while it runs
+        may land in either build.
+        """
+        with self._lock:
+            buffers, self._buffers = self._buffers, []
+            self._local = threading.local()
+            size = self._size
+        coaches = array(ID_TYPE)
+        students = array(ID_TYPE)
+        for buf in buffers:
+            if buf.end_id:
+                size = max(size, buf.next_id)
+            coaches.extend(buf.coaches)
+            students.extend(buf.students)
+        if coaches:
+            size = max(size, max(coaches) + 1, max(students) + 1)
+        if graph is None:
+            graph = Graph(size)
+        elif size > len(graph):
+            graph.add_users(size - len(graph))
+        graph.add_edge_arrays(coaches, students)
+        return graph
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for GraphBuilder"""
+
+import threading
+import unittest
+
+from builder import GraphBuilder
+from components import ComponentIndex
+from graph import Graph
+
+
+class GraphBuilderTestCase(unittest.TestCase):
+    def test_build(self):
+        builder = GraphBuilder()
+        first = builder.reserve(5)
+        self.assertEqual(0, first)
+        builder.add_edge(0, 1)
+        builder.add_edges([(0, 2), (3, 4)])
+        builder.add_edge_arrays([4], [1])
+        g = builder.build()
+        self.assertEqual(5, len(g))
+        self.assertEqual(4, g.E)
+        self.assertEqual([1, 2], sorted(g.students_of(0)))
+        self.assertEqual([0, 4], sorted(g.coaches_of(1)))
+
+    def test_unreserved_ids_grow_graph(self):
+        builder = GraphBuilder()
+        builder.add_edge(7, 2)
+        self.assertEqual(8, len(builder.build()))
+
+    def test_mismatched_arrays(self):
+        with self.assertRaises(ValueError):
+            GraphBuilder().add_edge_arrays([1, 2], [3])
+
+    def test_new_user_blocks(self):
+        builder = GraphBuilder(block_size=3)
+        self.assertEqual([0, 1, 2, 3], [builder.new_user() for i in range(4)])
+        self.assertEqual(6, builder.reserve(1))
+
+    def test_extend_existing_graph(self):
+        g = Graph(3)
+        g.add_edge(0, 1)
+        index = ComponentIndex(g)
+        builder = GraphBuilder(first_id=len(g))
+        uid = builder.new_user()
+        self.assertEqual(3, uid)
+        builder.add_edge(uid, 1)
+        builder.add_edge(2, uid)
+        self.assertIs(g, builder.build(g))
+        self.assertEqual(len(g), index.size(0))
+        # the builder starts afresh, and later ids don't collide
+        self.assertEqual(3, g.E)
+        builder.add_edge(builder.reserve(1), 0)
+        builder.build(g)
+        self.assertEqual(4, g.E)
+
+    def test_threads(self):
+        """Ids stay unique and no edge is lost with many threads adding at once"""
+        builder = GraphBuilder(block_size=16)
+        ids = []
+
+        def ingest():
+            mine = [builder.new_user() for i in range(500)]
+            builder.add_edges(zip(mine, mine[1:]))
+            ids.extend(mine)
+
+        threads = [threading.Thread(target=ingest) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(ids), len(set(ids)))
+        g = builder.build()
+        self.assertEqual(8 * 499, g.E)
+        index = ComponentIndex(g)
+        self.assertEqual(8, len(set(index.label(uid) for uid in ids)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Implement connected-component bookkeeping over a Graph
+
+Infections never cross a component boundary, so once every user carries a
+component label, "who gets infected if we start at X?" is a lookup instead of
+a traversal. ComponentIndex labels the graph in one pass and then listens to
+the Graph for new users and edges, merging components as they join, and for
+removed edges, splitting them when they come apart. UnionFind is the lighter
+alternative when only component ids and sizes are needed while edges stream
+in; it can't split, so it rebuilds itself after edges are removed.
+"""
+
+
+from array import array
+from itertools import imap, izip
+
+from graph import ID_TYPE, OFFSET_TYPE, to_array
+
+
+WEIGHT_BLOCK = 4096     # members summed at a time by ComponentIndex.weight()
+
+
+class ComponentIndex(object):
+    """Map every user of a Graph to a component label and keep member lists
+
+    A label is the id of one member of the component. Singleton components
+    are labelled with their only member and keep no member list at all, which
+    keeps the index near one int per user on sparse graphs.
+
+    An index can also be rebuilt without a traversal from the arrays groups()
+    returns; snapshot.py stores those so a reloaded population can map them.
+
+    When an edge is removed, a search runs out from both its ends by turns and
+    stops as soon as they meet, so an edge whose ends are still connected costs
+    little. Otherwise the side whose search ran out first, usually the smaller,
+    becomes a new component under its smallest id, unless it holds the old
+    label: labels name a member, so then it keeps the label and the other side
+    is relabelled instead, at the cost of walking that side. Member lists keep
+    the ids that left until someone next asks for them. A bulk removal that breaks a
+    component apart regroups just that component.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.labels = array(ID_TYPE, [-1]) * len(graph)
+        self.count = 0
+        self._members = {}
+        self._stale = set()     # labels whose member lists may hold ids that left
+        self._order = self._starts = self._slots = None
+        labels = self.labels
+        for root in xrange(len(graph)):
+            if labels[root] != -1:
+                continue
+            self.count += 1
+            labels[root] = root
+            found = array(ID_TYPE, [root])
+            i = 0
+            while i < len(found):
+                for v in graph.neighbors(found[i]):
+                    if labels[v] == -1:
+                        labels[v] = root
+                        found.append(v)
+                i += 1
+            if len(found) > 1:
+                self._members[root] = found
+        graph.listeners.append(self)
+
+    @classmethod
+    def from_groups(cls, graph, labels, order, starts, slots, count=None):
+        """Return an index over graph from the arrays of an earlier groups() call
+
+        count, the number of components, is worked out from labels if not given.
+        """
+        index = cls.__new__(cls)
+        index.graph = graph
+        index.labels = labels
+        if count is None:
+            count = sum(1 for uid, label in enumerate(labels) if uid == label)
+        index.count = count
+        index._members = {}
+        index._stale = set()
+        index._order, index._starts, index._slots = order, starts, slots
+        graph.listeners.append(index)
+        return index
+
+    def groups(self):
+        """Return (labels, order, starts, slots) arrays describing every component
+
+        order lists the members of each non-singleton component back to back;
+        component k spans order[starts[k]:starts[k + 1]], and slots[label] is k
+        for its label and -1 for every other id.
+        """
+        order = array(ID_TYPE)
+        starts = array(OFFSET_TYPE, [0])
+        slots = array(ID_TYPE, [-1]) * len(self.labels)
+        for label, size in self.sizes():
+            if size > 1:
+                slots[label] = len(starts) - 1
+                order.extend(to_array(ID_TYPE, self._group(label)))
+                starts.append(len(order))
+        return self.labels, order, starts, slots
+
+    def _slot(self, label):
+        # position of label's component in the groups we were built from, or -1
+        if self._slots is None or label >= len(self._slots):
+            return -1
+        return self._slots[label]
+
+    def _group(self, label):
+        # members of the component labelled label, or None for a singleton
+        members = self._members.get(label)
+        if members is None:
+            slot = self._slot(label)
+            if slot >= 0:
+                members = self._order[self._starts[slot]:self._starts[slot + 1]]
+        if label in self._stale:
+            self._stale.discard(label)
+            if members is not None:
+                labels = self.labels
+                members = array(ID_TYPE, [uid for uid in members if labels[uid] == label])
+                self._members[label] = members
+        return members
+
+    def _span(self, label):
+        # (sequence, start, stop) bounding label's members without copying any,
+        # or None for a singleton; only stale labels have their members gathered
+        members = self._members.get(label) if label not in self._stale else self._group(label)
+        if members is not None:
+            return members, 0, len(members)
+        slot = self._slot(label)
+        if slot >= 0:
+            return self._order, self._starts[slot], self._starts[slot + 1]
+        return None
+
+    def _group_size(self, label):
+        span = self._span(label)
+        return 1 if span is None else span[2] - span[1]
+
+    def __len__(self):
+        return self.count
+
+    def label(self, uid):
+        """Return the component label of uid"""
+        return self.labels[uid]
+
+    def size(self, uid):
+        """Return the number of users in uid's component"""
+        return self._group_size(self.labels[uid])
+
+    def members(self, uid):
+        """Return a fresh array of the ids in uid's component"""
+        label = self.labels[uid]
+        members = self._group(label)
+        return array(ID_TYPE, [label]) if members is None else array(ID_TYPE, members)
+
+    def component_members(self, uids):
+        """Return a fresh array of the ids in any of the components of uids"""
+        found = array(ID_TYPE)
+        labels = set()
+        for uid in uids:
+            label = self.labels[uid]
+            if label not in labels:
+                labels.add(label)
+                members = self._group(label)
+                if members is None:
+                    found.append(label)
+                else:
+                    found.extend(to_array(ID_TYPE, members))
+        return found
+
+    def weight(self, uid, weights, limit=None):
+        """Return the total of weights, indexed by id, over uid's component
+
+        Members are summed a block at a time, and with a limit the sum stops
+        as soon as it passes limit, so asking whether a big component fits in
+        a budget needn't visit all of it.
+        """
+        label = self.labels[uid]
+        span = self._span(label)
+        if span is None:
+            return weights[label]
+        members, first, stop = span
+        weigh = weights.__getitem__
+        total = 0
+        for start in xrange(first, stop, WEIGHT_BLOCK):
+            total += sum(imap(weigh, members[start:min(start + WEIGHT_BLOCK, stop)]))
+            if limit is not None and total > limit:
+                break
+        return total
+
+    def sizes(self):
+        """Yield (label, size) for every component"""
+        for uid, label in enumerate(self.labels):
+            if uid == label:
+                yield label, self._group_size(label)
+
+    def users_added(self, first, count):
+        self.labels = to_array(ID_TYPE, self.labels)
+        self.labels.extend(array(ID_TYPE, xrange(first, first + count)))
+        self.count += count
+
+    def edge_added(self, coach, student):
+        self._merge(coach, student)
+
+    def edges_added(self, coaches, students):
+        merge = self._merge
+        for coach, student in izip(coaches, students):
+            merge(coach, student)
+
+    def _merge(self, a, b):
+        # Relabel the smaller side into the larger, so no user is relabelled
+        # more than log2(N) times however the edges arrive.
+        labels, members = self.labels, self._members
+        big, small = labels[a], labels[b]
+        if big == small:
+            return
+        if self._group_size(big) < self._group_size(small):
+            big, small = small, big
+        big_members = self._group(big)
+        small_members = self._group(small)
+        small_members = array(ID_TYPE, [small]) if small_members is None else small_members
+        big_members = array(ID_TYPE, [big]) if big_members is None else big_members
+        for uid in small_members:
+            labels[uid] = big
+        big_members = to_array(ID_TYPE, big_members)
+        big_members.extend(to_array(ID_TYPE, small_members))
+        members[big] = big_members
+        members.pop(small, None)
+        self.count -= 1
+
+    def edge_removed(self, coach, student):
+        apart = self._search(coach, student)
+        if apart is None:
+            return
+        labels, members = self.labels, self._members
+        old = labels[coach]
+        if old in apart:
+            # the side leaving holds the label; move the other side out instead
+            leaving = set(apart)
+            stay = apart
+            apart = array(ID_TYPE, [uid for uid in self._group(old) if uid not in leaving])
+            members[old] = stay
+        else:
+            self._stale.add(old)
+        new = min(apart)
+        for uid in apart:
+            labels[uid] = new
+        members[new] = apart
+        self.count += 1
+
+    def edges_removed(self, coaches, students):
+        # Splitting edge by edge goes wrong once a component breaks in three,
+        # so only use the search to skip edges whose ends are still connected.
+        labels = self.labels
+        broken = set()
+        for coach, student in izip(coaches, students):
+            if labels[coach] not in broken and self._search(coach, student) is not None:
+                broken.add(labels[coach])
+        for label in broken:
+            self._regroup(label)
+
+    def _search(self, a, b):
+        """Search out from a and b by turns; return None if they meet
+
+        Otherwise return the ids reached from whichever side ran out of users
+        to visit first: the whole of its component.
+        """
+        if a == b:
+            return None
+        neighbors = self.graph.neighbors
+        side = {a: 0, b: 1}
+        found = (array(ID_TYPE, [a]), array(ID_TYPE, [b]))
+        next_up = [0, 0]
+        while True:
+            # widen whichever side has seen less so far
+            turn = 0 if len(found[0]) <= len(found[1]) else 1
+            ours = found[turn]
+            i = next_up[turn]
+            if i == len(ours):
+                return ours
+            next_up[turn] = i + 1
+            for v in neighbors(ours[i]):
+                seen = side.get(v)
+                if seen is None:
+                    side[v] = turn
+                    ours.append(v)
+                elif seen != turn:
+                    return None
+
+    def _regroup(self, label):
+        """Label each piece of the component labelled label afresh"""
+        labels, members = self.labels, self._members
+        group = self._group(label)
+        pieces = set()
+        for root in group:
+            if root in pieces:
+                continue
+            piece = self.graph.component((root,))
+            pieces.update(piece)
+            new = label if label in piece else min(piece)
+            for uid in piece:
+                labels[uid] = new
+            members[new] = piece
+            if new != label:
+                self.count += 1
+
+
+class UnionFind(object):
+    """Disjoint sets over the users of a Graph, kept in step with its edges
+
+    Cheaper to maintain than ComponentIndex under a heavy stream of new edges,
+    since a union touches two entries instead of relabelling members, but it
+    only answers which component and how big, not who is in it. Removing an
+    edge can't be undone by a union, so after one the sets are rebuilt from the
+    graph on the next question.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self._build()
+        graph.listeners.append(self)
+
+    def _build(self):
+        graph = self.graph
+        self.parent = array(ID_TYPE, xrange(len(graph)))
+        self._size = array(ID_TYPE, [1]) * len(graph)
+        self.count = len(graph)
+        self._dirty = False
+        union = self.union
+        for coach in xrange(len(graph)):
+            for student in graph.students_of(coach):
+                union(coach, student)
+
+    def __len__(self):
+        if self._dirty:
+            self._build()
+        return self.count
+
+    def find(self, uid):
+        """Return the root id of uid's component"""
+        if self._dirty:
+            self._build()
+        parent = self.parent
+        while parent[uid] != uid:
+            # path halving: point every other node at its grandparent
+            parent[uid] = parent[parent[uid]]
+            uid = parent[uid]
+        return uid
+
+    def size(self, uid):
+        """Return the number of users in uid's component"""
+        root = self.find(uid)   # may rebuild, replacing _size
+        return self._size[root]
+
+    def union(self, a, b):
+        """Join the components of a and b; return False if they were already one"""
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return False
+        size = self._size
+        if size[a] < size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        size[a] += size[b]
+        self.count -= 1
+        return True
+
+    def users_added(self, first, count):
+        if self._dirty:
+            return  # the rebuild will see them
+        self.parent.extend(array(ID_TYPE, xrange(first, first + count)))
+        self._size.extend(array(ID_TYPE, [1]) * count)
+        self.count += count
+
+    def edge_added(self, coach, student):
+        self.union(coach, student)
+
+    def edges_added(self, coaches, students):
+        union = self.union
+        for coach, student in izip(coaches, students):
+            union(coach, student)
+
+    def edge_removed(self, coach, student):
+        self._dirty = True
+
+    def edges_removed(self, coaches, students):
+        self._dirty = True
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for ComponentIndex"""
+
+import random
+import unittest
+
+from components import ComponentIndex, UnionFind
+from graph import Graph
+from infection import total_infection
+from population import Population
+from user import User
+
+
+class ComponentIndexTestCase(unittest.TestCase):
+    def test_labelling(self):
+        g = Graph(6)
+        g.add_edges([(0, 1), (2, 1), (3, 4)])
+        index = ComponentIndex(g)
+        self.assertEqual(3, len(index))
+        self.assertEqual(index.label(0), index.label(2))
+        self.assertNotEqual(index.label(0), index.label(3))
+        self.assertEqual(3, index.size(1))
+        self.assertEqual(1, index.size(5))
+        self.assertEqual(set([3, 4]), set(index.members(4)))
+        self.assertEqual([5], list(index.members(5)))
+        self.assertEqual(set([0, 1, 2, 5]), set(index.component_members([5, 0, 1])))
+        self.assertEqual([3, 2, 1], sorted([size for label, size in index.sizes()], reverse=True))
+
+    def test_follows_new_users_and_edges(self):
+        g = Graph(3)
+        index = ComponentIndex(g)
+        g.add_edge(0, 1)
+        self.assertEqual(2, len(index))
+        new = g.add_users(2)
+        self.assertEqual(4, len(index))
+        self.assertEqual(1, index.size(new))
+        g.add_edges([(new, new + 1), (new + 1, 2)])
+        g.add_edge(2, 0)
+        self.assertEqual(1, len(index))
+        self.assertEqual(5, index.size(new))
+        self.assertEqual(set(range(5)), set(index.members(3)))
+        self.assertEqual(1, len(set(index.labels)))
+
+    def test_weight(self):
+        g = Graph(5)
+        g.add_edges([(0, 1), (1, 2)])
+        index = ComponentIndex(g)
+        weights = [1, 2, 3, 4, 0.5]
+        self.assertEqual(6, index.weight(2, weights))
+        self.assertEqual(0.5, index.weight(4, weights))
+        import components
+        old_block = components.WEIGHT_BLOCK
+        components.WEIGHT_BLOCK = 1
+        try:
+            self.assertGreater(index.weight(0, weights, limit=1), 1)
+            self.assertLess(index.weight(0, weights, limit=1), 6)
+            self.assertEqual(6, index.weight(0, weights, limit=6))
+        finally:
+            components.WEIGHT_BLOCK = old_block
+
+    def test_members_are_copies(self):
+        g = Graph(2)
+        g.add_edge(0, 1)
+        index = ComponentIndex(g)
+        index.members(0).append(7)
+        self.assertEqual(2, index.size(0))
+
+
+class EdgeRemovalTestCase(unittest.TestCase):
+    def assertMatchesRebuild(self, index):
+        rebuilt = ComponentIndex(index.graph)
+        self.assertEqual(len(rebuilt), len(index))
+        for uid in range(len(index.graph)):
+            self.assertEqual(rebuilt.size(uid), index.size(uid))
+            self.assertEqual(set(rebuilt.members(uid)), set(index.members(uid)))
+            self.assertIn(index.label(uid), index.members(uid))
+        self.assertEqual(sorted(size for label, size in rebuilt.sizes()),
+                         sorted(size for label, size in index.sizes()))
+
+    def test_still_connected(self):
+        g = Graph(3)
+        g.add_edges([(0, 1), (1, 2), (2, 0)])
+        index = ComponentIndex(g)
+        g.remove_edge(0, 1)
+        self.assertEqual(1, len(index))
+        self.assertEqual(3, index.size(0))
+
+    def test_split(self):
+        # 0 - 1 - 2 - 3, with 0 the label
+        g = Graph(4)
+        g.add_edges([(0, 1), (1, 2), (2, 3)])
+        index = ComponentIndex(g)
+        g.remove_edge(2, 3)
+        self.assertEqual(2, len(index))
+        self.assertEqual(3, index.size(0))
+        self.assertEqual([3], list(index.members(3)))
+        g.remove_edge(0, 1)
+        self.assertEqual(3, len(index))
+        self.assertEqual(set([1, 2]), set(index.members(2)))
+        self.assertMatchesRebuild(index)
+
+    def test_label_leaves(self):
+        """The side that runs out first may be the one holding the label"""
+        g = Graph(6)
+        g.add_edges([(0, 1)] + [(1, student) for student in range(2, 6)])
+        index = ComponentIndex(g)
+        g.remove_edge(0, 1)
+        self.assertEqual(0, index.label(0))
+        self.assertEqual(5, index.size(1))
+        self.assertMatchesRebuild(index)
+
+    def test_bulk_split_in_three(self):
+        g = Graph(6)
+        g.add_edges([(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)])
+        index = ComponentIndex(g)
+        g.remove_edges([(1, 2), (3, 4), (4, 5)])
+        self.assertEqual(4, len(index))
+        self.assertMatchesRebuild(index)
+
+    def test_random(self):
+        """A stream of additions and removals leaves the index as a rebuild would"""
+        rng = random.Random(11)
+        g = Graph(120)
+        g.add_edges((rng.randrange(120), rng.randrange(120)) for i in range(150))
+        index = ComponentIndex(g)
+        uf = UnionFind(g)
+        for step in range(200):
+            coach = rng.randrange(120)
+            students = g.students_of(coach)
+            if students and rng.random() < 0.6:
+                g.remove_edge(coach, rng.choice(list(students)))
+            else:
+                g.add_edge(coach, rng.randrange(120))
+        pairs = [(coach, student) for coach in range(120) for student in g.students_of(coach)]
+        g.remove_edges(rng.sample(pairs, len(pairs) // 3))
+        self.assertMatchesRebuild(index)
+        self.assertEqual(len(index), len(uf))
+        for uid in range(120):
+            self.assertEqual(index.size(uid), uf.size(uid))
+
+    def test_union_find_size_after_removal(self):
+        g = Graph(3)
+        g.add_edges([(0, 1), (1, 2)])
+        uf = UnionFind(g)
+        g.remove_edge(1, 2)
+        self.assertEqual(2, uf.size(0))
+        self.assertEqual(1, uf.size(2))
+        p = Population(graph=g)
+        self.assertEqual(2, p.component_size(g.user(0)))
+        g.remove_edge(0, 1)
+        self.assertEqual(1, p.component_size(g.user(0)))
+        self.assertEqual(1, uf.size(1))
+
+    def test_snapshot_groups(self):
+        """An index made from groups() splits like one built by traversal"""
+        g = Graph(5)
+        g.add_edges([(0, 1), (1, 2), (3, 4)])
+        built = ComponentIndex(g)
+        index = ComponentIndex.from_groups(g, *built.groups())
+        g.remove_edge(1, 2)
+        g.remove_edge(3, 4)
+        self.assertMatchesRebuild(index)
+
+    def test_snapshot_sizes_unsliced(self):
+        """Sizes of an index made from groups() come from bounds, not member copies"""
+        class Unsliced(list):
+            def __getslice__(self, i, j):
+                raise AssertionError, "members were sliced"
+        g = Graph(5)
+        g.add_edges([(0, 1), (1, 2), (3, 4)])
+        labels, order, starts, slots = ComponentIndex(g).groups()
+        index = ComponentIndex.from_groups(g, labels, Unsliced(order), starts, slots)
+        self.assertEqual([3, 3, 3, 2, 2], [index.size(uid) for uid in range(5)])
+        self.assertEqual([(0, 3), (3, 2)], list(index.sizes()))
+
+    def test_plain_users(self):
+        A, B, C = User(), User(), User()
+        B.add_coach(A)
+        C.add_coach(B)
+        p = Population(users=[A, B, C])
+        index = p.components()
+        B.remove_coach(A)
+        self.assertEqual(1, index.size(p.id_of(A)))
+        self.assertEqual(2, p.component_size(C))
+        self.assertEqual(set([B, C]), total_infection(C))
+
+
+class UnionFindTestCase(unittest.TestCase):
+    def test_existing_edges(self):
+        g = Graph(5)
+        g.add_edges([(0, 1), (2, 1), (3, 4)])
+        uf = UnionFind(g)
+        self.assertEqual(2, len(uf))
+        self.assertEqual(uf.find(0), uf.find(2))
+        self.assertNotEqual(uf.find(0), uf.find(4))
+        self.assertEqual(3, uf.size(1))
+        self.assertFalse(uf.union(0, 1))
+        self.assertTrue(uf.union(0, 4))
+        self.assertEqual(5, uf.size(3))
+
+    def test_stays_in_sync_with_component_index(self):
+        """A stream of single and bulk edges leaves both structures agreeing"""
+        rng = random.Random(7)
+        g = Graph(200)
+        uf = UnionFind(g)
+        index = ComponentIndex(g)
+        for i in range(60):
+            g.add_edge(rng.randrange(200), rng.randrange(200))
+        g.add_edges((rng.randrange(200), rng.randrange(200)) for i in range(40))
+        g.add_users(10)
+        g.add_edge(205, 0)
+        self.assertEqual(len(index), len(uf))
+        for uid in range(len(g)):
+            self.assertEqual(index.size(uid), uf.size(uid))
+
+
+class PopulationComponentsTestCase(unittest.TestCase):
+    def test_plain_users(self):
+        A = User(); B = User(); C = User()
+        B.add_coach(A)
+        p = Population(users=[A, B, C])
+        index = p.components()
+        self.assertIs(index, p.components())
+        self.assertEqual(2, index.size(p.id_of(A)))
+        self.assertEqual(set([A, B]), total_infection(A))
+        C.add_coach(B)
+        self.assertEqual(3, index.size(p.id_of(A)))
+        self.assertEqual(set([A, B, C]), total_infection(C))
+
+    def test_newcomers_bring_their_friends(self):
+        A = User(); B = User(); C = User()
+        C.add_coach(B)
+        p = Population(users=[A])
+        p.components()
+        A.add_student(B)
+        self.assertEqual(set([A, B, C]), total_infection(A))
+        self.assertEqual(3, p.components().size(p.id_of(C)))
+
+    def test_union_find_follows_users(self):
+        A = User(); B = User(); C = User()
+        p = Population(users=[A, B, C])
+        self.assertEqual(1, p.component_size(A))
+        uf = p.union_find()
+        B.add_coach(A)
+        A.add_coach(C)
+        self.assertEqual(1, len(uf))
+        self.assertEqual(3, p.component_size(B))
+
+    def test_graph_population(self):
+        g = Graph(4)
+        g.add_edge(0, 1)
+        p = Population(graph=g)
+        self.assertEqual(set([g.user(0), g.user(1)]), total_infection(g.user(1)))
+        g.user(3).add_coach(g.user(1))
+        self.assertEqual(3, p.components().size(3))
+        g.user(2).features.add('A')
+        p = Population(graph=g)
+        self.assertEqual(set([g.user(2)]), total_infection(population=p))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Stream coaching edges between Graphs and edge-list files
+
+Two edge formats are understood:
+
+* text, one "coach_id,student_id" pair per line; blank lines and lines
+  starting with # are skipped
+* binary, fixed-width little-endian 32-bit (coach_id, student_id) pairs with
+  no header, so the file can be memory-mapped as it stands
+
+Features travel in a sidecar text file with one "user_id<TAB>feature" grant
+per line. Users holding any feature are the pre-infected ones.
+
+read_graph() makes two passes over the edges, counting degrees and then
+filling rows in place, so at no point is there a list of tuples or a second
+copy of the edges in memory; peak use stays near the size of the final Graph.
+"""
+
+
+from array import array
+from itertools import izip
+import sys
+
+from graph import Graph, ID_TYPE, OFFSET_TYPE
+
+
+CHUNK_SIZE = 1 << 20    # edges per chunk when streaming
+
+
+def is_binary(path):
+    """Guess the edge format of path from its extension"""
+    return path.endswith('.bin')
+
+def iter_edge_chunks(path, binary=None, chunk_size=CHUNK_SIZE):
+    """Yield (coaches, students) arrays of at most chunk_size edges from path"""
+    if binary is None:
+        binary = is_binary(path)
+    with open(path, 'rb') as f:
+        if binary:
+            while True:
+                pairs = array(ID_TYPE)
+                try:
+                    pairs.fromfile(f, 2 * chunk_size)
+                except EOFError:
+                    pass  # fromfile() keeps the short read at the end
+                if len(pairs) % 2:
+                    raise ValueError, "{} ends in the middle of an edge".format(path)
+                if not pairs:
+                    return
+                if sys.byteorder == 'big':
+                    pairs.byteswap()
+                yield pairs[0::2], pairs[1::2]
+        else:
+            coaches, students = array(ID_TYPE), array(ID_TYPE)
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                try:
+                    coach, student = line.split(',')
+                    coaches.append(int(coach))
+                    students.append(int(student))
+                except ValueError:
+                    raise ValueError, "{}:{}: expected coach_id,student_id".format(path, lineno)
+                if len(coaches) == chunk_size:
+                    yield coaches, students
+                    coaches, students = array(ID_TYPE), array(ID_TYPE)
+            if coaches:
+                yield coaches, students
+
+def read_sidecar(path):
+    """Yield (user_id, feature) grants from a sidecar file"""
+    with open(path, 'rb') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            try:
+                uid, feature = line.split('\t', 1)
+                yield int(uid), feature
+            except ValueError:
+                raise ValueError, "{}:{}: expected user_id<TAB>feature".format(path, lineno)
+
+def read_graph(path, binary=None, sidecar=None, size=None, chunk_size=CHUNK_SIZE):
+    """Return a Graph of the edges in path, plus any features in a sidecar file
+
+    The graph has size users, or one more than the largest id in the edges and
+    sidecar if size is not given.
+    """
+    grants = list(read_sidecar(sidecar)) if sidecar else []
+    n = size or 0
+    for uid, feature in grants:
+        n = max(n, uid + 1)
+
+    # first pass: degrees of every user, in both directions
+    out_degree = array(OFFSET_TYPE, [0]) * (n + 1)
+    in_degree = array(OFFSET_TYPE, [0]) * (n + 1)
+    for coaches, students in iter_edge_chunks(path, binary, chunk_size):
+        if min(min(coaches), min(students)) < 0:
+            raise ValueError, "{} has a negative user id".format(path)
+        top = max(max(coaches), max(students)) + 1
+        if top > n:
+            if size is not None:
+                raise IndexError, "{} has user {} but size is {}".format(path, top - 1, size)
+            out_degree.extend(array(OFFSET_TYPE, [0]) * (top - n))
+            in_degree.extend(array(OFFSET_TYPE, [0]) * (top - n))
+            n = top
+        for coach in coaches:
+            out_degree[coach + 1] += 1
+        for student in students:
+            in_degree[student + 1] += 1
+    for u in xrange(n):
+        out_degree[u + 1] += out_degree[u]
+        in_degree[u + 1] += in_degree[u]
+
+    # second pass: drop each edge into its row
+    targets_out = array(ID_TYPE, [0]) * out_degree[n]
+    targets_in = array(ID_TYPE, [0]) * in_degree[n]
+    fill_out = array(OFFSET_TYPE, out_degree)
+    fill_in = array(OFFSET_TYPE, in_degree)
+    for coaches, students in iter_edge_chunks(path, binary, chunk_size):
+        for coach, student in izip(coaches, students):
+            targets_out[fill_out[coach]] = student
+            fill_out[coach] += 1
+            targets_in[fill_in[student]] = coach
+            fill_in[student] += 1
+    del fill_out, fill_in
+
+    graph = Graph.from_csr(out_degree, targets_out, in_degree, targets_in)
+    for uid, feature in grants:
+        graph.features.grant(feature, (uid,))
+    return graph
+
+def write_graph(graph, path, binary=None, sidecar=None, chunk_size=CHUNK_SIZE):
+    """Write every edge of graph to path, and its features to sidecar if given"""
+    if binary is None:
+        binary = is_binary(path)
+    with open(path, 'wb') as f:
+        chunk = array(ID_TYPE) if binary else []
+        for coach in xrange(len(graph)):
+            for student in graph.students_of(coach):
+                if binary:
+                    chunk.append(coach)
+                    chunk.append(student)
+                else:
+                    chunk.append('{},{}\n'.format(coach, student))
+            if len(chunk) >= chunk_size:
+                _flush(f, chunk, binary)
+                chunk = array(ID_TYPE) if binary else []
+        _flush(f, chunk, binary)
+    if sidecar:
+        with open(sidecar, 'wb') as f:
+            for feature in graph.features:
+                for uid in graph.features.users([feature]):
+                    f.write('{}\t{}\n'.format(uid, feature))
+
+def _flush(f, chunk, binary):
+    if binary:
+        if sys.byteorder == 'big':
+            chunk.byteswap()
+        chunk.tofile(f)
+    else:
+        f.writelines(chunk)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for streaming edge lists in and out of Graphs"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from edgelist import iter_edge_chunks, read_graph, write_graph
+from graph import Graph
+from population import Population
+from user import User
+
+
+class EdgeListTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def graph(self):
+        g = Graph(6)
+        g.add_edges([(0, 1), (0, 2), (3, 2), (4, 0)])
+        g.features.grant('A', [1, 5])
+        g.features.grant('B', [5])
+        return g
+
+    def assertSameGraph(self, a, b):
+        self.assertEqual(len(a), len(b))
+        self.assertEqual(a.E, b.E)
+        for uid in range(len(a)):
+            self.assertEqual(sorted(a.students_of(uid)), sorted(b.students_of(uid)))
+            self.assertEqual(sorted(a.coaches_of(uid)), sorted(b.coaches_of(uid)))
+            self.assertEqual(a.features.features_of(uid), b.features.features_of(uid))
+
+    def test_text_round_trip(self):
+        g = self.graph()
+        write_graph(g, self.path('edges.csv'), sidecar=self.path('features.tsv'))
+        self.assertSameGraph(g, read_graph(self.path('edges.csv'),
+                                           sidecar=self.path('features.tsv')))
+
+    def test_binary_round_trip(self):
+        g = self.graph()
+        write_graph(g, self.path('edges.bin'), sidecar=self.path('features.tsv'))
+        self.assertEqual(8 * g.E, os.path.getsize(self.path('edges.bin')))
+        self.assertSameGraph(g, read_graph(self.path('edges.bin'), chunk_size=3,
+                                           sidecar=self.path('features.tsv')))
+
+    def test_chunks(self):
+        with open(self.path('edges.csv'), 'wb') as f:
+            f.write('# coach,student\n0,1\n\n1,2\n2,3\n')
+        chunks = list(iter_edge_chunks(self.path('edges.csv'), chunk_size=2))
+        self.assertEqual([([0, 1], [1, 2]), ([2], [3])],
+                         [(list(c), list(s)) for c, s in chunks])
+
+    def test_bad_input(self):
+        with open(self.path('edges.csv'), 'wb') as f:
+            f.write('0,1\n1;2\n')
+        with self.assertRaises(ValueError):
+            read_graph(self.path('edges.csv'))
+        with open(self.path('edges.csv'), 'wb') as f:
+            f.write('0,9\n')
+        with self.assertRaises(IndexError):
+            read_graph(self.path('edges.csv'), size=4)
+
+    def test_population_round_trip(self):
+        A = User(); B = User(); C = User()
+        B.add_coach(A)
+        C.features.add('X')
+        Population(users=[A, B, C]).to_edges(self.path('edges.csv'),
+                                             sidecar=self.path('features.tsv'))
+        p = Population.from_edges(self.path('edges.csv'), sidecar=self.path('features.tsv'))
+        self.assertEqual(3, p.N)
+        self.assertEqual(1, p.graph.E)
+        self.assertEqual(1, len(p.infected))
+        self.assertEqual(set(['X']), next(iter(p.infected)).features)
+
+    def test_population_ids_match_id_of(self):
+        A = User(); B = User(); C = User()
+        p = Population(users=[A])
+        p.id_graph()
+        B.add_coach(A)
+        C.add_coach(A)
+        # B keeps its id though a fresh copy of the graph would no longer reach it
+        B.remove_coach(A)
+        p.to_edges(self.path('edges.csv'))
+        with open(self.path('edges.csv')) as f:
+            self.assertEqual('{},{}\n'.format(p.id_of(A), p.id_of(C)), f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Implement FeatureRegistry, packed per-feature bitmaps over integer user ids
+
+A User keeps its features in a set of strings. For a Graph of millions of users
+that is one set per user, and asking "who has F but not G?" means visiting all
+of them. FeatureRegistry gives each feature a bit number and a bitmap with one
+bit per user id instead. Whole-population grants are a single buffer fill, and
+set algebra between features runs over Python longs in C.
+"""
+
+
+from binascii import hexlify, unhexlify
+from collections import MutableSet
+import re
+
+
+_NONZERO = re.compile(b'[^\x00]')
+
+
+def _to_long(bitmap):
+    """Return bitmap as a long whose bit i is bit i of the bitmap"""
+    return long(hexlify(bitmap[::-1]) or '0', 16)
+
+def _from_long(value, nbytes):
+    """Return the low nbytes of value as a little-endian bitmap"""
+    if not nbytes:
+        return bytearray()
+    return bytearray(unhexlify('%0*x' % (nbytes * 2, value)))[::-1]
+
+def count_bits(bitmap):
+    """Return the number of set bits in bitmap"""
+    return bin(_to_long(bitmap)).count('1')
+
+def union_of(bitmaps, nbytes):
+    """Return an nbytes bitmap of the bits set in any of bitmaps"""
+    union = 0
+    for bitmap in bitmaps:
+        union |= _to_long(bitmap)
+    return _from_long(union & ((1 << (nbytes * 8)) - 1), nbytes)
+
+def difference_of(bitmap, mask):
+    """Return a copy of bitmap without the bits set in mask"""
+    return _from_long(_to_long(bitmap) & ~_to_long(mask), len(bitmap))
+
+def ids_in(bitmap):
+    """Yield the id of every set bit in bitmap, in increasing order"""
+    for match in _NONZERO.finditer(bitmap):
+        byte = match.start()
+        bits = bitmap[byte]
+        for bit in xrange(8):
+            if bits >> bit & 1:
+                yield (byte << 3) + bit
+
+
+class FeatureRegistry(object):
+    """Feature bitmaps for users 0..N-1, one bit per user per feature
+
+    Features are numbered in the order they're first seen; bit(feature) gives
+    that number, and masks built from it summarize a user's features.
+
+    Objects in listeners are told which ids actually changed, after the fact,
+    through features_granted(feature, uids) and features_revoked(feature, uids).
+    With no listeners, grants and revokes skip working that out. A listener
+    with a features_revoked_bitmap(feature, bitmap) method is told about
+    revoke_bitmap()'s bulk revokes that way instead, as a bitmap of the ids
+    that changed.
+    """
+
+    def __init__(self, size=0):
+        self.N = size
+        self.listeners = []
+        self._bits = {}
+        self._bitmaps = {}
+
+    def __len__(self):
+        return len(self._bits)
+
+    def __iter__(self):
+        return iter(sorted(self._bits, key=self._bits.get))
+
+    def __contains__(self, feature):
+        return feature in self._bits
+
+    def _nbytes(self):
+        return (self.N + 7) // 8
+
+    def bit(self, feature):
+        """Return the bit number of feature, registering it if it's new"""
+        if feature not in self._bits:
+            self._bits[feature] = len(self._bits)
+            self._bitmaps[feature] = bytearray(self._nbytes())
+        return self._bits[feature]
+
+    def bitmap(self, feature):
+        """Return the live bitmap of feature; bit uid is set if uid has it"""
+        self.bit(feature)
+        return self._bitmaps[feature]
+
+    def resize(self, size):
+        """Make room for users up to size; new users have no features"""
+        self.N = size
+        extra = self._nbytes()
+        for bitmap in self._bitmaps.itervalues():
+            if len(bitmap) < extra:
+                bitmap.extend(bytearray(extra - len(bitmap)))
+
+    def _notify(self, event, feature, uids):
+        if uids:
+            for listener in self.listeners:
+                getattr(listener, event)(feature, uids)
+
+    def grant(self, feature, uids):
+        """Give feature to every id in uids"""
+        bitmap = self.bitmap(feature)
+        if self.listeners:
+            changed = []
+            for uid in uids:
+                if not bitmap[uid >> 3] >> (uid & 7) & 1:
+                    bitmap[uid >> 3] |= 1 << (uid & 7)
+                    changed.append(uid)
+            self._notify('features_granted', feature, changed)
+            return
+        for uid in uids:
+            bitmap[uid >> 3] |= 1 << (uid & 7)
+
+    def revoke(self, feature, uids):
+        """Take feature away from every id in uids"""
+        bitmap = self.bitmap(feature)
+        if self.listeners:
+            changed = []
+            for uid in uids:
+                if bitmap[uid >> 3] >> (uid & 7) & 1:
+                    bitmap[uid >> 3] &= ~(1 << (uid & 7)) & 0xff
+                    changed.append(uid)
+            self._notify('features_revoked', feature, changed)
+            return
+        for uid in uids:
+            bitmap[uid >> 3] &= ~(1 << (uid & 7)) & 0xff
+
+    def revoke_bitmap(self, feature, mask):
+        """Take feature away from every id set in the bitmap mask, in bulk
+
+        Returns a bitmap of the ids that actually lost it.
+        """
+        bitmap = self.bitmap(feature)
+        held = _to_long(bitmap)
+        taken = held & _to_long(mask)
+        changed = _from_long(taken, len(bitmap))
+        if not taken:
+            return changed
+        bitmap[:] = _from_long(held & ~taken, len(bitmap))
+        uids = None
+        for listener in self.listeners:
+            bulk = getattr(listener, 'features_revoked_bitmap', None)
+            if bulk is not None:
+                bulk(feature, changed)
+                continue
+            if uids is None:
+                uids = list(ids_in(changed))
+            listener.features_revoked(feature, uids)
+        return changed
+
+    def grant_components(self, feature, index, uids):
+        """Give feature to everyone in the ComponentIndex components of uids"""
+        self.grant(feature, index.component_members(uids))
+
+    def grant_all(self, feature):
+        """Give feature to every user"""
+        bitmap = self.bitmap(feature)
+        changed = list(self.users(without_features=[feature])) if self.listeners else ()
+        bitmap[:] = b'\xff' * len(bitmap)
+        if self.N & 7:
+            bitmap[-1] = (1 << (self.N & 7)) - 1
+        self._notify('features_granted', feature, changed)
+
+    def revoke_all(self, feature=None):
+        """Take feature away from every user; with no feature, take them all away"""
+        for name in ([feature] if feature is not None else self._bitmaps.keys()):
+            bitmap = self.bitmap(name)
+            changed = list(ids_in(bitmap)) if self.listeners else ()
+            bitmap[:] = bytearray(len(bitmap))
+            self._notify('features_revoked', name, changed)
+
+    def has(self, feature, uid):
+        """Return True if uid has feature"""
+        bitmap = self._bitmaps.get(feature)
+        return bitmap is not None and bool(bitmap[uid >> 3] >> (uid & 7) & 1)
+
+    def features_of(self, uid):
+        """Return the set of features uid has"""
+        byte, bit = uid >> 3, uid & 7
+        return set(feature for feature, bitmap in self._bitmaps.iteritems()
+                   if bitmap[byte] >> bit & 1)
+
+    def mask_of(self, uid):
+        """Return uid's features as an int with bit(feature) set for each"""
+        mask = 0
+        for feature in self.features_of(uid):
+            mask |= 1 << self._bits[feature]
+        return mask
+
+    def select(self, with_features=(), without_features=()):
+        """Return a bitmap of the users with all of with_features and none of without_features
+
+        With no with_features at all, every user is a candidate.
+        """
+        selected = (1 << self.N) - 1
+        for feature in with_features:
+            if feature not in self._bitmaps:
+                return bytearray(self._nbytes())
+            selected &= _to_long(self._bitmaps[feature])
+        for feature in without_features:
+            if feature in self._bitmaps:
+                selected &= ~_to_long(self._bitmaps[feature])
+        return _from_long(selected, self._nbytes())
+
+    def users(self, with_features=(), without_features=()):
+        """Yield the ids select() would set, in increasing order"""
+        return ids_in(self.select(with_features, without_features))
+
+    def anyone(self):
+        """Return a bitmap of the users with at least one feature"""
+        selected = 0
+        for bitmap in self._bitmaps.itervalues():
+            selected |= _to_long(bitmap)
+        return _from_long(selected, self._nbytes())
+
+    def count(self, feature):
+        """Return the number of users with feature"""
+        bitmap = self._bitmaps.get(feature)
+        return 0 if bitmap is None else count_bits(bitmap)
+
+    def counts(self):
+        """Return a dict of the number of users with each feature"""
+        return dict((feature, self.count(feature)) for feature in self._bitmaps)
+
+
+class UserFeatures(MutableSet):
+    """The features of one user id, as a live set-alike over a FeatureRegistry"""
+    __slots__ = ('registry', 'uid')
+
+    def __init__(self, registry, uid):
+        self.registry = registry
+        self.uid = uid
+
+    def __contains__(self, feature):
+        return self.registry.has(feature, self.uid)
+
+    def __iter__(self):
+        return iter(self.registry.features_of(self.uid))
+
+    def __len__(self):
+        return len(self.registry.features_of(self.uid))
+
+    def add(self, feature):
+        self.registry.grant(feature, (self.uid,))
+
+    def discard(self, feature):
+        if feature in self.registry:
+            self.registry.revoke(feature, (self.uid,))
+
+    def __repr__(self):
+        return "UserFeatures({!r})".format(self.registry.features_of(self.uid))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for FeatureRegistry and UserFeatures"""
+
+import unittest
+
+from features import (FeatureRegistry, UserFeatures, count_bits, difference_of, ids_in,
+                      union_of)
+from graph import Graph
+from population import Population
+
+
+class FeatureRegistryTestCase(unittest.TestCase):
+    def test_bits_in_order(self):
+        r = FeatureRegistry(10)
+        self.assertEqual(0, r.bit('A'))
+        self.assertEqual(1, r.bit('B'))
+        self.assertEqual(0, r.bit('A'))
+        self.assertEqual(['A', 'B'], list(r))
+
+    def test_grant_and_revoke(self):
+        r = FeatureRegistry(20)
+        r.grant('A', [0, 9, 19])
+        r.grant('B', [9])
+        self.assertTrue(r.has('A', 19))
+        self.assertFalse(r.has('A', 18))
+        self.assertFalse(r.has('C', 0))
+        self.assertEqual(set(['A', 'B']), r.features_of(9))
+        self.assertEqual(0b11, r.mask_of(9))
+        r.revoke('A', [9])
+        self.assertEqual([0, 19], list(r.users(['A'])))
+        self.assertEqual({'A': 2, 'B': 1}, r.counts())
+
+    def test_grant_all(self):
+        r = FeatureRegistry(13)
+        r.grant_all('A')
+        self.assertEqual(13, r.count('A'))
+        self.assertEqual(range(13), list(r.users(['A'])))
+        r.revoke_all('A')
+        self.assertEqual(0, r.count('A'))
+
+    def test_select(self):
+        r = FeatureRegistry(16)
+        r.grant('F', range(0, 16, 2))
+        r.grant('G', range(0, 16, 4))
+        self.assertEqual([2, 6, 10, 14], list(r.users(['F'], ['G'])))
+        self.assertEqual([1, 3, 5, 7, 9, 11, 13, 15], list(r.users(without_features=['F'])))
+        self.assertEqual([], list(r.users(['F', 'H'])))
+        self.assertEqual(range(0, 16, 2), list(ids_in(r.anyone())))
+
+    def test_empty_registry(self):
+        r = FeatureRegistry(0)
+        r.bit('A')
+        self.assertEqual([], list(r.users(['A'])))
+        self.assertEqual(bytearray(), r.anyone())
+
+    def test_listeners(self):
+        class Recorder(object):
+            def __init__(self):
+                self.events = []
+            def features_granted(self, feature, uids):
+                self.events.append(('+', feature, list(uids)))
+            def features_revoked(self, feature, uids):
+                self.events.append(('-', feature, list(uids)))
+        r = FeatureRegistry(10)
+        recorder = Recorder()
+        r.listeners.append(recorder)
+        r.grant('A', [1, 2])
+        r.grant('A', [2, 3])
+        r.revoke('A', [3, 4])
+        r.grant('A', [])
+        r.grant_all('A')
+        r.revoke_all()
+        self.assertEqual([('+', 'A', [1, 2]), ('+', 'A', [3]), ('-', 'A', [3]),
+                          ('+', 'A', [0, 3, 4, 5, 6, 7, 8, 9]), ('-', 'A', range(10))],
+                         recorder.events)
+
+    def test_revoke_bitmap(self):
+        class Bulk(object):
+            def __init__(self):
+                self.bitmaps = []
+            def features_revoked_bitmap(self, feature, bitmap):
+                self.bitmaps.append((feature, list(ids_in(bitmap))))
+        class Plain(object):
+            def __init__(self):
+                self.revoked = []
+            def features_granted(self, feature, uids):
+                pass
+            def features_revoked(self, feature, uids):
+                self.revoked.append((feature, list(uids)))
+        r = FeatureRegistry(20)
+        r.grant('A', [1, 2, 3, 17])
+        r.grant('B', [2])
+        bulk, plain = Bulk(), Plain()
+        r.listeners.extend([bulk, plain])
+        mask = bytearray(3)
+        for uid in (2, 17, 19):
+            mask[uid >> 3] |= 1 << (uid & 7)
+        self.assertEqual([2, 17], list(ids_in(r.revoke_bitmap('A', mask))))
+        self.assertEqual([1, 3], list(r.users(['A'])))
+        self.assertEqual([2], list(r.users(['B'])))
+        self.assertEqual([('A', [2, 17])], bulk.bitmaps)
+        self.assertEqual([('A', [2, 17])], plain.revoked)
+        r.revoke_bitmap('A', mask)
+        self.assertEqual(1, len(bulk.bitmaps))
+
+    def test_bitmap_helpers(self):
+        self.assertEqual(3, count_bits(bytearray([0x81, 0x10])))
+        self.assertEqual(bytearray([0x83, 0]), union_of([bytearray([1]), bytearray([0x82])], 2))
+        self.assertEqual(bytearray([0x0f]), union_of([bytearray([0x0f, 0xff])], 1))
+        self.assertEqual(bytearray([0x80, 1]),
+                         difference_of(bytearray([0x81, 1]), bytearray([1])))
+
+    def test_resize(self):
+        r = FeatureRegistry(3)
+        r.grant_all('A')
+        r.resize(30)
+        r.grant('A', [29])
+        self.assertEqual([0, 1, 2, 29], list(r.users(['A'])))
+
+
+class UserFeaturesTestCase(unittest.TestCase):
+    def test_set_behaviour(self):
+        r = FeatureRegistry(4)
+        features = UserFeatures(r, 2)
+        self.assertFalse(features)
+        features.add('A')
+        features.add('B')
+        self.assertEqual(set(['A', 'B']), features)
+        self.assertIn('A', features)
+        features.discard('A')
+        features.discard('Z')
+        self.assertEqual(set(['B']), features)
+        features.clear()
+        self.assertEqual(0, len(features))
+
+    def test_graph_population(self):
+        g = Graph(6)
+        g.add_edges([(0, 1), (2, 3)])
+        g.user(4).features.add('A')
+        p = Population(graph=g)
+        self.assertEqual(set([g.user(4)]), p.infected)
+        p.toggle_infections('B')
+        p.infect_components('C', [g.user(1), g.user(3)])
+        self.assertEqual([0, 1, 2, 3], list(g.features.users(['C'], ['B'])))
+        self.assertEqual({'A': 1, 'B': 1, 'C': 4}, g.features.counts())
+        p.toggle_infections(None)
+        self.assertEqual(0, g.features.count('C'))
+
+
+if __name__ == "__main__":
+    unittest.main()
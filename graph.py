@@ -0,0 +1,482 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Implement a compact, array-backed coaching graph for very large populations
+
+User carries three Python sets per instance, which is fine for hand-wired test
+graphs but costs gigabytes at tens of millions of users. Graph keeps users as
+integer ids 0..N-1 and coaching edges as CSR (compressed sparse row) arrays,
+one for each direction. Rows touched since the last compaction live in a small
+overlay so single edges can still be added or removed cheaply.
+
+GraphUser is a thin view over one id which speaks the same coaches() and
+students() dialect as User, so infection.py and Population can walk either.
+"""
+
+
+from array import array
+from collections import Iterable
+from itertools import chain, izip
+
+from features import FeatureRegistry, UserFeatures
+
+
+ID_TYPE = 'i'      # user ids; 32 bits holds two billion users
+OFFSET_TYPE = 'l'  # row offsets; edge counts may outgrow 32 bits first
+COMPACT_MIN = 4096 # don't bother compacting over tiny overlays
+HASHED_ROW = 32    # overlay rows this long get a set for membership checks
+
+
+def to_array(typecode, seq):
+    """Return seq as an array of typecode, copying it only if it isn't one already
+
+    Graphs loaded from a snapshot keep their rows in memory-mapped storage that
+    slices into lists and can't grow; anything that needs a real array takes a
+    private copy through here first.
+    """
+    if isinstance(seq, array):
+        return seq
+    copy = array(typecode)
+    if isinstance(seq, list):
+        copy.fromlist(seq)
+    else:
+        copy.fromstring(buffer(seq))
+    return copy
+
+
+class _Adjacency(object):
+    """One direction of the coaching graph: CSR rows plus an overlay of edited rows"""
+
+    def __init__(self):
+        self.offsets = array(OFFSET_TYPE, [0])
+        self.targets = array(ID_TYPE)
+        self.overlay = {}
+        self.overlay_edges = 0
+        self.hashed = {}    # long overlay rows as sets, for has()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def grow(self, count):
+        self.offsets = to_array(OFFSET_TYPE, self.offsets)
+        self.offsets.extend(array(OFFSET_TYPE, [self.offsets[-1]]) * count)
+
+    def row(self, u):
+        row = self.overlay.get(u)
+        if row is None:
+            return self.targets[self.offsets[u]:self.offsets[u + 1]]
+        return row
+
+    def degree(self, u):
+        row = self.overlay.get(u)
+        if row is None:
+            return self.offsets[u + 1] - self.offsets[u]
+        return len(row)
+
+    def edge_count(self):
+        return len(self.targets) + self.overlay_edges
+
+    def has(self, u, v):
+        hashed = self.hashed.get(u)
+        if hashed is not None:
+            return v in hashed
+        return v in self.row(u)
+
+    def add(self, u, v):
+        row = self.overlay.get(u)
+        if row is None:
+            row = self.overlay[u] = to_array(ID_TYPE, self.row(u))
+        row.append(v)
+        self.overlay_edges += 1
+        hashed = self.hashed.get(u)
+        if hashed is not None:
+            hashed.add(v)
+        elif len(row) >= HASHED_ROW:
+            self.hashed[u] = set(row)
+
+    def remove(self, u, v):
+        row = self.overlay.get(u)
+        if row is None:
+            row = self.overlay[u] = to_array(ID_TYPE, self.row(u))
+        row.remove(v)
+        self.overlay_edges -= 1
+        hashed = self.hashed.get(u)
+        if hashed is not None:
+            hashed.discard(v)
+
+    def needs_compaction(self):
+        return len(self.overlay) > max(COMPACT_MIN, len(self) // 8)
+
+    def compact(self, sources=(), destinations=()):
+        """Rebuild the CSR arrays from the current rows plus optional extra edges
+
+        sources and destinations are parallel sequences of ids; each
+        sources[i] gains destinations[i] in its row.
+        """
+        n = len(self)
+        old_offsets, old_targets, overlay = self.offsets, self.targets, self.overlay
+        # growth of each row first, then a running sum over the old row lengths
+        offsets = array(OFFSET_TYPE, [0]) * (n + 1)
+        for u in sources:
+            offsets[u + 1] += 1
+        for u, row in overlay.iteritems():
+            offsets[u + 1] += len(row) - (old_offsets[u + 1] - old_offsets[u])
+        total = 0
+        for u in xrange(n):
+            total += offsets[u + 1] + old_offsets[u + 1] - old_offsets[u]
+            offsets[u + 1] = total
+
+        targets = array(ID_TYPE, [0]) * total
+        fill = array(OFFSET_TYPE, offsets)
+        if old_targets or overlay:
+            for u in xrange(n):
+                row = overlay.get(u)
+                if row is None:
+                    if old_offsets[u] == old_offsets[u + 1]:
+                        continue
+                    row = to_array(ID_TYPE, old_targets[old_offsets[u]:old_offsets[u + 1]])
+                start = fill[u]
+                targets[start:start + len(row)] = row
+                fill[u] = start + len(row)
+        for u, v in izip(sources, destinations):
+            targets[fill[u]] = v
+            fill[u] += 1
+
+        self.offsets, self.targets = offsets, targets
+        self.overlay = {}
+        self.overlay_edges = 0
+        self.hashed = {}
+
+    def nbytes(self):
+        total = len(buffer(self.offsets)) + len(buffer(self.targets))
+        for row in self.overlay.itervalues():
+            total += len(buffer(row))
+        return total
+
+
+class Graph(object):
+    """A coaching graph of N users with integer ids and array-backed edges
+
+    Edges run from coach to student. add_edge() is cheap for a steady trickle
+    of new relationships; add_edges() is the bulk path and rebuilds the arrays
+    in one pass, so prefer it when loading millions of edges at once.
+
+    Objects in listeners are told about every change after it happens, through
+    users_added(first, count), edge_added(coach, student),
+    edges_added(coaches, students), edge_removed(coach, student) and
+    edges_removed(coaches, students); this is how indexes such as
+    components.ComponentIndex stay current without rescanning the graph.
+    """
+
+    def __init__(self, size=0):
+        self.N = 0
+        self.population = None
+        self.listeners = []
+        self.features = FeatureRegistry()
+        self._students = _Adjacency()
+        self._coaches = _Adjacency()
+        if size:
+            self.add_users(size)
+
+    def __len__(self):
+        return self.N
+
+    @property
+    def E(self):
+        """The number of coaching edges in the graph"""
+        return self._students.edge_count()
+
+    def add_users(self, count=1):
+        """Grow the graph by count unconnected users and return the first new id"""
+        first = self.N
+        self._students.grow(count)
+        self._coaches.grow(count)
+        self.N += count
+        self.features.resize(self.N)
+        for listener in self.listeners:
+            listener.users_added(first, count)
+        return first
+
+    def _check_id(self, uid):
+        if not 0 <= uid < self.N:
+            raise IndexError, "No user {} in a graph of {}".format(uid, self.N)
+
+    def add_edge(self, coach, student):
+        """Record that coach coaches student; return False if they already did"""
+        self._check_id(coach)
+        self._check_id(student)
+        if self._students.has(coach, student):
+            return False
+        self._students.add(coach, student)
+        self._coaches.add(student, coach)
+        if self._students.needs_compaction() or self._coaches.needs_compaction():
+            self.compact()
+        for listener in self.listeners:
+            listener.edge_added(coach, student)
+        return True
+
+    def add_edges(self, pairs):
+        """Record every (coach, student) pair in pairs with a single rebuild
+
+        Unlike add_edge(), pairs are not checked against existing edges; bulk
+        exports are expected to be keyed by (coach, student) already.
+        """
+        coaches = array(ID_TYPE)
+        students = array(ID_TYPE)
+        for coach, student in pairs:
+            coaches.append(coach)
+            students.append(student)
+        return self.add_edge_arrays(coaches, students)
+
+    def add_edge_arrays(self, coaches, students):
+        """Like add_edges(), but for parallel arrays of coach and student ids"""
+        for uid in (coaches, students):
+            if uid and (min(uid) < 0 or max(uid) >= self.N):
+                raise IndexError, "Edge endpoints must be users of this graph"
+        self._students.compact(coaches, students)
+        self._coaches.compact(students, coaches)
+        for listener in self.listeners:
+            listener.edges_added(coaches, students)
+        return len(coaches)
+
+    def remove_edge(self, coach, student):
+        """Forget that coach coaches student; return False if they didn't"""
+        self._check_id(coach)
+        self._check_id(student)
+        if not self._students.has(coach, student):
+            return False
+        self._students.remove(coach, student)
+        self._coaches.remove(student, coach)
+        if self._students.needs_compaction() or self._coaches.needs_compaction():
+            self.compact()
+        for listener in self.listeners:
+            listener.edge_removed(coach, student)
+        return True
+
+    def remove_edges(self, pairs):
+        """Forget every (coach, student) pair in pairs; return the number that existed
+
+        Listeners hear about the removals once, through edges_removed(), with
+        only the edges that were there.
+        """
+        coaches = array(ID_TYPE)
+        students = array(ID_TYPE)
+        for coach, student in pairs:
+            coaches.append(coach)
+            students.append(student)
+        return self.remove_edge_arrays(coaches, students)
+
+    def remove_edge_arrays(self, coaches, students):
+        """Like remove_edges(), but for parallel arrays of coach and student ids"""
+        removed_coaches, removed_students = array(ID_TYPE), array(ID_TYPE)
+        for coach, student in izip(coaches, students):
+            self._check_id(coach)
+            self._check_id(student)
+            if self._students.has(coach, student):
+                self._students.remove(coach, student)
+                self._coaches.remove(student, coach)
+                removed_coaches.append(coach)
+                removed_students.append(student)
+        if self._students.needs_compaction() or self._coaches.needs_compaction():
+            self.compact()
+        if removed_coaches:
+            for listener in self.listeners:
+                listener.edges_removed(removed_coaches, removed_students)
+        return len(removed_coaches)
+
+    def compact(self):
+        """Fold every overlay row back into the CSR arrays"""
+        self._students.compact()
+        self._coaches.compact()
+
+    def students_of(self, uid):
+        """Return the ids coached by uid"""
+        return self._students.row(uid)
+
+    def coaches_of(self, uid):
+        """Return the ids coaching uid"""
+        return self._coaches.row(uid)
+
+    def neighbors(self, uid):
+        """Return an iterable of the ids sharing any coaching relationship with uid"""
+        return chain(self._students.row(uid), self._coaches.row(uid))
+
+    def component(self, seeds):
+        """Return an array of every id connected to any of the ids in seeds"""
+        seen = bytearray(self.N)
+        found = array(ID_TYPE)
+        for seed in seeds:
+            if not seen[seed]:
+                seen[seed] = 1
+                found.append(seed)
+        i = 0
+        while i < len(found):
+            for v in self.neighbors(found[i]):
+                if not seen[v]:
+                    seen[v] = 1
+                    found.append(v)
+            i += 1
+        return found
+
+    def user(self, uid):
+        """Return a User-alike view of uid"""
+        self._check_id(uid)
+        return GraphUser(self, uid)
+
+    def users(self):
+        """Return a read-only sequence of views over every user in the graph"""
+        return GraphUsers(self)
+
+    def nbytes(self):
+        """Return the approximate number of bytes held by the edge arrays"""
+        return self._students.nbytes() + self._coaches.nbytes()
+
+    @classmethod
+    def from_csr(cls, student_offsets, students, coach_offsets, coaches):
+        """Make a Graph directly from prebuilt CSR arrays, one pair per direction
+
+        Row u of students is students[student_offsets[u]:student_offsets[u + 1]],
+        and likewise for coaches. The arrays are adopted, not copied.
+        """
+        graph = cls()
+        graph.N = len(student_offsets) - 1
+        graph.features.resize(graph.N)
+        graph._students.offsets, graph._students.targets = student_offsets, students
+        graph._coaches.offsets, graph._coaches.targets = coach_offsets, coaches
+        return graph
+
+    @classmethod
+    def from_users(cls, users):
+        """Copy a graph of User objects into a new Graph
+
+        Returns the graph and a dict mapping each User to its id. Users reached
+        through coaching relationships but absent from users are included too.
+        """
+        ids = {}
+        order = []
+        for user in users:
+            if user not in ids:
+                ids[user] = len(order)
+                order.append(user)
+        i = 0
+        while i < len(order):
+            for other in order[i].coaches() | order[i].students():
+                if other not in ids:
+                    ids[other] = len(order)
+                    order.append(other)
+            i += 1
+        graph = cls(len(order))
+        graph.add_edges((ids[coach], ids[student])
+                        for student in order for coach in student.coaches())
+        for user in order:
+            for feature in user.features:
+                graph.features.grant(feature, (ids[user],))
+        return graph, ids
+
+
+class GraphUser(object):
+    """A lightweight stand-in for User backed by one id of a Graph"""
+    __slots__ = ('graph', 'id')
+
+    def __init__(self, graph, uid):
+        self.graph = graph
+        self.id = uid
+
+    def add_coach(self, coach):
+        """Add a coaching edge from coach to us.
+
+        If coach is an iterable, every member will be added.
+        It is an error to add a coach which is not a GraphUser of our graph."""
+        self._each_user(coach, lambda them: self.graph.add_edge(them.id, self.id))
+
+    def add_student(self, student):
+        """Add a coaching edge from us to student.
+
+        If student is an iterable, every member will be added.
+        It is an error to add a student which is not a GraphUser of our graph."""
+        self._each_user(student, lambda them: self.graph.add_edge(self.id, them.id))
+
+    def remove_coach(self, coach):
+        """Remove the coaching edge from coach to us, if there is one.
+
+        If coach is an iterable, every member will be removed."""
+        self._each_user(coach, lambda them: self.graph.remove_edge(them.id, self.id))
+
+    def remove_student(self, student):
+        """Remove the coaching edge from us to student, if there is one.
+
+        If student is an iterable, every member will be removed."""
+        self._each_user(student, lambda them: self.graph.remove_edge(self.id, them.id))
+
+    def _each_user(self, userish, apply):
+        def apply_with_check(userish):
+            if isinstance(userish, GraphUser) and userish.graph is self.graph:
+                apply(userish)
+            else:
+                raise TypeError, "Only Users of the same graph can be coaches."
+        if isinstance(userish, Iterable):
+            for u in userish:
+                apply_with_check(u)
+        else:
+            apply_with_check(userish)
+
+    def coaches(self):
+        """Return the set of coaches this user is coached_by"""
+        return set(GraphUser(self.graph, uid) for uid in self.graph.coaches_of(self.id))
+
+    def students(self):
+        """Return the set of students this user is coaching"""
+        return set(GraphUser(self.graph, uid) for uid in self.graph.students_of(self.id))
+
+    @property
+    def features(self):
+        return UserFeatures(self.graph.features, self.id)
+
+    @property
+    def population(self):
+        return self.graph.population
+
+    def __eq__(self, other):
+        return (isinstance(other, GraphUser) and self.id == other.id
+                and self.graph is other.graph)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self.id
+
+    def __repr__(self):
+        return "<GraphUser() {}>".format(self.id)
+
+
+class GraphUsers(object):
+    """A read-only sequence of GraphUser views, made on demand"""
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __len__(self):
+        return len(self.graph)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.graph)
+        return self.graph.user(i)
+
+    def __iter__(self):
+        graph = self.graph
+        for uid in xrange(len(graph)):
+            yield GraphUser(graph, uid)
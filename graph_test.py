@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for Graph and GraphUser"""
+
+import unittest
+
+import graph
+from graph import Graph
+from infection import limited_infection, total_infection
+from population import Population
+from user import User
+
+
+class GraphTestCase(unittest.TestCase):
+    def test_empty_graph(self):
+        g = Graph()
+        self.assertEqual(0, len(g))
+        self.assertEqual(0, g.E)
+        self.assertEqual(0, g.add_users(3))
+        self.assertEqual(3, len(g))
+
+    def test_add_edge(self):
+        """add_edge() updates both directions and ignores repeats"""
+        g = Graph(3)
+        self.assertTrue(g.add_edge(0, 1))
+        self.assertFalse(g.add_edge(0, 1))
+        g.add_edge(2, 1)
+        self.assertEqual([1], list(g.students_of(0)))
+        self.assertEqual(set([0, 2]), set(g.coaches_of(1)))
+        self.assertEqual(2, g.E)
+        with self.assertRaises(IndexError):
+            g.add_edge(0, 3)
+
+    def test_big_classroom(self):
+        """Repeats are caught in rows long enough to be hashed, through removals too"""
+        g = Graph(101)
+        for student in range(1, 101):
+            self.assertTrue(g.add_edge(0, student))
+        self.assertFalse(g.add_edge(0, 50))
+        self.assertTrue(g.remove_edge(0, 50))
+        self.assertFalse(g.remove_edge(0, 50))
+        self.assertTrue(g.add_edge(0, 50))
+        self.assertEqual(100, g.E)
+        g.compact()
+        self.assertFalse(g.add_edge(0, 70))
+        self.assertEqual(range(1, 101), sorted(g.students_of(0)))
+
+    def test_add_edges_and_compact(self):
+        """Bulk edges and overlay edges survive compaction together"""
+        g = Graph(4)
+        g.add_edge(0, 1)
+        g.add_edges([(1, 2), (1, 3)])
+        g.add_edge(3, 0)
+        g.compact()
+        self.assertEqual(4, g.E)
+        self.assertEqual(set([2, 3]), set(g.students_of(1)))
+        self.assertEqual([3], list(g.coaches_of(0)))
+        self.assertEqual(set([0, 1]), set(g.neighbors(3)))
+
+    def test_overlay_compacts_itself(self):
+        old_min = graph.COMPACT_MIN
+        graph.COMPACT_MIN = 2
+        try:
+            g = Graph(10)
+            for student in range(1, 10):
+                g.add_edge(0, student)
+                if student % 2:
+                    g.add_edge(student, 0)
+            self.assertEqual(set(range(1, 10)), set(g.students_of(0)))
+            self.assertEqual(set([1, 3, 5, 7, 9]), set(g.coaches_of(0)))
+            self.assertEqual(14, g.E)
+        finally:
+            graph.COMPACT_MIN = old_min
+
+    def test_remove_edge(self):
+        g = Graph(3)
+        g.add_edges([(0, 1), (0, 2), (2, 1)])
+        self.assertTrue(g.remove_edge(0, 1))
+        self.assertFalse(g.remove_edge(0, 1))
+        self.assertFalse(g.remove_edge(1, 2))
+        self.assertEqual([2], list(g.students_of(0)))
+        self.assertEqual([2], list(g.coaches_of(1)))
+        self.assertEqual(2, g.E)
+        g.compact()
+        self.assertEqual(2, g.E)
+        self.assertEqual([2], list(g.coaches_of(1)))
+        with self.assertRaises(IndexError):
+            g.remove_edge(0, 3)
+
+    def test_remove_edges(self):
+        class Recorder(object):
+            def __init__(self):
+                self.removed = []
+            def edge_removed(self, coach, student):
+                self.removed.append([(coach, student)])
+            def edges_removed(self, coaches, students):
+                self.removed.append(zip(coaches, students))
+        g = Graph(4)
+        g.add_edges([(0, 1), (0, 2), (1, 3)])
+        recorder = Recorder()
+        g.listeners.append(recorder)
+        self.assertEqual(2, g.remove_edges([(0, 1), (3, 1), (1, 3)]))
+        self.assertEqual(0, g.remove_edges([(0, 1)]))
+        g.remove_edge(0, 2)
+        self.assertEqual([[(0, 1), (1, 3)], [(0, 2)]], recorder.removed)
+        self.assertEqual(0, g.E)
+
+    def test_remove_through_views(self):
+        g = Graph(3)
+        A, B, C = g.users()
+        A.add_student([B, C])
+        B.remove_coach(A)
+        A.remove_student([C, B])
+        self.assertEqual(set(), A.students())
+        self.assertEqual(0, g.E)
+
+    def test_component(self):
+        g = Graph(5)
+        g.add_edges([(0, 1), (2, 1), (3, 4)])
+        self.assertEqual(set([0, 1, 2]), set(g.component([2])))
+        self.assertEqual(set(range(5)), set(g.component([0, 4])))
+
+    def test_from_users(self):
+        A = User(); B = User(); C = User()
+        B.add_coach(A)
+        C.add_coach(B)
+        C.features.add('x')
+        g, ids = Graph.from_users([A])
+        self.assertEqual(3, len(g))
+        self.assertEqual([ids[A]], list(g.coaches_of(ids[B])))
+        self.assertEqual(set(['x']), g.user(ids[C]).features)
+        self.assertEqual(set(), g.user(ids[A]).features)
+
+
+class GraphUserTestCase(unittest.TestCase):
+    def test_views_match_user_api(self):
+        g = Graph(3)
+        A, B, C = g.users()
+        B.add_coach(A)
+        A.add_student([C])
+        self.assertEqual(set([B, C]), A.students())
+        self.assertEqual(set([A]), C.coaches())
+        self.assertEqual(g.user(1), B)
+        self.assertNotEqual(Graph(3).user(1), B)
+
+    def test_add_coach_breaks_without_graph_user(self):
+        g = Graph(1)
+        with self.assertRaises(TypeError):
+            g.user(0).add_coach(User())
+        with self.assertRaises(TypeError):
+            g.user(0).add_coach(Graph(1).user(0))
+
+    def test_features(self):
+        g = Graph(2)
+        g.user(1).features.add('A')
+        self.assertEqual(set(['A']), g.user(1).features)
+        self.assertEqual(set(), g.user(0).features)
+
+    def test_population_and_infection(self):
+        g = Graph(4)
+        g.add_edges([(0, 1), (0, 2)])
+        g.user(3).features.add('A')
+        p = Population(graph=g)
+        self.assertEqual(4, p.N)
+        self.assertEqual(set([g.user(0)]), p.coaches)
+        self.assertEqual(set([g.user(3)]), p.infected)
+        self.assertEqual(set(g.user(i) for i in (1, 2, 3)), p.students)
+        self.assertEqual(set(g.user(i) for i in (0, 1, 2)), total_infection(g.user(1)))
+        self.assertEqual(set([g.user(3)]), total_infection(population=p))
+        self.assertEqual(2, len(limited_infection(g.user(0), 2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,50 +13,434 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Implement total_infection() and local_infection() for User objects
+"""Implement total_infection(), limited_infection(), exact_infection() and iter_infection()
 
 Relies on some graph of User objects to be pre-generated; check out User
-and Population, and read the unit tests for some ideas.
+and Population, and read the unit tests for some ideas. Users may also be
+GraphUser views over a compact Graph, in which case traversal runs over the
+Graph's integer arrays instead of building a set per visited user.
+
+iter_infection() hands out newly infected users in batches as it reaches them,
+so a rollout can start on the first of them and stop whenever it likes.
+infect_new_edges() keeps a rolled out feature whole as coaching edges arrive.
+weighted_infection() is limited_infection() counting users by a weight, such
+as their activity, rather than one apiece.
+
+total_infection() and limited_infection() take an optional InfectionStats to
+fill in with what the traversal did, for tuning limits and spotting graphs
+that make them slow. They can also be held to a hop radius, an edge budget or
+a deadline, and then say whether that cut them short through the truncated
+flag of the InfectionResult they return.
 """
 
 
-def limited_infection(start_user, max_infections=0):
-    """Keep walking across social graph until the entire connected component is infected.
+from array import array
+from collections import deque
+from heapq import heappop, heappush
+from itertools import chain, count
+import multiprocessing
+import random
+import sys
+import time
+
+from graph import GraphUser, ID_TYPE
+
+
+BATCH_SIZE = 1024   # users per iter_infection() batch in classroom order
+
+
+class InfectionStats(object):
+    """Counters describing what infection traversals did; pass one as stats= to fill it in
+
+    * nodes_popped is how many users were taken off a frontier, stale_pops how many of
+      those were already infected or outdated and skipped, and random_jumps how many
+      users limited_infection() picked at random because its frontier ran dry.
+    * edges_scanned counts coaching relationships looked at; max_degree is the most
+      any one user had, which is how a coach with 50k students shows up.
+    * set_difference_work counts the members visited by set differences in the
+      User-object traversal.
+    * frontier_peak is the largest the frontier ever got.
+    * infected is the number of users returned, and overshoot how far past
+      max_infections limited_infection() went.
+    * seconds maps each phase of the work to the wall time it took.
+
+    Traversals count into local variables and add them in here once at the end, so
+    a shared InfectionStats sums over calls and costs next to nothing while it isn't
+    passed at all. Override finished() to forward the numbers somewhere.
+    """
+
+    COUNTERS = ('nodes_popped', 'stale_pops', 'random_jumps', 'edges_scanned',
+                'set_difference_work', 'infected', 'overshoot')
+    PEAKS = ('frontier_peak', 'max_degree')
+
+    def __init__(self):
+        for name in self.COUNTERS + self.PEAKS:
+            setattr(self, name, 0)
+        self.seconds = {}
+
+    def add_time(self, phase, seconds):
+        """Charge seconds of wall time to phase"""
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+
+    def add_peaks(self, frontier_peak=0, max_degree=0):
+        """Raise the recorded peaks to the given ones if they're higher"""
+        self.frontier_peak = max(self.frontier_peak, frontier_peak)
+        self.max_degree = max(self.max_degree, max_degree)
+
+    def finished(self, function):
+        """Called with the function's name whenever an instrumented call returns"""
+        pass
+
+    def as_dict(self):
+        """Return every counter, peak and phase time in a plain dict"""
+        stats = dict((name, getattr(self, name)) for name in self.COUNTERS + self.PEAKS)
+        stats['seconds'] = dict(self.seconds)
+        return stats
+
+    def __repr__(self):
+        return "InfectionStats({!r})".format(self.as_dict())
+
+class Budget(object):
+    """Limits on how far a traversal may go; truncated says whether any cut it short
+
+    * max_hops is the furthest, in coaching relationships, a user may be from where
+      the infection started; 0 infects the starting users alone.
+    * max_edges is the most coaching relationships the traversal may look at.
+    * deadline is a time.time() past which the traversal stops.
+    """
+
+    CLOCK_EVERY = 64    # users expanded between looks at the clock
+
+    def __init__(self, max_hops=None, max_edges=None, deadline=None):
+        self.max_hops = max_hops
+        self.max_edges = max_edges
+        self.deadline = deadline
+        self.edges = 0
+        self.truncated = False
+        self._expanded = 0
+
+    def expand(self, degree):
+        """Return True if a user with degree relationships may be expanded, and charge for it"""
+        if not degree:
+            return True
+        if self.max_edges is not None and self.edges + degree > self.max_edges:
+            self.truncated = True
+            return False
+        if (self.deadline is not None and not self._expanded % self.CLOCK_EVERY
+                and time.time() >= self.deadline):
+            self.truncated = True
+            return False
+        self._expanded += 1
+        self.edges += degree
+        return True
+
+
+class InfectionResult(set):
+    """The set of infected users, with truncated set if a Budget cut the infection short"""
+    truncated = False
+
+def _lap(stats, phase=None, since=None):
+    """Charge the time since since to phase of stats and return the time now
+
+    Does nothing and returns None when stats is None, so call sites need no guard.
+    """
+    if stats is None:
+        return None
+    now = time.time()
+    if phase is not None:
+        stats.add_time(phase, now - since)
+    return now
+
+def _random_uninfected(universe, infected):
+    """Return a random member of the sequence universe not in infected, or None"""
+    n = len(universe)
+    if n == 0:
+        return None
+    for attempt in xrange(8):
+        user = universe[random.randrange(n)]
+        if user not in infected:
+            return user
+    # Mostly infected already; walk from a random spot rather than keep guessing
+    offset = random.randrange(n)
+    for i in xrange(n):
+        user = universe[(offset + i) % n]
+        if user not in infected:
+            return user
+    return None
+
+def _classroom_order(start, students_of, coaches_of, universe=None, stats=None, budget=None):
+    """Yield users in the order SPEC.txt's limited infection reaches them
+
+    Students of every infected user come first, so classrooms fill up before
+    anything else. Next comes the uninfected coach with the most infected
+    students, kept in a heap whose stale entries are skipped when popped rather
+    than updated in place. When neither is left, a random uninfected member of
+    the sequence universe is picked, if there is one.
+
+    Counts are added to stats, if given, when the generator finishes or is closed.
+    A budget, if given, is respected; with a max_hops, no random jumps are made
+    and nobody further than that from start is reached. Classroom order may reach
+    a user by a longer path than its shortest, so hops are lowered as shorter paths
+    turn up, and an infected user whose hops drop has its neighbours looked at
+    again, at the budget's expense, in case some were held back as too far.
+    """
+    infected = set()
+    classmates = deque([start])
+    infected_students = {}
+    candidates = []
+    tiebreak = count()
+    hops = None
+    if budget is not None and budget.max_hops is not None:
+        hops = {start: 0}
+    held = set()        # infected users whose neighbours lay beyond max_hops
+    stale = jumps = scanned = peak = widest = 0
+
+    def enqueue(students, coaches):
+        for student in students:
+            if student not in infected:
+                classmates.append(student)
+        for coach in coaches:
+            if coach not in infected:
+                score = infected_students[coach] = infected_students.get(coach, 0) + 1
+                heappush(candidates, (-score, next(tiebreak), coach))
+
+    try:
+        while True:
+            if classmates:
+                user = classmates.popleft()
+                if user in infected:
+                    stale += 1
+                    continue
+            elif candidates:
+                score, _, user = heappop(candidates)
+                if user in infected or -score != infected_students[user]:
+                    stale += 1
+                    continue
+            else:
+                if universe is None or hops is not None:
+                    if held:
+                        budget.truncated = True
+                    return
+                user = _random_uninfected(universe, infected)
+                if user is None:
+                    return
+                jumps += 1
+            infected.add(user)
+            infected_students.pop(user, None)
+            yield user
+            students = students_of(user)
+            coaches = coaches_of(user)
+            if budget is not None and not budget.expand(len(students) + len(coaches)):
+                return
+            if hops is None:
+                enqueue(students, coaches)
+            pending = [] if hops is None else [(user, students, coaches, True)]
+            while pending:
+                near, near_students, near_coaches, first = pending.pop()
+                hop = hops[near] + 1
+                for n in chain(near_students, near_coaches):
+                    if hop < hops.get(n, hop + 1):
+                        hops[n] = hop
+                        if n in infected:
+                            n_students, n_coaches = students_of(n), coaches_of(n)
+                            if not budget.expand(len(n_students) + len(n_coaches)):
+                                return
+                            pending.append((n, n_students, n_coaches, False))
+                if hop > budget.max_hops:
+                    if any(n not in infected for n in chain(near_students, near_coaches)):
+                        held.add(near)
+                elif first or near in held:
+                    held.discard(near)
+                    enqueue(near_students, near_coaches)
+            if stats is not None:
+                degree = len(students) + len(coaches)
+                scanned += degree
+                widest = max(widest, degree)
+                peak = max(peak, len(classmates) + len(candidates))
+    finally:
+        if stats is not None:
+            stats.nodes_popped += len(infected) - jumps + stale
+            stats.stale_pops += stale
+            stats.random_jumps += jumps
+            stats.edges_scanned += scanned
+            stats.add_peaks(peak, widest)
+
+def _bfs_layers(seeds, students_of, coaches_of, stats=None, budget=None):
+    """Yield sets of users, each one breadth-first layer further out from seeds
+
+    Coaching runs both ways for infection, so every neighbour of a user in one
+    layer lies in the layer before, the same layer or the next one. Keeping just
+    those layers is enough to know who's been reached, so memory follows the
+    size of the frontier rather than of the component. A budget, if given, is
+    respected.
+    """
+    previous, current = set(), set(seeds)
+    popped = scanned = peak = widest = 0
+    hop = 0
+    try:
+        while current:
+            yield current
+            following = set()
+            for user in current:
+                students = students_of(user)
+                coaches = coaches_of(user)
+                if budget is not None:
+                    if budget.max_hops is not None and hop >= budget.max_hops:
+                        # only look far enough to know whether we're leaving anyone out
+                        if any(n not in current and n not in previous
+                               for n in chain(students, coaches)):
+                            budget.truncated = True
+                            return
+                        continue
+                    if not budget.expand(len(students) + len(coaches)):
+                        return
+                for neighbour in chain(students, coaches):
+                    if neighbour not in current and neighbour not in previous:
+                        following.add(neighbour)
+                if stats is not None:
+                    popped += 1
+                    degree = len(students) + len(coaches)
+                    scanned += degree
+                    widest = max(widest, degree)
+            if stats is not None:
+                peak = max(peak, len(current) + len(following))
+            previous, current = current, following
+            hop += 1
+    finally:
+        if stats is not None:
+            stats.nodes_popped += popped
+            stats.edges_scanned += scanned
+            stats.add_peaks(peak, widest)
+
+def iter_infection(start_user=None, population=None, batch_size=None, max_infections=None,
+                   deadline=None, until=None, classrooms=False, stats=None, budget=None):
+    """Yield lists of newly infected users as the infection reaches them.
+
+    * start_user and population give the users to start from, as for total_infection().
+    * batch_size, if given, is the number of users per list; otherwise each list is one
+      breadth-first layer, everyone one step further out than the list before.
+    * max_infections, if given, stops the infection once that many users are yielded.
+    * deadline, if given, is a time.time() after which no new batch is started.
+    * until, if given, is called with each infected user; the first one it returns true
+      for is the last one yielded.
+    * classrooms, if set, visits users in limited_infection()'s classroom order instead
+      of breadth first. population is then only where random jumps come from, and
+      batch_size defaults to BATCH_SIZE since that order has no layers.
+    * stats, an optional InfectionStats, gets the traversal's counters once iteration
+      ends or the generator is closed.
+    * budget, an optional Budget, limits the traversal itself; check its truncated
+      flag once iteration ends.
+
+    Breadth first, only the last few layers are remembered, so memory follows the size
+    of the frontier rather than of the component. Classroom order has to remember
+    everyone it's infected.
+    """
+    if start_user is None and population is None:
+        raise TypeError, "Both start_user and population may not be unspecified."
+    if start_user is None and classrooms:
+        raise TypeError, "Classroom order needs a start_user."
+    seeds = [] if start_user is None else [start_user]
+    if population is not None and not classrooms:
+        seeds.extend(population.infected)
+    elif population is None:
+        population = start_user.population
+    graph = population.graph if start_user is None else getattr(start_user, 'graph', None)
+    if graph is not None:
+        # traverse over ids and only make views of what we yield
+        students_of, coaches_of = graph.students_of, graph.coaches_of
+        view = lambda uid: GraphUser(graph, uid)
+        unwrap = lambda user: user.id
+        universe = None if population is None else xrange(len(graph))
+    else:
+        students_of, coaches_of = lambda u: u.students(), lambda u: u.coaches()
+        view = unwrap = None
+        universe = None if population is None else population.population
+
+    if classrooms:
+        batch_size = batch_size or BATCH_SIZE
+        order = _classroom_order(unwrap(start_user) if unwrap else start_user, students_of,
+                                 coaches_of, universe, stats, budget)
+        groups = ((user,) for user in order)
+    else:
+        order = groups = _bfs_layers([unwrap(u) for u in seeds] if unwrap else seeds,
+                                     students_of, coaches_of, stats, budget)
+    limit = sys.maxint if max_infections is None else int(min(max_infections, sys.maxint))
+
+    late = lambda: deadline is not None and time.time() >= deadline
+
+    taken = 0
+    batch = []
+    try:
+        if limit <= 0:
+            return
+        for group in groups:
+            for user in group:
+                if view is not None:
+                    user = view(user)
+                batch.append(user)
+                taken += 1
+                stop = taken >= limit or (until is not None and until(user))
+                if stop or len(batch) == batch_size:
+                    yield batch
+                    batch = []
+                    if stop or late():
+                        return
+            if batch_size is None:
+                yield batch
+                batch = []
+                if late():
+                    return
+        if batch:
+            yield batch
+    finally:
+        order.close()
+
+def limited_infection(start_user, max_infections=0, population=None, whole_classrooms=False,
+                      stats=None, max_hops=None, max_edges=None, deadline=None):
+    """Infect close to max_infections users, keeping classrooms together where we can.
     
     * start_user is the user from whom to start graph traversal; they will be infected along
       with everyone reachable from them. If start_user is none, only traverse from the 
       pre-infected list in population. 
     * max_infections is the target number of users we'd like to be infected. if max_infections 
       is 0, return total_infection(start_user) instead.
+    * population is the Population to draw random users from once start_user's reachable
+      coaches are all infected; it defaults to start_user's own population, if any.
+    * whole_classrooms, if set, finishes the classroom of every infected coach once the
+      limit is reached, which may put us slightly over it as SPEC.txt allows.
+    * stats, an optional InfectionStats, is filled in with what the traversal did.
+    * max_hops, max_edges and deadline hold the traversal to a Budget; see there. No
+      random jumps are made with a max_hops.
+
+    Returns an InfectionResult, a set whose truncated flag is set if the budget stopped
+    the infection short of what it would otherwise have reached.
     """
-    to_infect = set([start_user])
-    infected_set = set()
     if max_infections == 0:
-        return total_infection(start_user=start_user)
-    while len(infected_set) < max_infections:
-        #if len(to_infect):
-        #    user = to_infect.pop()
-        #elif len(infected_set) < len( # get a reference to all students
-        try:
-            user = to_infect.pop()
-        except KeyError:
-            # pop from empty set means our population is smaller than max_infections
-            # so just return whatever we've calculated so far
-            return infected_set
-            # bug: 1-node graph (but overage is ok, so fix)
-        infected_set.add(user)
-        def keyfunc(coach):
-            # If we have many coaches, pick the one with the least infected students
-            return len( infected_set - coach.students() )
-        if len(user.coaches()) > 1:
-            coaches = sorted(user.coaches(), key=keyfunc)
-            add_infections = set((coaches.pop(0))).union(user.students()) - to_infect - infected_set
-        else:
-            add_infections = user.coaches().union(user.students()) - to_infect - infected_set
-        to_infect.update(add_infections)
+        return total_infection(start_user=start_user, stats=stats, max_hops=max_hops,
+                               max_edges=max_edges, deadline=deadline)
+    budget = None
+    if max_hops is not None or max_edges is not None or deadline is not None:
+        budget = Budget(max_hops, max_edges, deadline)
+    started = _lap(stats)
+    infected_set = InfectionResult()
+    for batch in iter_infection(start_user, population, max_infections=max_infections,
+                                classrooms=True, stats=stats, budget=budget):
+        infected_set.update(batch)
+    if budget is not None:
+        infected_set.truncated = budget.truncated
+    started = _lap(stats, 'traverse', started)
+    if whole_classrooms:
+        for user in list(infected_set):
+            infected_set.update(user.students())
+        _lap(stats, 'whole_classrooms', started)
+    if stats is not None:
+        stats.infected += len(infected_set)
+        stats.overshoot += max(0, len(infected_set) - int(max_infections))
+        stats.finished('limited_infection')
     return infected_set
 
-def total_infection(start_user=None, population=None):
+def total_infection(start_user=None, population=None, stats=None, max_hops=None,
+                    max_edges=None, deadline=None):
     """Keep walking across social graph until the entire connected component is infected.
     
     * start_user is the user from whom to start graph traversal; they will be infected along
@@ -64,19 +448,341 @@ def total_infection(start_user=None, population=None):
       pre-infected list in population. 
     * population is an optional Population object collecting a set of users. Use this to 
       traverse from both the start_user and also from the pre-seeded population infections.
+    * stats, an optional InfectionStats, is filled in with what the traversal did.
+    * max_hops, max_edges and deadline hold the traversal to a Budget; see there.
+
+    When a population is known, either passed in or because start_user belongs to one, its
+    component index answers the question with a lookup rather than a traversal, unless
+    there's a budget. Returns an InfectionResult, a set whose truncated flag is set if the
+    budget stopped the infection short of the whole component.
     """
-    to_infect = set()
-    infected_set = set()
     if start_user is None and population is None:
         raise TypeError, "Both start_user and population may not be unspecified."
-    if start_user and not population:
-        to_infect.update({start_user})
-    if population and not start_user:
-        to_infect.update(population.infected)
-    while len(to_infect) > 0:
-        user = to_infect.pop()
-        infected_set.add(user)
-        add_infections = user.coaches().union(user.students()) - to_infect - infected_set
-        to_infect.update(add_infections)
+    if max_hops is not None or max_edges is not None or deadline is not None:
+        budget = Budget(max_hops, max_edges, deadline)
+        started = _lap(stats)
+        infected_set = InfectionResult()
+        for batch in iter_infection(start_user, population, stats=stats, budget=budget):
+            infected_set.update(batch)
+        infected_set.truncated = budget.truncated
+        _lap(stats, 'traverse', started)
+        if stats is not None:
+            stats.infected += len(infected_set)
+            stats.finished('total_infection')
+        return infected_set
+    seeds = [] if start_user is None else [start_user]
+    if population is not None:
+        seeds.extend(population.infected)
+    else:
+        population = start_user.population
+    started = _lap(stats)
+    graph = getattr(start_user, 'graph', None)
+    if population is not None:
+        index = population.components()
+        started = _lap(stats, 'index', started)
+        uids = index.component_members([population.id_of(u) for u in seeds])
+        started = _lap(stats, 'lookup', started)
+        infected_set = InfectionResult(population.user_of(uid) for uid in uids)
+        _lap(stats, 'views', started)
+    elif graph is not None:
+        if stats is None:
+            uids = graph.component([start_user.id])
+        else:
+            uids = _counted_component(graph, start_user.id, stats)
+        started = _lap(stats, 'traverse', started)
+        infected_set = InfectionResult(GraphUser(graph, uid) for uid in uids)
+        _lap(stats, 'views', started)
+    else:
+        to_infect = set(seeds)
+        infected_set = InfectionResult()
+        work = scanned = peak = widest = 0
+        while len(to_infect) > 0:
+            user = to_infect.pop()
+            infected_set.add(user)
+            neighbours = user.coaches().union(user.students())
+            unqueued = neighbours - to_infect
+            to_infect.update(unqueued - infected_set)
+            if stats is not None:
+                work += len(neighbours) + len(unqueued)
+                scanned += len(user.coaches()) + len(user.students())
+                widest = max(widest, len(neighbours))
+                peak = max(peak, len(to_infect))
+        if stats is not None:
+            stats.nodes_popped += len(infected_set)
+            stats.set_difference_work += work
+            stats.edges_scanned += scanned
+            stats.add_peaks(max(peak, len(seeds)), widest)
+            _lap(stats, 'traverse', started)
+    if stats is not None:
+        stats.infected += len(infected_set)
+        stats.finished('total_infection')
+    return infected_set
+
+def _counted_component(graph, seed, stats):
+    """Graph.component() from one seed, adding what it did to stats"""
+    seen = bytearray(len(graph))
+    seen[seed] = 1
+    found = array(ID_TYPE, [seed])
+    scanned = peak = widest = 0
+    i = 0
+    while i < len(found):
+        degree = 0
+        for v in graph.neighbors(found[i]):
+            degree += 1
+            if not seen[v]:
+                seen[v] = 1
+                found.append(v)
+        i += 1
+        scanned += degree
+        widest = max(widest, degree)
+        peak = max(peak, len(found) - i)
+    stats.nodes_popped += len(found)
+    stats.edges_scanned += scanned
+    stats.add_peaks(peak, widest)
+    return found
+
+
+def _spread(starts, neighbors, has_feature):
+    """Return everyone reachable from starts without passing through a user with the feature"""
+    found = set(starts)
+    queue = deque(found)
+    while queue:
+        for neighbour in neighbors(queue.popleft()):
+            if neighbour not in found and not has_feature(neighbour):
+                found.add(neighbour)
+                queue.append(neighbour)
+    return found
+
+def infect_new_edges(edges, feature):
+    """Give feature to whoever must have it now that edges join them to someone who does.
+
+    * edges is a sequence of (coach, student) user pairs, already added to their graph.
+    * feature is a feature that was rolled out to whole components, by total_infection(),
+      Population.infect_components() or a RolloutScheduler, say.
+
+    Returns the set of users newly given the feature. Only edges with the feature on one
+    end and not the other matter; from the end without it we walk through users who
+    don't have it either, so the work done grows with the number of users infected and
+    their relationships rather than with everyone who already had the feature.
+    """
+    edges = list(edges)
+    if not edges:
+        return set()
+    graph = getattr(edges[0][0], 'graph', None)
+    if graph is not None:
+        edges = [(coach.id, student.id) for coach, student in edges]
+        has_feature = lambda uid: graph.features.has(feature, uid)
+        neighbors = graph.neighbors
+    else:
+        has_feature = lambda user: feature in user.features
+        neighbors = lambda user: chain(user.students(), user.coaches())
+    starts = []
+    for coach, student in edges:
+        coach_has, student_has = has_feature(coach), has_feature(student)
+        if coach_has != student_has:
+            starts.append(student if coach_has else coach)
+    infected_set = _spread(starts, neighbors, has_feature)
+    if graph is not None:
+        graph.features.grant(feature, infected_set)
+        return set(GraphUser(graph, uid) for uid in infected_set)
+    for user in infected_set:
+        user.features.add(feature)
+    return infected_set
+
+
+class _InComponents(object):
+    """The ids in any of the components labelled in taken, as a container"""
+    __slots__ = ('labels', 'taken')
+
+    def __init__(self, labels, taken):
+        self.labels = labels
+        self.taken = taken
+
+    def __contains__(self, uid):
+        return self.labels[uid] in self.taken
+
+def weighted_infection(start_user, max_weight, weights, population=None,
+                       whole_classrooms=False, stats=None):
+    """Infect users in limited_infection()'s order until their weights add up to max_weight.
+
+    * start_user is the user from whom to start; they are always infected.
+    * max_weight is the total weight we'd like infected.
+    * weights is a sequence of non-negative numbers indexed by population.id_of(user):
+      daily sessions, say, or a share of requests. Users of weight 0 are infected as
+      the order reaches them but count for nothing.
+    * population is the Population to draw random users from, as for
+      limited_infection(); it defaults to start_user's own, and one is required.
+    * whole_classrooms and stats are as for limited_infection().
+
+    Infection stops with the first user to bring the total to max_weight, so it goes
+    over by less than that user's weight. Classroom order fills a component before it
+    jumps to another, so when the population's component index is already built, a
+    component whose weight fits in what's left is taken whole from it, and only the
+    component the target falls in is traversed user by user. Without the index, the
+    traversal runs just as limited_infection()'s does. Returns an InfectionResult.
+    """
+    if population is None:
+        population = start_user.population
+    if population is None:
+        raise TypeError, "weighted_infection() needs a population to index weights by."
+    started = _lap(stats)
+    graph = population.id_graph()
+    infected = array(ID_TYPE)
+    total = 0
+    uid = population.id_of(start_user)
+    universe = xrange(len(graph))
+    if population.has_components():
+        index = population.components()
+        taken = set()   # labels of the components infected whole
+        outside = _InComponents(index.labels, taken)
+        while uid is not None:
+            weight = index.weight(uid, weights, max_weight - total)
+            if total + weight > max_weight:
+                break
+            infected.extend(index.members(uid))
+            taken.add(index.label(uid))
+            total += weight
+            uid = None if total >= max_weight else _random_uninfected(universe, outside)
+        universe = None
+    partial = []
+    if uid is not None:
+        order = _classroom_order(uid, graph.students_of, graph.coaches_of, universe, stats)
+        try:
+            for user in order:
+                partial.append(user)
+                total += weights[user]
+                if total >= max_weight:
+                    break
+        finally:
+            order.close()
+    started = _lap(stats, 'traverse', started)
+    if whole_classrooms and partial:
+        # components taken whole are whole classrooms already
+        reached = set(partial)
+        for coach in list(partial):
+            for student in graph.students_of(coach):
+                if student not in reached:
+                    reached.add(student)
+                    partial.append(student)
+        started = _lap(stats, 'whole_classrooms', started)
+    infected.extend(partial)
+    infected_set = InfectionResult(population.user_of(uid) for uid in infected)
+    _lap(stats, 'views', started)
+    if stats is not None:
+        stats.infected += len(infected_set)
+        stats.finished('weighted_infection')
     return infected_set
 
+# The graph total_infection_many() shares with its workers. Pool workers are
+# forked after this is set, so they see the parent's pages without a copy.
+_shared_graph = None
+
+def _component_of(seed):
+    return seed, _shared_graph.component([seed]).tostring()
+
+def total_infection_many(seeds, population, workers=None, sizes_only=False):
+    """Run total_infection() from each of seeds in turn and return the results in a list.
+
+    * seeds is a sequence of users of population.
+    * population is the Population they belong to.
+    * workers is the number of processes to traverse with; None means one per CPU, and
+      1 traverses in this process.
+    * sizes_only, if set, returns component sizes rather than sets of users.
+
+    Seeds in the same component share one result set, and each component is traversed
+    at most once. If population.components() is already built no traversal is needed at
+    all. Otherwise seeds are grouped by component with population.union_find(), which
+    is enough for sizes_only; for members, one seed per component is handed to forked
+    worker processes, which share the graph with us read-only.
+    """
+    graph = population.id_graph()
+    uids = [population.id_of(seed) for seed in seeds]
+    found = {}   # a component's label -> its members
+    if population.has_components():
+        index = population.components()
+        labels = [index.label(uid) for uid in uids]
+        for uid, label in zip(uids, labels):
+            if label not in found:
+                found[label] = index.members(uid)
+    else:
+        union_find = population.union_find()
+        labels = [union_find.find(uid) for uid in uids]
+        if sizes_only:
+            return [union_find.size(label) for label in labels]
+        # one seed to traverse from per component
+        representatives = dict(zip(labels, uids)).values()
+        global _shared_graph
+        workers = min(workers or multiprocessing.cpu_count(), len(representatives))
+        _shared_graph = graph
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        try:
+            if pool is not None:
+                results = pool.map(_component_of, representatives)
+            else:
+                results = map(_component_of, representatives)
+        finally:
+            _shared_graph = None
+            if pool is not None:
+                pool.close()
+                pool.join()
+        for seed, members in results:
+            found[union_find.find(seed)] = array(ID_TYPE, members)
+
+    if sizes_only:
+        return [len(found[label]) for label in labels]
+    results = {}
+    for label, members in found.iteritems():
+        results[label] = set(population.user_of(uid) for uid in members)
+    return [results[label] for label in labels]
+
+def exact_infection(population, n):
+    """Infect exactly n users of population by infecting whole connected components.
+
+    * population is the Population to infect. Components holding any of its pre-infected
+      users are always included and count towards n.
+    * n is the exact number of users to infect.
+
+    Choosing components is a subset-sum over component sizes. Real graphs have many
+    components of the same small size, so sizes are grouped and each group is split into
+    power-of-two bundles before a bitset DP over Python longs; the bitset kept before each
+    bundle lets us walk back and recover which components were used. Raises ValueError if
+    no choice of components adds up to n.
+    """
+    index = population.components()
+    forced = set(index.label(population.id_of(u)) for u in population.infected)
+    target = n - sum(index.size(label) for label in forced)
+    if target < 0:
+        raise ValueError, "Cannot infect exactly {} users; {} are infected already".format(
+            n, n - target)
+
+    by_size = {}
+    for label, size in index.sizes():
+        if label not in forced and size <= target:
+            by_size.setdefault(size, []).append(label)
+    bundles = []
+    for size, labels in by_size.iteritems():
+        remaining, k = len(labels), 1
+        while remaining:
+            k = min(k, remaining)
+            bundles.append((size, k))
+            remaining -= k
+            k *= 2
+
+    mask = (1 << (target + 1)) - 1
+    reachable = 1
+    before = []
+    for size, k in bundles:
+        before.append(reachable)
+        reachable |= (reachable << (size * k)) & mask
+    if not (reachable >> target) & 1:
+        raise ValueError, "Cannot infect exactly {} users with whole components".format(n)
+
+    taken = {}
+    for (size, k), reachable in reversed(zip(bundles, before)):
+        if not (reachable >> target) & 1:
+            target -= size * k
+            taken[size] = taken.get(size, 0) + k
+    labels = list(forced)
+    for size, k in taken.iteritems():
+        labels.extend(by_size[size][:k])
+    return set(population.user_of(uid) for uid in index.component_members(labels))
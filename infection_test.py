@@ -20,7 +20,12 @@ See SPEC.txt for details.
 
 import unittest
 
-from infection import limited_infection, total_infection
+from graph import Graph
+import infection
+from infection import (Budget, InfectionStats, exact_infection, infect_new_edges,
+                       iter_infection, limited_infection, total_infection,
+                       total_infection_many, weighted_infection)
+from population import Population
 from user import User
 
 
@@ -56,15 +61,23 @@ class LimitedInfectionTestCase(unittest.TestCase):
         self.assertEqual(set([A, B]), infected)
         
     def test_two_users_no_relation(self):
-        """Limited infection of independent users keeps trying until its full"""
+        """Limited infection of independent users keeps trying until its full
+
+        Unrelated users can only be reached by jumping, and jumps are made into
+        the users' population; bare users have none, so stop at their component.
+        """
         A = User()
         B = User()
+        Population(users=[A, B])
         infected = limited_infection(A, 1)
         self.assertEqual(set([A]), infected)
         infected = limited_infection(A, 2)
         self.assertEqual(set([A, B]), infected)
         infected = limited_infection(B, 1e7)
         self.assertEqual(set([A, B]), infected)
+        C = User()
+        User()
+        self.assertEqual(set([C]), limited_infection(C, 1e7))
 
     def test_two_users_cyclic(self):
         """Cyclic users still behave as expected."""
@@ -95,6 +108,41 @@ class LimitedInfectionTestCase(unittest.TestCase):
         self.assertEqual(set([A, B, C]), infected)
 
 
+class ClassroomInfectionTestCase(unittest.TestCase):
+    """Test that limited_infection() follows the coach-priority rule in SPEC.txt"""
+    def test_coach_with_most_infected_students_first(self):
+        C = User(); X = User(); Y = User(); S1 = User(); S2 = User()
+        C.add_student([S1, S2])
+        X.add_student([S1, S2])
+        Y.add_student(S1)
+        infected = limited_infection(C, 4)
+        self.assertEqual(set([C, S1, S2, X]), infected)
+
+    def test_random_jump_within_population(self):
+        """Unrelated users are reached through the population once the frontier is empty"""
+        A = User(); B = User()
+        p = Population(users=[A, B])
+        self.assertEqual(set([A, B]), limited_infection(A, 2, population=p))
+        self.assertEqual(set([A, B]), limited_infection(B, 1e7))
+
+    def test_whole_classrooms(self):
+        A = User(); B = User(); C = User()
+        A.add_student([B, C])
+        self.assertEqual(2, len(limited_infection(A, 2)))
+        self.assertEqual(set([A, B, C]), limited_infection(A, 2, whole_classrooms=True))
+
+    def test_graph_users(self):
+        g = Graph(100)
+        g.add_edges((0, student) for student in range(1, 10))
+        g.add_edge(50, 1)
+        A = g.user(0)
+        self.assertEqual(set(g.user(i) for i in range(10)), limited_infection(A, 10))
+        self.assertIn(g.user(50), limited_infection(A, 11))
+        self.assertEqual(11, len(limited_infection(A, 11)))
+        Population(graph=g)
+        self.assertEqual(60, len(limited_infection(A, 60)))
+
+
 class TotalInfectionTestCase(unittest.TestCase):
     # TODO: test total infection when calling limited infection here
 
@@ -167,5 +215,446 @@ class TotalInfectionTestCase(unittest.TestCase):
         self.assertEqual(set([A, B, C]), infected)
 
 
+class TotalInfectionManyTestCase(unittest.TestCase):
+    def _graph(self):
+        g = Graph(8)
+        g.add_edges([(0, 1), (1, 2), (3, 4)])
+        return g
+
+    def test_matches_total_infection(self):
+        for workers in (1, 2):
+            g = self._graph()
+            p = Population(graph=g)
+            seeds = [g.user(i) for i in (2, 0, 4, 7, 1)]
+            results = total_infection_many(seeds, p, workers=workers)
+            self.assertFalse(p.has_components())
+            self.assertEqual([total_infection(seed) for seed in seeds], results)
+            self.assertIs(results[0], results[1])
+
+    def test_one_traversal_per_component(self):
+        g = self._graph()
+        p = Population(graph=g)
+        traversed = []
+        component_of = infection._component_of
+        def counting(seed):
+            traversed.append(seed)
+            return component_of(seed)
+        infection._component_of = counting
+        try:
+            results = total_infection_many([g.user(i) for i in (0, 1, 2, 3, 4)], p, workers=1)
+        finally:
+            infection._component_of = component_of
+        self.assertEqual(2, len(traversed))
+        self.assertEqual([3, 3, 3, 2, 2], [len(result) for result in results])
+
+    def test_sizes_only(self):
+        g = self._graph()
+        p = Population(graph=g)
+        self.assertEqual([3, 2, 1], total_infection_many([g.user(i) for i in (1, 3, 5)], p,
+                                                         workers=2, sizes_only=True))
+        p.components()
+        self.assertEqual([3, 2, 1], total_infection_many([g.user(i) for i in (1, 3, 5)], p,
+                                                         sizes_only=True))
+
+    def test_plain_users(self):
+        A = User(); B = User(); C = User()
+        B.add_coach(A)
+        p = Population(users=[A, B, C])
+        self.assertEqual([set([A, B]), set([C]), set([A, B])],
+                         total_infection_many([A, C, B], p, workers=1))
+
+
+class InfectNewEdgesTestCase(unittest.TestCase):
+    """Test that infect_new_edges() spreads a feature across only the edges that need it"""
+    def setUp(self):
+        # 0 - 1 has the feature; 2 - 3, 4 - 5 and 6 don't
+        self.graph = Graph(7)
+        self.graph.add_edges([(0, 1), (2, 3), (4, 5)])
+        self.graph.features.grant('beta', [0, 1])
+        self.user = self.graph.user
+
+    def add(self, coach, student):
+        self.graph.add_edge(coach, student)
+        return self.user(coach), self.user(student)
+
+    def test_joins_uninfected_component(self):
+        edges = [self.add(1, 2)]
+        self.assertEqual(set([self.user(2), self.user(3)]), infect_new_edges(edges, 'beta'))
+        self.assertEqual([0, 1, 2, 3], list(self.graph.features.users(['beta'])))
+        # from the other direction, too
+        edges = [self.add(5, 0)]
+        self.assertEqual(set([self.user(4), self.user(5)]), infect_new_edges(edges, 'beta'))
+
+    def test_edges_that_change_nothing(self):
+        edges = [self.add(0, 3), self.add(3, 1)]
+        self.assertEqual(set([self.user(2), self.user(3)]), infect_new_edges(edges, 'beta'))
+        edges = [self.add(0, 2), self.add(5, 6)]
+        self.assertEqual(set(), infect_new_edges(edges, 'beta'))
+        self.assertEqual(set(), infect_new_edges([], 'beta'))
+        self.assertEqual(4, self.graph.features.count('beta'))
+
+    def test_plain_users(self):
+        A = User(); B = User(); C = User(); D = User()
+        A.add_student(B)
+        C.add_student(D)
+        for user in total_infection(A):
+            user.features.add('beta')
+        B.add_student(C)
+        self.assertEqual(set([C, D]), infect_new_edges([(B, C)], 'beta'))
+        self.assertIn('beta', D.features)
+
+
+class PathGraphTestCase(unittest.TestCase):
+    """A path 0 - 1 - 2 - ... - 9, a fork 0 - 10, and 11 on its own"""
+    def setUp(self):
+        self.graph = Graph(12)
+        self.graph.add_edges([(i, i + 1) for i in range(9)] + [(0, 10)])
+        self.user = self.graph.user
+
+    def ids(self, users):
+        return sorted(u.id for u in users)
+
+    def batch_ids(self, batches):
+        return [self.ids(batch) for batch in batches]
+
+
+class IterInfectionTestCase(PathGraphTestCase):
+    """Test the batches iter_infection() yields and the ways it can stop"""
+
+    def test_layers(self):
+        layers = self.batch_ids(iter_infection(self.user(0)))
+        self.assertEqual([[0], [1, 10], [2], [3], [4], [5], [6], [7], [8], [9]], layers)
+        self.assertEqual([[5], [4, 6], [3, 7], [2, 8], [1, 9], [0], [10]],
+                         self.batch_ids(iter_infection(self.user(5))))
+
+    def test_matches_total_infection(self):
+        users = [User() for i in range(6)]
+        users[0].add_student(users[1:3])
+        users[3].add_coach(users[2])
+        users[3].add_student(users[0])
+        infected = set()
+        for batch in iter_infection(users[1]):
+            self.assertFalse(infected.intersection(batch))
+            infected.update(batch)
+        self.assertEqual(total_infection(users[1]), infected)
+
+    def test_batches(self):
+        batches = list(iter_infection(self.user(0), batch_size=4))
+        self.assertEqual([4, 4, 3], [len(batch) for batch in batches])
+
+    def test_max_infections(self):
+        batches = self.batch_ids(iter_infection(self.user(0), max_infections=4))
+        self.assertEqual([[0], [1, 10], [2]], batches)
+        self.assertEqual([], list(iter_infection(self.user(0), max_infections=0)))
+
+    def test_until(self):
+        batches = self.batch_ids(iter_infection(self.user(0), until=lambda u: u.id == 3))
+        self.assertEqual([[0], [1, 10], [2], [3]], batches)
+
+    def test_deadline(self):
+        self.assertEqual([[0]], self.batch_ids(iter_infection(self.user(0), deadline=0)))
+
+    def test_population_seeds(self):
+        p = Population(graph=self.graph)
+        p.graph.features.grant('X', [11])
+        self.assertEqual([[11]], self.batch_ids(iter_infection(population=p)))
+        self.assertEqual([[0, 11], [1, 10]], self.batch_ids(iter_infection(self.user(0), p))[:2])
+
+    def test_classrooms(self):
+        self.assertEqual([[0, 1, 10], [2, 3]],
+                         self.batch_ids(iter_infection(self.user(0), classrooms=True,
+                                                 batch_size=3, max_infections=5)))
+        with self.assertRaises(TypeError):
+            list(iter_infection(population=Population(graph=self.graph), classrooms=True))
+
+    def test_stop_early(self):
+        """Counters still reach stats when the consumer stops early"""
+        stats = InfectionStats()
+        layers = iter_infection(self.user(0), stats=stats)
+        next(layers)
+        next(layers)
+        layers.close()
+        self.assertEqual(1, stats.nodes_popped)
+        self.assertEqual(2, stats.max_degree)
+
+
+class InfectionStatsTestCase(unittest.TestCase):
+    """Test the counters total_infection() and limited_infection() fill in"""
+    def test_limited_overshoot(self):
+        A = User(); B = User(); C = User()
+        A.add_student([B, C])
+        stats = InfectionStats()
+        limited_infection(A, 2, whole_classrooms=True, stats=stats)
+        self.assertEqual(3, stats.infected)
+        self.assertEqual(1, stats.overshoot)
+        self.assertEqual(2, stats.max_degree)
+        self.assertGreaterEqual(stats.nodes_popped, 2)
+        self.assertIn('traverse', stats.seconds)
+        self.assertIn('whole_classrooms', stats.seconds)
+
+    def test_graph_star(self):
+        """A coach with many students shows up as max_degree and frontier_peak"""
+        g = Graph(1001)
+        g.add_edges((0, student) for student in range(1, 1001))
+        stats = InfectionStats()
+        self.assertEqual(1001, len(total_infection(g.user(0), stats=stats)))
+        self.assertEqual(1001, stats.nodes_popped)
+        self.assertEqual(2000, stats.edges_scanned)
+        self.assertEqual(1000, stats.max_degree)
+        self.assertEqual(1000, stats.frontier_peak)
+
+        stats = InfectionStats()
+        self.assertEqual(10, len(limited_infection(g.user(0), 10, stats=stats)))
+        self.assertEqual(10, stats.infected)
+        self.assertEqual(0, stats.overshoot)
+        self.assertEqual(1000, stats.frontier_peak)
+
+    def test_plain_users(self):
+        A = User(); B = User(); C = User()
+        A.add_student([B, C])
+        stats = InfectionStats()
+        total_infection(A, stats=stats)
+        self.assertEqual(3, stats.nodes_popped)
+        self.assertEqual(4, stats.edges_scanned)
+        self.assertGreater(stats.set_difference_work, 0)
+
+    def test_sums_over_calls(self):
+        calls = []
+        class Recorder(InfectionStats):
+            def finished(self, function):
+                calls.append(function)
+        A = User(); B = User()
+        A.add_student(B)
+        stats = Recorder()
+        total_infection(A, stats=stats)
+        limited_infection(A, 1, stats=stats)
+        self.assertEqual(['total_infection', 'limited_infection'], calls)
+        self.assertEqual(3, stats.as_dict()['infected'])
+
+    def test_index_lookup(self):
+        g = Graph(10)
+        g.add_edge(0, 1)
+        p = Population(graph=g)
+        stats = InfectionStats()
+        self.assertEqual(2, len(total_infection(g.user(0), population=p, stats=stats)))
+        self.assertEqual(0, stats.nodes_popped)
+        self.assertIn('lookup', stats.seconds)
+
+
+class BoundedInfectionTestCase(PathGraphTestCase):
+    """Test the hop, edge and deadline limits and the truncated flag"""
+    def test_unbounded(self):
+        infected = total_infection(self.user(0))
+        self.assertEqual(11, len(infected))
+        self.assertFalse(infected.truncated)
+        self.assertFalse(limited_infection(self.user(0), 3).truncated)
+
+    def test_max_hops(self):
+        infected = total_infection(self.user(0), max_hops=2)
+        self.assertEqual([0, 1, 2, 10], self.ids(infected))
+        self.assertTrue(infected.truncated)
+        self.assertEqual([0], self.ids(total_infection(self.user(0), max_hops=0)))
+        infected = total_infection(self.user(5), max_hops=20)
+        self.assertEqual(11, len(infected))
+        self.assertFalse(infected.truncated)
+
+    def test_max_edges(self):
+        infected = total_infection(self.user(0), max_edges=3)
+        self.assertEqual([0, 1, 10], self.ids(infected))
+        self.assertTrue(infected.truncated)
+        self.assertFalse(total_infection(self.user(0), max_edges=100).truncated)
+
+    def test_deadline(self):
+        infected = total_infection(self.user(0), deadline=0)
+        self.assertEqual([0], self.ids(infected))
+        self.assertTrue(infected.truncated)
+        self.assertFalse(total_infection(self.user(11), deadline=0).truncated)
+
+    def test_population(self):
+        p = Population(graph=self.graph)
+        infected = total_infection(self.user(0), population=p, max_hops=1)
+        self.assertEqual([0, 1, 10], self.ids(infected))
+        self.assertTrue(infected.truncated)
+
+    def test_plain_users(self):
+        A = User(); B = User(); C = User()
+        A.add_student(B)
+        B.add_student(C)
+        infected = total_infection(A, max_hops=1)
+        self.assertEqual(set([A, B]), infected)
+        self.assertTrue(infected.truncated)
+
+    def test_limited(self):
+        infected = limited_infection(self.user(0), 8, max_hops=1)
+        self.assertEqual([0, 1, 10], self.ids(infected))
+        self.assertTrue(infected.truncated)
+        infected = limited_infection(self.user(0), 2, max_hops=1)
+        self.assertEqual(2, len(infected))
+        self.assertFalse(infected.truncated)
+
+    def test_limited_shortest_paths(self):
+        """Classroom order reaching a user the long way round doesn't cut off its neighbours"""
+        g = Graph(6)
+        g.add_edges([(0, 1), (1, 2), (2, 3), (4, 0), (4, 3), (3, 5)])
+        infected = limited_infection(g.user(0), 100, max_hops=3)
+        self.assertEqual(range(6), self.ids(infected))
+        self.assertFalse(infected.truncated)
+
+    def test_budget_with_max_hops(self):
+        """max_edges and deadline still hold when combined with max_hops"""
+        infected = limited_infection(self.user(0), 100, max_hops=5, max_edges=3)
+        self.assertTrue(infected.truncated)
+        self.assertGreaterEqual(3, len(infected))
+        infected = limited_infection(self.user(0), 100, max_hops=5, deadline=0)
+        self.assertEqual([0], self.ids(infected))
+        self.assertTrue(infected.truncated)
+
+    def test_no_jumps(self):
+        """With a max_hops, limited_infection doesn't jump to unrelated users"""
+        infected = limited_infection(self.user(11), 5, max_hops=3)
+        self.assertEqual([11], self.ids(infected))
+        self.assertFalse(infected.truncated)
+
+    def test_budget(self):
+        budget = Budget(max_edges=3)
+        self.assertTrue(budget.expand(2))
+        self.assertFalse(budget.expand(2))
+        self.assertTrue(budget.truncated)
+        self.assertTrue(budget.expand(1))
+        self.assertEqual(3, budget.edges)
+
+
+class WeightedInfectionTestCase(unittest.TestCase):
+    """Test weighted_infection() against headcounts and weights"""
+    def setUp(self):
+        # 0 coaches 1 and 2; 3 coaches 4; 5 on its own
+        self.graph = Graph(6)
+        self.graph.add_edges([(0, 1), (0, 2), (3, 4)])
+        self.population = Population(graph=self.graph)
+        self.user = self.graph.user
+
+    def ids(self, users):
+        return sorted(u.id for u in users)
+
+    def test_whole_components(self):
+        weights = [1, 1, 1, 0, 10, 2]
+        self.assertEqual([0, 1, 2], self.ids(weighted_infection(self.user(0), 3, weights)))
+
+    def test_within_a_component(self):
+        weights = [1, 1, 1, 0, 10, 2]
+        infected = weighted_infection(self.user(0), 2, weights)
+        self.assertEqual(2, len(infected))
+        self.assertIn(self.user(0), infected)
+        # the heavy student goes over the target, by less than their own weight
+        self.assertEqual([3, 4], self.ids(weighted_infection(self.user(3), 5, weights)))
+
+    def test_dormant_users_are_free(self):
+        weights = [0, 0, 0, 0, 0, 2]
+        infected = weighted_infection(self.user(0), 2, weights)
+        self.assertIn(self.user(5), infected)
+        self.assertEqual([0, 1, 2], self.ids(infected)[:3])
+
+    def test_with_index(self):
+        """With the component index built, the same targets give the same users"""
+        weights = [1, 1, 1, 0, 10, 2]
+        self.population.components()
+        self.assertEqual([0, 1, 2], self.ids(weighted_infection(self.user(0), 3, weights)))
+        self.assertEqual(2, len(weighted_infection(self.user(0), 2, weights)))
+        self.assertEqual([3, 4], self.ids(weighted_infection(self.user(3), 5, weights)))
+        # the first component fits, and whichever comes next carries us past 5
+        infected = self.ids(weighted_infection(self.user(0), 5, weights))
+        self.assertEqual([0, 1, 2], infected[:3])
+        self.assertGreaterEqual(sum(weights[uid] for uid in infected), 5)
+
+    def test_whole_classrooms(self):
+        g = Graph(5)
+        g.add_edges((0, student) for student in range(1, 5))
+        Population(graph=g)
+        self.assertEqual(2, len(weighted_infection(g.user(0), 2, [1] * 5)))
+        self.assertEqual(5, len(weighted_infection(g.user(0), 2, [1] * 5,
+                                                   whole_classrooms=True)))
+
+    def test_matches_limited_infection(self):
+        """Unit weights infect as many users as limited_infection() would"""
+        p = Population()
+        p.randomize_graph(2000, seed=3)
+        ones = [1] * 2000
+        for uid, k in [(0, 1), (5, 50), (17, 700), (99, 2000)]:
+            user = p.graph.user(uid)
+            infected = weighted_infection(user, k, ones)
+            self.assertEqual(len(limited_infection(user, k)), len(infected))
+            self.assertIn(user, infected)
+            index = p.components()
+            whole = [label for label in set(index.label(u.id) for u in infected)
+                     if index.size(label) == sum(1 for u in infected
+                                                 if index.label(u.id) == label)]
+            self.assertGreaterEqual(len(whole), len(set(index.label(u.id) for u in infected)) - 1)
+
+    def test_plain_users(self):
+        A = User(); B = User(); C = User()
+        A.add_student(B)
+        p = Population([A, B, C])
+        weights = [0] * 3
+        weights[p.id_of(C)] = 5
+        self.assertEqual(set([A, B, C]), weighted_infection(A, 5, weights))
+        with self.assertRaises(TypeError):
+            weighted_infection(User(), 1, [1])
+
+    def test_stats(self):
+        stats = InfectionStats()
+        weighted_infection(self.user(0), 2, [1] * 6, stats=stats)
+        self.assertEqual(2, stats.infected)
+        self.assertIn('traverse', stats.seconds)
+
+
+class ExactInfectionTestCase(unittest.TestCase):
+    def _population(self, *sizes):
+        """Build a graph-backed population of chains with the given sizes"""
+        g = Graph(sum(sizes))
+        edges = []
+        first = 0
+        for size in sizes:
+            edges.extend((uid, uid + 1) for uid in range(first, first + size - 1))
+            first += size
+        g.add_edges(edges)
+        return Population(graph=g)
+
+    def test_exact_counts(self):
+        p = self._population(1, 3, 3, 5, 8)
+        for n in (0, 1, 3, 4, 6, 7, 9, 11, 12, 20):
+            infected = exact_infection(p, n)
+            self.assertEqual(n, len(infected))
+            for user in infected:
+                self.assertLessEqual(total_infection(user), infected)
+
+    def test_impossible_counts(self):
+        p = self._population(3, 3, 5)
+        for n in (1, 2, 4, 7, 12):
+            with self.assertRaises(ValueError):
+                exact_infection(p, n)
+
+    def test_pre_infected_components_count(self):
+        p = self._population(2, 2, 3)
+        p.graph.user(0).features.add('A')
+        p = Population(graph=p.graph)
+        self.assertIn(p.graph.user(1), exact_infection(p, 4))
+        self.assertEqual(5, len(exact_infection(p, 5)))
+        with self.assertRaises(ValueError):
+            exact_infection(p, 1)
+
+    def test_plain_users(self):
+        A = User(); B = User(); C = User()
+        B.add_coach(A)
+        p = Population(users=[A, B, C])
+        self.assertEqual(set([A, B]), exact_infection(p, 2))
+        self.assertEqual(set([A, B, C]), exact_infection(p, 3))
+
+    def test_many_repeated_sizes(self):
+        p = self._population(*([2] * 500 + [7] * 300))
+        self.assertEqual(2101, len(exact_infection(p, 2101)))
+        with self.assertRaises(ValueError):
+            exact_infection(p, 3102)
+
+
 if __name__ == "__main__":
     unittest.main()
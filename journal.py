@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Implement FeatureJournal, an append-only log of feature grants that can undo them
+
+Population.toggle_infections(None) takes every feature from everyone. When one
+rollout goes bad we want to pull just that feature, or just its last stage,
+and leave other experiments be. A FeatureJournal listens to a FeatureRegistry
+and logs every grant and revoke as an Entry: what, which feature, the stage it
+was tagged with, when, and the ids. Alongside the log it keeps one bitmap per
+feature and stage of the ids that stage granted and still hold the feature, so
+rollback() is a few operations over Python longs and a single bulk revoke,
+however many users it touches.
+
+Given a path, entries are also appended to a file there, each a JSON header
+line followed by its ids as raw bytes, and a journal opened on that path
+again replays them.
+"""
+
+
+from array import array
+from collections import namedtuple
+import json
+import os
+import sys
+import time
+
+from features import difference_of, ids_in, union_of
+from graph import ID_TYPE
+
+
+GRANT = 'grant'
+REVOKE = 'revoke'
+
+
+class Entry(namedtuple('Entry', 'action feature stage timestamp uids')):
+    """One logged change: action is GRANT or REVOKE
+
+    uids is an array of ids, or, for revokes made in bulk, a bitmap with bit
+    uid set for each id.
+    """
+    __slots__ = ()
+
+    def ids(self):
+        """Return the ids of the entry as a list"""
+        if isinstance(self.uids, bytearray):
+            return list(ids_in(self.uids))
+        return self.uids.tolist()
+
+
+class FeatureJournal(object):
+    """An append-only log of the grants and revokes made through registry
+
+    Grants are tagged with stage, a number or string which callers set before
+    each stage of a rollout goes out; None is a stage like any other.
+    """
+
+    def __init__(self, registry, path=None):
+        self.registry = registry
+        self.path = path
+        self.stage = None
+        self.entries = []
+        self._held = {}     # (feature, stage) -> bitmap of ids that stage granted
+        if path is not None and os.path.exists(path):
+            for entry in _read(path):
+                self._apply(entry)
+        self._file = None if path is None else open(path, 'ab')
+        registry.listeners.append(self)
+
+    def close(self):
+        """Stop listening to the registry and close the journal file, if any"""
+        if self in self.registry.listeners:
+            self.registry.listeners.remove(self)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stages(self, feature):
+        """Return the stages that granted feature, in the order they were first seen"""
+        seen = []
+        for entry in self.entries:
+            if entry.feature == feature and entry.action == GRANT and entry.stage not in seen:
+                seen.append(entry.stage)
+        return seen
+
+    def held(self, feature, stage=None):
+        """Return a bitmap of the ids stage gave feature that still have it
+
+        Without a stage, return those of every stage.
+        """
+        return union_of((bitmap for (name, tagged), bitmap in self._held.iteritems()
+                         if name == feature and (stage is None or tagged == stage)),
+                        len(self.registry.bitmap(feature)))
+
+    def rollback(self, feature, stage=None):
+        """Take feature back from the ids stage granted it to, or all stages without one
+
+        Only ids the journal saw granted are touched, so users who had feature
+        before the journal started keep it. Returns a bitmap of the ids that lost it.
+        """
+        return self.registry.revoke_bitmap(feature, self.held(feature, stage))
+
+    def features_granted(self, feature, uids):
+        self._record(Entry(GRANT, feature, self.stage, time.time(), array(ID_TYPE, uids)))
+
+    def features_revoked(self, feature, uids):
+        self._record(Entry(REVOKE, feature, self.stage, time.time(), array(ID_TYPE, uids)))
+
+    def features_revoked_bitmap(self, feature, bitmap):
+        self._record(Entry(REVOKE, feature, self.stage, time.time(), bytearray(bitmap)))
+
+    def _record(self, entry):
+        self._apply(entry)
+        if self._file is not None:
+            _write(self._file, entry)
+
+    def _apply(self, entry):
+        self.entries.append(entry)
+        if entry.action == GRANT:
+            key = (entry.feature, entry.stage)
+            bitmap = self._held.setdefault(key, bytearray())
+            for uid in entry.uids:
+                if uid >> 3 >= len(bitmap):
+                    bitmap.extend(bytearray((uid >> 3) + 1 - len(bitmap)))
+                bitmap[uid >> 3] |= 1 << (uid & 7)
+            return
+        for key, bitmap in self._held.iteritems():
+            if key[0] != entry.feature:
+                continue
+            if isinstance(entry.uids, bytearray):
+                bitmap[:] = difference_of(bitmap, entry.uids)
+                continue
+            for uid in entry.uids:
+                if uid >> 3 < len(bitmap):
+                    bitmap[uid >> 3] &= ~(1 << (uid & 7)) & 0xff
+
+
+def _write(f, entry):
+    bulk = isinstance(entry.uids, bytearray)
+    header = dict(action=entry.action, feature=entry.feature, stage=entry.stage,
+                  timestamp=entry.timestamp, bitmap=bulk, length=len(entry.uids))
+    f.write(json.dumps(header, sort_keys=True) + '\n')
+    if bulk:
+        f.write(entry.uids)
+    else:
+        uids = entry.uids
+        if sys.byteorder == 'big':
+            uids = array(ID_TYPE, uids)
+            uids.byteswap()
+        uids.tofile(f)
+    f.flush()
+
+def _read(path):
+    """Yield the Entries of the journal file at path"""
+    with open(path, 'rb') as f:
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            if not line.endswith('\n'):
+                raise ValueError, "{} ends in the middle of an entry".format(path)
+            header = json.loads(line)
+            if header['bitmap']:
+                uids = bytearray(f.read(header['length']))
+                short = len(uids) < header['length']
+            else:
+                uids = array(ID_TYPE)
+                try:
+                    uids.fromfile(f, header['length'])
+                    short = False
+                except EOFError:
+                    short = True
+                if sys.byteorder == 'big':
+                    uids.byteswap()
+            if short:
+                raise ValueError, "{} ends in the middle of an entry".format(path)
+            yield Entry(header['action'], header['feature'], header['stage'],
+                        header['timestamp'], uids)
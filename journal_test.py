@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for FeatureJournal and Population.rollback()"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from features import FeatureRegistry, ids_in
+from graph import Graph
+from journal import GRANT, REVOKE, FeatureJournal
+from population import Population
+from user import User
+
+
+class FeatureJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = FeatureRegistry(100)
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_log(self):
+        journal = FeatureJournal(self.registry)
+        journal.stage = 1
+        self.registry.grant('A', [1, 2])
+        self.registry.grant('A', [2, 3])
+        journal.stage = 2
+        self.registry.revoke('A', [1])
+        self.assertEqual([(GRANT, 'A', 1, [1, 2]), (GRANT, 'A', 1, [3]), (REVOKE, 'A', 2, [1])],
+                         [(e.action, e.feature, e.stage, e.ids()) for e in journal.entries])
+        self.assertLessEqual(journal.entries[-1].timestamp, time.time())
+        self.assertEqual([1], journal.stages('A'))
+
+    def test_rollback_stage(self):
+        self.registry.grant('A', [0])           # before the journal; never rolled back
+        journal = FeatureJournal(self.registry)
+        journal.stage = 'one'
+        self.registry.grant('A', range(10))
+        self.registry.grant('B', range(10))
+        journal.stage = 'two'
+        self.registry.grant('A', range(10, 30))
+        self.assertEqual(range(10, 30), list(ids_in(journal.rollback('A', 'two'))))
+        self.assertEqual(range(10), list(self.registry.users(['A'])))
+        self.assertEqual(range(10), list(self.registry.users(['B'])))
+        self.assertEqual(REVOKE, journal.entries[-1].action)
+        self.assertEqual(range(10, 30), journal.entries[-1].ids())
+        self.assertEqual([], list(ids_in(journal.rollback('A', 'two'))))
+
+    def test_rollback_feature(self):
+        journal = FeatureJournal(self.registry)
+        for stage in range(3):
+            journal.stage = stage
+            self.registry.grant('A', range(10 * stage, 10 * stage + 10))
+        self.registry.grant('B', [5])
+        journal.rollback('A')
+        self.assertEqual(0, self.registry.count('A'))
+        self.assertEqual(1, self.registry.count('B'))
+
+    def test_regranted(self):
+        """A user revoked and granted again belongs to the later stage only"""
+        journal = FeatureJournal(self.registry)
+        journal.stage = 1
+        self.registry.grant('A', [1, 2])
+        self.registry.revoke('A', [2])
+        journal.stage = 2
+        self.registry.grant('A', [2])
+        journal.rollback('A', 1)
+        self.assertEqual([2], list(self.registry.users(['A'])))
+
+    def test_file(self):
+        path = os.path.join(self.tmp, 'journal')
+        journal = FeatureJournal(self.registry, path)
+        journal.stage = 1
+        self.registry.grant('A', [1, 2, 40])
+        journal.stage = 2
+        self.registry.grant('A', [50, 60])
+        journal.rollback('A', 2)
+        journal.close()
+        self.assertNotIn(journal, self.registry.listeners)
+
+        registry = FeatureRegistry(100)
+        registry.grant('A', [1, 2, 40, 99])
+        again = FeatureJournal(registry, path)
+        self.assertEqual([(e.action, e.stage, e.ids()) for e in journal.entries],
+                         [(e.action, e.stage, e.ids()) for e in again.entries])
+        again.rollback('A')
+        self.assertEqual([99], list(registry.users(['A'])))
+        again.close()
+        self.assertEqual(4, len(FeatureJournal(FeatureRegistry(100), path)))
+
+    def test_torn_file(self):
+        path = os.path.join(self.tmp, 'journal')
+        journal = FeatureJournal(self.registry, path)
+        self.registry.grant('A', range(10))
+        journal.close()
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:-3])
+        with self.assertRaises(ValueError):
+            FeatureJournal(FeatureRegistry(100), path)
+
+    def test_million(self):
+        """Rolling back a million users is a bulk operation"""
+        registry = FeatureRegistry(1000000)
+        journal = FeatureJournal(registry)
+        registry.grant_all('A')
+        start = time.time()
+        journal.rollback('A')
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(0, registry.count('A'))
+
+
+class PopulationRollbackTestCase(unittest.TestCase):
+    def test_graph(self):
+        g = Graph(20)
+        g.add_edges([(0, 1), (2, 3), (4, 5)])
+        p = Population(graph=g)
+        journal = p.journal()
+        self.assertIs(journal, p.journal())
+        journal.stage = 1
+        p.infect_components('A', [g.user(0)])
+        p.infect_components('B', [g.user(0)])
+        journal.stage = 2
+        p.infect_components('A', [g.user(2), g.user(4)])
+        self.assertEqual(4, p.rollback('A', 2))
+        self.assertEqual([0, 1], list(g.features.users(['A'])))
+        self.assertEqual(2, p.rollback('A'))
+        self.assertEqual([0, 1], list(g.features.users(['B'])))
+
+    def test_roles_follow(self):
+        g = Graph(4)
+        g.add_edges([(0, 1), (0, 2)])
+        p = Population(graph=g)
+        roles = p.roles('A')
+        p.journal()
+        p.infect_components('A', [g.user(0)])
+        self.assertEqual([(0, 2)], roles.top_coaches(1))
+        p.rollback('A')
+        self.assertEqual(0, roles.infected_students[0])
+
+    def test_plain_users(self):
+        users = [User() for i in range(4)]
+        users[0].add_student(users[1])
+        users[2].add_student(users[3])
+        p = Population(users)
+        p.journal().stage = 'beta'
+        p.infect_components('A', [users[0]])
+        p.infect_components('A', [users[2]])
+        users[3].features.add('B')
+        self.assertEqual(4, p.rollback('A'))
+        self.assertEqual([set(), set(), set(), set(['B'])], [u.features for u in users])
+
+
+if __name__ == "__main__":
+    unittest.main()
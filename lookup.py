@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Answer "does user X have feature F?" from a frozen, memory-mapped lookup file
+
+A rollout ends with features granted in a FeatureRegistry; serving needs only
+to read them, many times a second, from many processes. write_lookup() freezes
+a registry into a file holding, for each feature, whichever is smaller of a
+bitmap with one bit per user and a sorted array of the ids that have it. Sorted
+arrays may carry a Bloom filter in front, so most ids without the feature are
+turned away before a binary search.
+
+FeatureLookup maps such a file copy-on-write, like snapshot.py does, so opening
+one is quick whatever its size, and processes serving from the same file share
+its pages. publish_lookup() replaces a file atomically by renaming a finished
+one over it, and LookupHandle notices and swaps to the new file between
+queries, so a new rollout stage goes live without readers ever seeing half of
+one.
+"""
+
+
+from array import array
+from bisect import bisect_left
+import ctypes
+import json
+import mmap
+import os
+import struct
+import sys
+
+from features import ids_in
+from graph import ID_TYPE
+
+
+MAGIC = 'INFLOOK\x00'
+VERSION = 1
+_PREAMBLE = struct.Struct('<8sII')
+_MASK32 = 0xffffffff
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+def _bloom_bits(uid, nbits, hashes):
+    """Yield the Bloom filter bit numbers of uid, by double hashing"""
+    h1 = (uid * 2654435761) & _MASK32
+    h2 = (((uid ^ (uid >> 16)) * 0x45d9f3b) & _MASK32) | 1
+    for i in xrange(hashes):
+        yield (h1 + i * h2) % nbits
+
+def _bloom(uids, nbits, hashes):
+    bloom = bytearray((nbits + 7) // 8)
+    for uid in uids:
+        for bit in _bloom_bits(uid, nbits, hashes):
+            bloom[bit >> 3] |= 1 << (bit & 7)
+    return bloom
+
+def write_lookup(registry, path, features=None, bloom_bits=0, meta=None):
+    """Freeze features of a FeatureRegistry, all of them by default, into a lookup file
+
+    * bloom_bits, if set, is the number of Bloom filter bits per id to put in
+      front of each sorted id array; 10 turns away all but about 1% of misses.
+    * meta is any JSON-able value to store alongside, a rollout stage say.
+    """
+    features = list(registry) if features is None else list(features)
+    sections = []
+    header = {'N': registry.N, 'byteorder': sys.byteorder, 'meta': meta, 'features': {}}
+    for feature in features:
+        bitmap = registry.bitmap(feature)
+        count = registry.count(feature)
+        entry = {'count': count}
+        if 4 * count < len(bitmap):
+            ids = array(ID_TYPE, ids_in(bitmap))
+            entry['sorted'] = len(sections)
+            sections.append(ids)
+            if bloom_bits and count:
+                nbits = max(64, count * bloom_bits)
+                hashes = max(1, int(round(0.693 * nbits / count)))
+                entry['bloom'] = [len(sections), nbits, hashes]
+                sections.append(_bloom(ids, nbits, hashes))
+        else:
+            entry['bitmap'] = len(sections)
+            sections.append(bitmap)
+        header['features'][feature] = entry
+
+    # section offsets go in the header, so lay them out after a guess at its
+    # length and try again with more room if the guess was short
+    guess = 0
+    while True:
+        offset = _align(_PREAMBLE.size + guess)
+        header['sections'] = []
+        for data in sections:
+            header['sections'].append([offset, len(buffer(data))])
+            offset = _align(offset + len(buffer(data)))
+        encoded = json.dumps(header, sort_keys=True)
+        if _PREAMBLE.size + len(encoded) <= _align(_PREAMBLE.size + guess):
+            break
+        guess = len(encoded) + 64
+
+    with open(path, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(encoded)))
+        f.write(encoded)
+        for (start, length), data in zip(header['sections'], sections):
+            f.seek(start)
+            f.write(buffer(data))
+        f.truncate(offset)
+
+def publish_lookup(registry, path, features=None, bloom_bits=0, meta=None):
+    """Like write_lookup(), but replace any file at path in one atomic rename"""
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    write_lookup(registry, temporary, features, bloom_bits, meta)
+    os.rename(temporary, path)
+
+
+class FeatureLookup(object):
+    """A read-only view of the features frozen into a lookup file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            self.stat = os.fstat(f.fileno())
+        magic, version, length = _PREAMBLE.unpack_from(self._mapped, 0)
+        if magic != MAGIC:
+            raise ValueError, "{} is not a feature lookup file".format(path)
+        if version != VERSION:
+            raise ValueError, "{} is lookup version {}; we read version {}".format(
+                path, version, VERSION)
+        header = json.loads(self._mapped[_PREAMBLE.size:_PREAMBLE.size + length])
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError, "{} was written on a {}-endian machine".format(
+                path, header['byteorder'])
+        self.N = header['N']
+        self.meta = header['meta']
+        self._counts = {}
+        self._bitmaps = {}
+        self._sorted = {}
+        self._blooms = {}
+        sections = header['sections']
+        view = lambda ctype, i: (ctype * (sections[i][1] // ctypes.sizeof(ctype))).from_buffer(
+            self._mapped, sections[i][0])
+        for feature, entry in header['features'].iteritems():
+            feature = feature.encode('utf-8')
+            self._counts[feature] = entry['count']
+            if 'bitmap' in entry:
+                self._bitmaps[feature] = view(ctypes.c_ubyte, entry['bitmap'])
+            else:
+                self._sorted[feature] = view(ctypes.c_int, entry['sorted'])
+            if 'bloom' in entry:
+                i, nbits, hashes = entry['bloom']
+                self._blooms[feature] = (view(ctypes.c_ubyte, i), nbits, hashes)
+
+    def __iter__(self):
+        return iter(sorted(self._counts))
+
+    def __contains__(self, feature):
+        return feature in self._counts
+
+    def count(self, feature):
+        """Return the number of users with feature"""
+        return self._counts.get(feature, 0)
+
+    def has(self, feature, uid):
+        """Return True if uid has feature"""
+        bitmap = self._bitmaps.get(feature)
+        if bitmap is not None:
+            return 0 <= uid < self.N and bool(bitmap[uid >> 3] >> (uid & 7) & 1)
+        ids = self._sorted.get(feature)
+        if ids is None:
+            return False
+        bloom = self._blooms.get(feature)
+        if bloom is not None:
+            bits, nbits, hashes = bloom
+            for bit in _bloom_bits(uid, nbits, hashes):
+                if not bits[bit >> 3] >> (bit & 7) & 1:
+                    return False
+        i = bisect_left(ids, uid)
+        return i < len(ids) and ids[i] == uid
+
+    def has_many(self, feature, uids):
+        """Return a list of has(feature, uid) for each of uids"""
+        has = self.has
+        return [has(feature, uid) for uid in uids]
+
+    def features_of(self, uid):
+        """Return the set of features uid has"""
+        return set(feature for feature in self._counts if self.has(feature, uid))
+
+
+class LookupHandle(object):
+    """The FeatureLookup at path, swapped for a new one whenever path is replaced
+
+    refresh() is cheap, one stat() call, so calling it before every request or
+    batch of requests is fine. A swap is a single assignment, so a concurrent
+    reader sees either the old lookup or the new one; the old one stays mapped
+    for as long as anyone still holds it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lookup = FeatureLookup(path)
+
+    def refresh(self):
+        """Reopen path if it has been replaced; return True if it was"""
+        stat = os.stat(self.path)
+        old = self.lookup.stat
+        if (stat.st_ino, stat.st_mtime, stat.st_size) == (old.st_ino, old.st_mtime,
+                                                           old.st_size):
+            return False
+        self.lookup = FeatureLookup(self.path)
+        return True
+
+    def has(self, feature, uid):
+        return self.lookup.has(feature, uid)
+
+    def has_many(self, feature, uids):
+        return self.lookup.has_many(feature, uids)
+
+    def features_of(self, uid):
+        return self.lookup.features_of(uid)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for frozen feature lookup files"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from features import FeatureRegistry
+from lookup import FeatureLookup, LookupHandle, publish_lookup, write_lookup
+from population import Population
+from user import User
+
+
+class FeatureLookupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'features.lookup')
+        self.registry = FeatureRegistry(1000)
+        self.registry.grant_all('everyone')
+        self.registry.grant('sparse', [3, 500, 999])
+        self.registry.grant('dense', range(0, 1000, 2))
+        self.registry.bit('nobody')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def check(self, lookup):
+        for feature in self.registry:
+            self.assertEqual(self.registry.count(feature), lookup.count(feature))
+            expected = [self.registry.has(feature, uid) for uid in range(1000)]
+            self.assertEqual(expected, lookup.has_many(feature, range(1000)))
+        self.assertFalse(lookup.has('sparse', 1000))
+        self.assertFalse(lookup.has('dense', 1000))
+        self.assertFalse(lookup.has('unknown', 3))
+
+    def test_round_trip(self):
+        write_lookup(self.registry, self.path, meta={'stage': 2})
+        lookup = FeatureLookup(self.path)
+        self.check(lookup)
+        self.assertEqual({'stage': 2}, lookup.meta)
+        self.assertEqual(['dense', 'everyone', 'nobody', 'sparse'], list(lookup))
+        self.assertEqual(set(['everyone', 'dense', 'sparse']), lookup.features_of(500))
+        # sparse features are stored as sorted ids, dense ones as bitmaps
+        self.assertIn('sparse', lookup._sorted)
+        self.assertIn('dense', lookup._bitmaps)
+
+    def test_bloom(self):
+        write_lookup(self.registry, self.path, bloom_bits=10)
+        lookup = FeatureLookup(self.path)
+        self.assertIn('sparse', lookup._blooms)
+        self.check(lookup)
+
+    def test_only_some_features(self):
+        write_lookup(self.registry, self.path, features=['sparse'])
+        lookup = FeatureLookup(self.path)
+        self.assertEqual(['sparse'], list(lookup))
+
+    def test_not_a_lookup(self):
+        with open(self.path, 'wb') as f:
+            f.write('x' * 64)
+        with self.assertRaises(ValueError):
+            FeatureLookup(self.path)
+
+    def test_handle_swaps(self):
+        publish_lookup(self.registry, self.path, meta=1)
+        handle = LookupHandle(self.path)
+        old = handle.lookup
+        self.assertFalse(handle.refresh())
+        self.assertFalse(handle.has('sparse', 4))
+
+        self.registry.grant('sparse', [4])
+        publish_lookup(self.registry, self.path, meta=2)
+        self.assertFalse(old.has('sparse', 4))   # still readable after the swap
+        self.assertTrue(handle.refresh())
+        self.assertTrue(handle.has('sparse', 4))
+        self.assertEqual(2, handle.lookup.meta)
+        self.assertEqual(['features.lookup'], os.listdir(self.tmp))
+
+    def test_population(self):
+        A = User(); B = User(); C = User()
+        B.add_coach(A)
+        p = Population(users=[A, B, C])
+        p.infect_components('beta', [A])
+        C.features.add('gamma')
+        p.publish_lookup(self.path)
+        lookup = FeatureLookup(self.path)
+        self.assertEqual([True, True, False],
+                         lookup.has_many('beta', [p.id_of(u) for u in (A, B, C)]))
+        self.assertEqual(set(['gamma']), lookup.features_of(p.id_of(C)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,9 +16,20 @@
 """Implement Population class for fun testing"""
 
 
-from math import ceil
+from array import array
+from bisect import bisect
+from math import ceil, erf, sqrt
 import random
 
+from buckets import ComponentBuckets
+from components import ComponentIndex, UnionFind
+from edgelist import read_graph, write_graph
+from features import FeatureRegistry, count_bits, ids_in, union_of
+from graph import Graph, GraphUser, ID_TYPE
+from journal import FeatureJournal
+from lookup import publish_lookup
+from roles import RoleIndex
+from snapshot import read_snapshot, write_snapshot
 from user import User
 
 
@@ -52,20 +63,207 @@ def random_small_sample(population, odds):
         N = random.randint(1, range_end)
     return set(select_N_of(population, N))
 
+def _small_sample_size(rng, size, odds):
+    # how many members random_small_sample() would pick from size of them
+    if odds < 0 or odds > 1:
+        raise ValueError, "Odds must be a value between 0 and 1"
+    elif odds == 0 or size == 0:
+        return 0
+    elif odds == 1:
+        return size
+    range_end = int(odds * size)
+    return rng.randint(1, range_end) if range_end >= 2 else 1
+
+def _coach_count_cdf(mu=1, sigma=0.9, limit=1e-12):
+    # P(ceil(|N(mu, sigma)|) <= k) for k = 1, 2, ...; the distribution used by
+    # Population._random_number_of_coaches(), tabulated so we can bisect it
+    def normal_cdf(x):
+        return 0.5 * (1 + erf((x - mu) / (sigma * sqrt(2))))
+    cdf = []
+    k = 1
+    while not cdf or 1 - cdf[-1] > limit:
+        cdf.append(normal_cdf(k) - normal_cdf(-k))
+        k += 1
+    return cdf
+
+def random_graph(size, infect_rate=0.02, feature=None, coach_rate=0.1,
+                 coach_study_rate=0.5, classes_per_student=0, seed=None):
+    """Return a Graph shaped the way Population.randomize() shapes its Users
+
+    The arguments mean the same as they do for randomize(); seed makes the
+    result reproducible. Nothing here builds a User or a set per user: roles
+    live in bytearrays, coaching edges go straight into id arrays, and the
+    Graph is compacted once at the end. Coach counts are drawn by bisecting a
+    table of the same ceil|N(1, 0.9)| distribution randomize() samples.
+    """
+    return _random_graph(size, infect_rate, feature, coach_rate, coach_study_rate,
+                         classes_per_student, seed)[0]
+
+def _random_graph(size, infect_rate, feature, coach_rate, coach_study_rate,
+                  classes_per_student, seed):
+    # random_graph(), and a bitmap of the users sampled to come pre-infected,
+    # which the Graph only records if they were given a feature
+    rng = random.Random(seed)
+    graph = Graph(size)
+    infected = rng.sample(xrange(size), _small_sample_size(rng, size, infect_rate))
+    if feature is not None:
+        graph.features.grant(feature, infected)
+    seeded = bytearray((size + 7) // 8)
+    for uid in infected:
+        seeded[uid >> 3] |= 1 << (uid & 7)
+    coaches = array(ID_TYPE, rng.sample(xrange(size), _small_sample_size(rng, size, coach_rate)))
+    studying = rng.sample(coaches, _small_sample_size(rng, len(coaches), coach_study_rate))
+    # students are everybody except the coaches who don't study
+    is_coach = bytearray(size)
+    not_student = bytearray(size)
+    for coach in coaches:
+        is_coach[coach] = not_student[coach] = 1
+    for coach in studying:
+        not_student[coach] = 0
+
+    edge_coaches = array(ID_TYPE)
+    edge_students = array(ID_TYPE)
+    n_coaches = len(coaches)
+    draw = rng.random
+    coach_count_cdf = _coach_count_cdf()
+    for me in xrange(size):
+        if not_student[me]:
+            continue
+        if classes_per_student:
+            my_coach_count = classes_per_student
+        else:
+            my_coach_count = bisect(coach_count_cdf, draw()) + 1
+        my_coach_count = min(my_coach_count, n_coaches - is_coach[me])
+        my_coaches = set()
+        while len(my_coaches) < my_coach_count:
+            coach = coaches[int(draw() * n_coaches)]
+            if coach != me:
+                my_coaches.add(coach)
+        for coach in my_coaches:
+            edge_coaches.append(coach)
+            edge_students.append(me)
+    graph.add_edge_arrays(edge_coaches, edge_students)
+    return graph, seeded
+
+
+def _role_property(role, doc):
+    """Return a property serving role live, unless it has been assigned a set
+
+    Live role sets are frozensets, so changing one in place fails rather than
+    going unseen. Assigning a role pins it to a mutable set of its own, as
+    randomize() does with the roles it plans; deleting it goes back to live.
+    """
+    def get(self):
+        if role in self._pinned:
+            return self._pinned[role]
+        return self._live_role(role)
+
+    def pin(self, users):
+        self._pinned[role] = set(users)
+
+    def unpin(self):
+        self._pinned.pop(role, None)
+
+    return property(get, pin, unpin, doc)
+
 
 class Population(object):
-    def __init__(self, users=[]):
+    def __init__(self, users=[], graph=None):
         # XXX: this is intended for manual testing and is very slow; it's best to 
-        #      initialize an empty users list and use randomize() to get big datasets
+        #      initialize an empty users list and use randomize() to get big datasets,
+        #      or hand us a compact Graph, which never builds User objects up front
+        self._reset_indexes(graph)
+        if graph is not None:
+            self._init_from_graph(graph)
+            return
         self.N = len(users)
         self.population = users
-        self.infected = set([u for u in users if u.features])
-        self.coaches = set([u for u in users if u.students()])
-        self.studying_coaches = set([u for u in users if u.students() and u.coaches()])
-        self.students = set(users) - (self.coaches - self.studying_coaches)
+        for u in users:
+            u.population = self
+
+    def _reset_indexes(self, graph=None):
+        self.graph = graph
+        if graph is not None:
+            graph.population = self
+        self._components = None
+        self._union_find = None
+        self._roles = {}
+        self._buckets = {}
+        self._journal = None
+        self._pinned = {}
+        # users randomize() picked to come pre-infected, feature or not: a set
+        # of Users, or on a Graph a bitmap of their ids
+        self._seeded = set() if graph is None else bytearray()
+        # Populations of plain Users get an id Graph mirroring them on demand
+        self._mirror = None
+        self._ids = None
+        self._users = None
+
+    @classmethod
+    def from_edges(cls, path, binary=None, sidecar=None, size=None):
+        """Return a Population over a Graph streamed from an edge-list file
+
+        * path holds coach_id,student_id pairs, as text or, if binary is set or path
+          ends in .bin, as little-endian 32-bit pairs; see edgelist.py
+        * sidecar optionally names a file of user_id<TAB>feature grants, which also
+          marks those users as pre-infected
+        * size is the number of users, if not one more than the largest id seen
+        """
+        return cls(graph=read_graph(path, binary, sidecar, size))
+
+    def to_edges(self, path, binary=None, sidecar=None):
+        """Write our coaching edges to path, and features to sidecar, for from_edges()
+
+        Ids are those of id_of(), as in snapshots and lookup files. For plain
+        Users, features are those of our id graph, as with roles().
+        """
+        write_graph(self.id_graph(), path, binary, sidecar)
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """Return a Population mapped from a snapshot written by to_snapshot()
+
+        The graph and component index are memory-mapped rather than read, so
+        this is quick however big the population, and processes loading the
+        same snapshot share its pages; see snapshot.py.
+        """
+        graph, index = read_snapshot(path)
+        population = cls(graph=graph)
+        population._components = index
+        return population
+
+    def to_snapshot(self, path):
+        """Write our graph, component labels and features to a snapshot at path
+
+        Populations of plain Users are written by their id graph, and come back
+        from from_snapshot() as Graph-backed populations.
+        """
+        write_snapshot(self.id_graph(), self.components(), path)
+
+    def _init_from_graph(self, graph):
+        self.N = len(graph)
+        self.population = graph.users()
+
+    infected = _role_property('infected', "The users with any feature, and those randomize() seeded for one")
+    coaches = _role_property('coaches', "The users with students")
+    studying_coaches = _role_property('studying_coaches', "The users with both students and coaches")
+    students = _role_property('students', "Everyone but the coaches who don't study")
+
+    def _live_role(self, role):
+        # Role sets come from roles() and the feature bitmaps of our id graph,
+        # so for plain Users they see features given through toggle_infections()
+        # and infect_components(), and those already held when the mirror was made.
+        if role != 'infected':
+            return frozenset(self.user_of(uid) for uid in self.roles().users(role))
+        anyone = self.id_graph().features.anyone()
+        if self.graph is None:
+            return frozenset(self.user_of(uid) for uid in ids_in(anyone)) | self._seeded
+        if self._seeded:
+            anyone = union_of((anyone, self._seeded), max(len(anyone), len(self._seeded)))
+        return frozenset(GraphUser(self.graph, uid) for uid in ids_in(anyone))
 
     def randomize(self, size, infect_rate=0.02, feature=None, coach_rate=0.1, 
-                        coach_study_rate=0.5, classes_per_student=0):
+                        coach_study_rate=0.5, classes_per_student=0, live_roles=False):
         """Initialize a population of Users conforming to certaing statistical properties
 
         * size is a population size
@@ -75,24 +273,195 @@ class Population(object):
         * coach_study_rate is the rough proportion of coaches who also have coaches of 
           their own
         * classes_per_student set a precise number of coaches for each student
+        * live_roles, if set, leaves the role sets live, so they say who ended up
+          with students and coaches; otherwise they stay the ones planned here
 
-        XXX: currently Population only supports modeling one feature at a time, despite 
-             Users being able to carry an arbitrary set of features.
+        XXX: randomize only models one feature at a time; use infect_components() to
+             layer more on top.
         """
         self.N = size
-        pop = [User() for x in xrange(size)]
+        self._reset_indexes()
+        pop = [User(population=self) for x in xrange(size)]
         self.population = pop
-        self.infected = random_small_sample(pop, infect_rate)
+        infected = random_small_sample(pop, infect_rate)
         coaches = random_small_sample(pop, coach_rate)
-        self.coaches = coaches
         studying_coaches = random_small_sample(coaches, coach_study_rate)
-        self.studying_coaches = studying_coaches
         # students are everybody except the coaches who don't study
-        self.students = set(pop) - (coaches - studying_coaches)
+        students = set(pop) - (coaches - studying_coaches)
+        if live_roles:
+            self._seeded = infected
+        else:
+            self.infected = infected
+            self.coaches = coaches
+            self.studying_coaches = studying_coaches
+            self.students = students
 
         if feature is not None:
             self.toggle_infections(feature)
-        self.update_user_relationships(classes_per_student)
+        self.update_user_relationships(classes_per_student, students, coaches)
+
+    def id_graph(self):
+        """Return a Graph whose ids match id_of() and user_of() for our users"""
+        if self.graph is not None:
+            return self.graph
+        if self._mirror is None:
+            self._mirror, self._ids = Graph.from_users(self.population)
+            self._users = [None] * len(self._ids)
+            for user, uid in self._ids.iteritems():
+                self._users[uid] = user
+        return self._mirror
+
+    def id_of(self, user):
+        """Return the integer id of user in this population's graph"""
+        if self.graph is not None:
+            return user.id
+        self.id_graph()
+        return self._adopt(user)
+
+    def user_of(self, uid):
+        """Return the user object behind an integer id from this population's graph"""
+        if self.graph is not None:
+            return GraphUser(self.graph, uid)
+        self.id_graph()
+        return self._users[uid]
+
+    def components(self):
+        """Return a ComponentIndex over this population, building it on first use
+
+        The index follows edges added afterwards through User.add_coach() and
+        friends, so it is built at most once per population.
+        """
+        if self._components is None:
+            self._components = ComponentIndex(self.id_graph())
+        return self._components
+
+    def has_components(self):
+        """Return True if components() is already built, and so costs nothing to ask"""
+        return self._components is not None
+
+    def union_find(self):
+        """Return a UnionFind over this population, building it on first use
+
+        Like components(), it is updated on every new edge from then on. Use it
+        instead of components() when only component ids and sizes are needed.
+        """
+        if self._union_find is None:
+            self._union_find = UnionFind(self.id_graph())
+        return self._union_find
+
+    def roles(self, feature=None):
+        """Return a RoleIndex over this population, building it on first use
+
+        Like components(), it follows every new edge from then on. With a feature,
+        it also ranks coaches by how many of their students have it. For plain
+        Users, that ranking sees features granted through toggle_infections() and
+        infect_components(), but not ones added to User.features by hand.
+        """
+        if feature not in self._roles:
+            self._roles[feature] = RoleIndex(self.id_graph(), feature)
+        return self._roles[feature]
+
+    def buckets(self, salt):
+        """Return the ComponentBuckets deciding the feature salted salt; see buckets.py
+
+        Membership comes from hashing component labels, so nothing is granted
+        or stored per user. Ids are those of id_of().
+        """
+        if salt not in self._buckets:
+            self._buckets[salt] = ComponentBuckets(self.components(), salt)
+        return self._buckets[salt]
+
+    def journal(self, path=None):
+        """Return the FeatureJournal logging our grants, starting it on first use
+
+        path, if given the first time, is a file to append the journal to, or to
+        carry on from. For plain Users, the journal sees features granted through
+        toggle_infections() and infect_components() only.
+        """
+        if self._journal is None:
+            self._journal = FeatureJournal(self.id_graph().features, path)
+        return self._journal
+
+    def rollback(self, feature, stage=None):
+        """Take back feature from everyone the journal saw it granted to, or just stage's
+
+        Other features, and users who had feature before the journal started, are
+        left alone. Returns the number of users who lost it.
+        """
+        changed = self.journal().rollback(feature, stage)
+        if self.graph is None:
+            for uid in ids_in(changed):
+                self._users[uid].features.discard(feature)
+        return count_bits(changed)
+
+    def publish_lookup(self, path, features=None, bloom_bits=0, meta=None):
+        """Freeze our features into a lookup file at path for serving; see lookup.py
+
+        The file is replaced atomically, so LookupHandles on path pick up each new
+        stage of a rollout whole. Ids are those of id_of().
+        """
+        if self.graph is not None:
+            registry = self.graph.features
+        else:
+            registry = FeatureRegistry(len(self.id_graph()))
+            for uid, user in enumerate(self._users):
+                for feature in user.features:
+                    registry.grant(feature, (uid,))
+        publish_lookup(registry, path, features, bloom_bits, meta)
+
+    def component_size(self, user):
+        """Return the number of users in user's connected component"""
+        uid = self.id_of(user)
+        if self.has_components():
+            return self._components.size(uid)
+        return self.union_find().size(uid)
+
+    def edge_added(self, coach, student):
+        """Mirror a new coaching edge between plain Users into our id graph, if any"""
+        if self._mirror is not None:
+            self._mirror.add_edge(self._adopt(coach), self._adopt(student))
+
+    def edge_removed(self, coach, student):
+        """Mirror a removed coaching edge between plain Users into our id graph, if any"""
+        if self._mirror is not None:
+            self._mirror.remove_edge(self._adopt(coach), self._adopt(student))
+
+    def _adopt(self, user):
+        # Users we've never seen bring along everyone already connected to
+        # them, so the mirror never misses a relationship formed elsewhere.
+        if user in self._ids:
+            return self._ids[user]
+        newcomers = [user]
+        self._ids[user] = self._mirror.add_users(1)
+        self._users.append(user)
+        i = 0
+        while i < len(newcomers):
+            for other in newcomers[i].coaches() | newcomers[i].students():
+                if other not in self._ids:
+                    self._ids[other] = self._mirror.add_users(1)
+                    self._users.append(other)
+                    newcomers.append(other)
+            i += 1
+        ids = self._ids
+        for newcomer in newcomers:
+            newcomer.population = self
+            for coach in newcomer.coaches():
+                self._mirror.add_edge(ids[coach], ids[newcomer])
+            for student in newcomer.students():
+                self._mirror.add_edge(ids[newcomer], ids[student])
+        return ids[user]
+
+    def randomize_graph(self, size, infect_rate=0.02, feature=None, coach_rate=0.1,
+                              coach_study_rate=0.5, classes_per_student=0, seed=None):
+        """Like randomize(), but build a compact Graph in bulk with random_graph()
+
+        This is the way to make populations of millions; seed makes them reproducible.
+        """
+        graph, seeded = _random_graph(size, infect_rate, feature, coach_rate,
+                                      coach_study_rate, classes_per_student, seed)
+        self._reset_indexes(graph)
+        self._init_from_graph(graph)
+        self._seeded = seeded
 
     def _random_number_of_coaches(self, max_poolsize):
         # I'm guessing most students take 1 course, and a handful take more
@@ -103,16 +472,40 @@ class Population(object):
         """If feature specified, enable it for every poplutaion member in infected set.
 
         If feature is None, remove all infections everywhere."""
-        if feature is not None:
+        if feature is not None and self.graph is not None:
+            self.graph.features.grant(feature, [user.id for user in self.infected])
+        elif feature is not None:
             for user in self.infected:
                 user.features.add(feature)
+            if self._mirror is not None:
+                self._mirror.features.grant(feature, [self.id_of(u) for u in self.infected])
+        elif self.graph is not None:
+            self.graph.features.revoke_all()
         else:
             for user in self.population:
                 user.features.clear()
+            if self._mirror is not None:
+                self._mirror.features.revoke_all()
         
-    def update_user_relationships(self, classes_per_student=0):
-        students = self.students
-        coaches = self.coaches
+    def infect_components(self, feature, users):
+        """Enable feature for everyone in the connected components of users
+
+        Any number of features can be layered this way. On a Graph this sets
+        bits in the feature's bitmap rather than touching any user objects.
+        """
+        index = self.components()
+        uids = index.component_members([self.id_of(user) for user in users])
+        if self.graph is not None:
+            self.graph.features.grant(feature, uids)
+        else:
+            for uid in uids:
+                self.user_of(uid).features.add(feature)
+            self._mirror.features.grant(feature, uids)
+
+    def update_user_relationships(self, classes_per_student=0, students=None, coaches=None):
+        """Give each of students coaches drawn from coaches, our current roles by default"""
+        students = self.students if students is None else students
+        coaches = self.coaches if coaches is None else coaches
         for me in students:
             my_coach_pool = coaches if me not in coaches else (coaches - {me})
             my_coach_count = classes_per_student if classes_per_student else self._random_number_of_coaches(len(my_coach_pool))
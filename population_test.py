@@ -18,7 +18,8 @@
 
 import unittest
 
-from population import select_N_of, random_small_sample, Population
+from graph import Graph
+from population import select_N_of, random_small_sample, random_graph, Population
 from user import User
 
 
@@ -79,6 +80,64 @@ class PopulationTestCase(unittest.TestCase):
         self.assertEqual(set(), p.coaches)
         self.assertEqual(set([unlucky]), p.students)
 
+    def test_infect_components(self):
+        A = User(); B = User(); C = User()
+        B.add_coach(A)
+        p = Population(users=[A, B, C])
+        p.infect_components('X', [B])
+        p.infect_components('Y', [A, C])
+        self.assertEqual(set(['X', 'Y']), A.features)
+        self.assertEqual(set(['Y']), C.features)
+
+    def test_roles_stay_current(self):
+        A = User(); B = User(); C = User()
+        B.add_coach(A)
+        A.features.add('X')
+        p = Population(users=[A, B, C])
+        roles = p.roles('X')
+        self.assertEqual(1, roles.count('coaches'))
+        C.add_coach(B)
+        self.assertEqual(set([p.id_of(A), p.id_of(B)]), roles.users('coaches'))
+        self.assertEqual(set([p.id_of(B)]), roles.users('studying_coaches'))
+        self.assertEqual([], roles.top_coaches())
+        p.infect_components('X', [C])
+        self.assertEqual([(p.id_of(A), 1), (p.id_of(B), 1)], sorted(roles.top_coaches(2)))
+
+    def test_roles_are_live(self):
+        A = User(); B = User(); C = User()
+        p = Population(users=[A, B, C])
+        self.assertEqual(set(), p.coaches)
+        self.assertEqual(set(), p.infected)
+        B.add_coach(A)
+        C.add_coach(B)
+        self.assertEqual(set([A, B]), p.coaches)
+        self.assertEqual(set([B]), p.studying_coaches)
+        self.assertEqual(set([B, C]), p.students)
+        p.infect_components('X', [C])
+        self.assertEqual(set([A, B, C]), p.infected)
+        with self.assertRaises(AttributeError):
+            p.infected.add(A)
+
+    def test_assigned_roles_are_kept(self):
+        A = User(); B = User()
+        p = Population(users=[A, B])
+        p.infected = [A]
+        p.infected.add(B)
+        self.assertEqual(set([A, B]), p.infected)
+        p.coaches = [B]
+        self.assertEqual(set([B]), p.coaches)
+        del p.infected, p.coaches
+        self.assertEqual(set(), p.infected)
+        self.assertEqual(set(), p.coaches)
+
+    def test_live_random_population_roles(self):
+        p = Population()
+        p.randomize(200, infect_rate=0.1, feature='A', live_roles=True)
+        self.assertEqual(set(u for u in p.population if u.students()), p.coaches)
+        self.assertEqual(set(u for u in p.population if u.features), p.infected)
+        p.population[0].add_coach(p.population[1])
+        self.assertIn(p.population[1], p.coaches)
+
     def test_pessimistic_random_population_creation(self):
         p = Population()
         # 10 students who are all infected, all teachers, and all study
@@ -99,5 +158,58 @@ class PopulationTestCase(unittest.TestCase):
         self.assertLess(1, max([len(u.coaches()) for u in p.students]))
 
 
+class RandomGraphTestCase(unittest.TestCase):
+    def test_seed_reproduces_graph(self):
+        a = random_graph(500, feature='A', seed=42)
+        b = random_graph(500, feature='A', seed=42)
+        self.assertEqual(a.E, b.E)
+        for uid in range(500):
+            self.assertEqual(list(a.coaches_of(uid)), list(b.coaches_of(uid)))
+        self.assertEqual(list(a.features.users(['A'])), list(b.features.users(['A'])))
+
+    def test_classes_per_student(self):
+        g = random_graph(50, coach_rate=1, coach_study_rate=1, classes_per_student=3, seed=1)
+        for uid in range(50):
+            self.assertEqual(3, len(set(g.coaches_of(uid))))
+            self.assertNotIn(uid, g.coaches_of(uid))
+
+    def test_pessimistic_random_graph_population(self):
+        p = Population()
+        p.randomize_graph(10, infect_rate=1, feature='A', coach_rate=1, coach_study_rate=1)
+        self.assertEqual(10, p.N)
+        self.assertEqual(p.N, len(p.population))
+        self.assertEqual(len(p.population), len(p.infected))
+        self.assertEqual(len(p.infected), len(p.students))
+
+    def test_normal_random_graph_population(self):
+        p = Population()
+        p.randomize_graph(1024, seed=3)
+        self.assertLess(len(p.coaches), len(p.students))
+        self.assertLess(len(p.studying_coaches), len(p.coaches))
+        self.assertLess(1, max([len(u.coaches()) for u in p.students]))
+        # the pre-infected sample is kept even with no feature to give it
+        self.assertLess(0, len(p.infected))
+        self.assertEqual(0, p.graph.features.count('A'))
+        p.toggle_infections('A')
+        self.assertEqual(p.infected, set(p.graph.user(uid) for uid in p.graph.features.users(['A'])))
+
+    def test_graph_roles_stay_current(self):
+        p = Population(graph=Graph(4))
+        self.assertEqual(set(), p.coaches)
+        p.graph.user(0).add_student(p.graph.user(1))
+        self.assertEqual(set([p.graph.user(0)]), p.coaches)
+        self.assertEqual(3, len(p.students))
+
+    def test_graph_infected_stays_current(self):
+        p = Population(graph=Graph(4))
+        p.graph.user(0).add_student(p.graph.user(1))
+        p.journal()
+        self.assertEqual(set(), p.infected)
+        p.infect_components('X', [p.graph.user(1)])
+        self.assertEqual(set([p.graph.user(0), p.graph.user(1)]), p.infected)
+        p.rollback('X')
+        self.assertEqual(set(), p.infected)
+
+
 if __name__ == "__main__":
     unittest.main()
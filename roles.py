@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Implement RoleIndex, live role, degree and infected-student bookkeeping over a Graph
+
+Population works out who coaches and who studies by scanning every user, and
+the answer is stale as soon as another edge arrives. A RoleIndex counts each
+user's coaches and students once, then listens to the Graph for new users and
+for edges coming and going, and to its FeatureRegistry for grants and revokes,
+so role membership and counts, the degree histograms, and the coaches with the
+most infected students are all answered without a scan.
+
+Roles follow Population's definitions: coaches have students, studying
+coaches have coaches too, and students are everyone but the coaches who
+don't study.
+"""
+
+
+from array import array
+from bisect import bisect_left, insort
+from heapq import nsmallest
+from itertools import izip
+
+from features import ids_in
+from graph import ID_TYPE, to_array
+
+
+ROLES = ('coaches', 'studying_coaches', 'students')
+
+
+class RoleIndex(object):
+    """Degrees, roles and degree histograms of a Graph's users, kept current
+
+    With a feature, it also counts each coach's students who have it and
+    keeps coaches bucketed by that count, so top_coaches() only looks at the
+    buckets its answer comes from.
+    """
+
+    def __init__(self, graph, feature=None):
+        self.graph = graph
+        self.feature = feature
+        n = len(graph)
+        self.students_count = array(ID_TYPE, [0]) * n
+        self.coaches_count = array(ID_TYPE, [0]) * n
+        for uid in xrange(n):
+            self.students_count[uid] = len(graph.students_of(uid))
+            self.coaches_count[uid] = len(graph.coaches_of(uid))
+        self._histograms = ({}, {})
+        self._coaches = set()
+        self._studying = set()
+        for uid in xrange(n):
+            self._count(uid, 1)
+
+        self.infected_students = array(ID_TYPE, [0]) * n
+        self._buckets = {}      # infected-student count -> coaches with that many
+        self._levels = []       # the counts with a non-empty bucket, ascending
+        if feature is not None:
+            for student in ids_in(graph.features.bitmap(feature)):
+                for coach in graph.coaches_of(student):
+                    self.infected_students[coach] += 1
+            for coach, infected in enumerate(self.infected_students):
+                if infected:
+                    self._bucket(coach, 0, infected)
+            graph.features.listeners.append(self)
+        graph.listeners.append(self)
+
+    def __len__(self):
+        return len(self.students_count)
+
+    def _count(self, uid, sign):
+        # add (sign=1) or take away (sign=-1) uid's contribution to the
+        # histograms and role sets, around a change to its degrees
+        for histogram, degree in izip(self._histograms, (self.students_count[uid],
+                                                         self.coaches_count[uid])):
+            histogram[degree] = histogram.get(degree, 0) + sign
+            if not histogram[degree]:
+                del histogram[degree]
+        if self.students_count[uid]:
+            (self._coaches.add if sign > 0 else self._coaches.discard)(uid)
+            if self.coaches_count[uid]:
+                (self._studying.add if sign > 0 else self._studying.discard)(uid)
+
+    def _bucket(self, coach, old, new):
+        # move coach from the bucket for old infected students to the one for new
+        buckets, levels = self._buckets, self._levels
+        if old:
+            bucket = buckets[old]
+            bucket.discard(coach)
+            if not bucket:
+                del buckets[old]
+                del levels[bisect_left(levels, old)]
+        if new:
+            if new not in buckets:
+                buckets[new] = set()
+                insort(levels, new)
+            buckets[new].add(coach)
+
+    def is_coach(self, uid):
+        return self.students_count[uid] > 0
+
+    def is_studying_coach(self, uid):
+        return self.students_count[uid] > 0 and self.coaches_count[uid] > 0
+
+    def is_student(self, uid):
+        return self.coaches_count[uid] > 0 or self.students_count[uid] == 0
+
+    def count(self, role):
+        """Return the number of users in role, one of ROLES"""
+        if role == 'coaches':
+            return len(self._coaches)
+        if role == 'studying_coaches':
+            return len(self._studying)
+        if role == 'students':
+            return len(self) - len(self._coaches) + len(self._studying)
+        raise ValueError, "Unknown role {!r}; expected one of {}".format(role, ROLES)
+
+    def users(self, role):
+        """Return the ids in role, one of ROLES, as a set
+
+        Coaches and studying coaches are kept as sets already; students are
+        nearly everyone, so are worked out from the coaches who don't study.
+        """
+        if role == 'coaches':
+            return set(self._coaches)
+        if role == 'studying_coaches':
+            return set(self._studying)
+        if role == 'students':
+            teachers = self._coaches - self._studying
+            return set(uid for uid in xrange(len(self)) if uid not in teachers)
+        raise ValueError, "Unknown role {!r}; expected one of {}".format(role, ROLES)
+
+    def histogram(self, direction='students'):
+        """Return a dict of degree -> number of users with that many students or coaches"""
+        if direction not in ('students', 'coaches'):
+            raise ValueError, "direction must be 'students' or 'coaches'"
+        return dict(self._histograms[direction == 'coaches'])
+
+    def top_coaches(self, k=1):
+        """Return up to k (coach, infected students) pairs, the most infected students first"""
+        top = []
+        for level in reversed(self._levels):
+            if len(top) >= k:
+                break
+            # ties go to the smallest ids, without sorting a whole bucket
+            top.extend((coach, level) for coach in nsmallest(k - len(top), self._buckets[level]))
+        return top
+
+    def users_added(self, first, count):
+        for name in ('students_count', 'coaches_count', 'infected_students'):
+            setattr(self, name, to_array(ID_TYPE, getattr(self, name)))
+            getattr(self, name).extend(array(ID_TYPE, [0]) * count)
+        for uid in xrange(first, first + count):
+            self._count(uid, 1)
+
+    def edge_added(self, coach, student):
+        self._count(coach, -1)
+        self._count(student, -1)
+        self.students_count[coach] += 1
+        self.coaches_count[student] += 1
+        self._count(coach, 1)
+        self._count(student, 1)
+        if self.feature is not None and self.graph.features.has(self.feature, student):
+            infected = self.infected_students[coach]
+            self.infected_students[coach] = infected + 1
+            self._bucket(coach, infected, infected + 1)
+
+    def edges_added(self, coaches, students):
+        edge_added = self.edge_added
+        for coach, student in izip(coaches, students):
+            edge_added(coach, student)
+
+    def edge_removed(self, coach, student):
+        self._count(coach, -1)
+        self._count(student, -1)
+        self.students_count[coach] -= 1
+        self.coaches_count[student] -= 1
+        self._count(coach, 1)
+        self._count(student, 1)
+        if self.feature is not None and self.graph.features.has(self.feature, student):
+            infected = self.infected_students[coach]
+            self.infected_students[coach] = infected - 1
+            self._bucket(coach, infected, infected - 1)
+
+    def edges_removed(self, coaches, students):
+        edge_removed = self.edge_removed
+        for coach, student in izip(coaches, students):
+            edge_removed(coach, student)
+
+    def features_granted(self, feature, uids):
+        self._infect(feature, uids, 1)
+
+    def features_revoked(self, feature, uids):
+        self._infect(feature, uids, -1)
+
+    def _infect(self, feature, uids, change):
+        if feature != self.feature:
+            return
+        infected_students = self.infected_students
+        for student in uids:
+            for coach in self.graph.coaches_of(student):
+                infected = infected_students[coach]
+                infected_students[coach] = infected + change
+                self._bucket(coach, infected, infected + change)
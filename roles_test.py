@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for RoleIndex"""
+
+import unittest
+
+from graph import Graph
+from population import random_graph
+from roles import ROLES, RoleIndex
+
+
+class RoleIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        # 0 coaches 1, 2 and 3; 1 coaches 3; 4 and 5 are on their own
+        self.graph = Graph(6)
+        self.graph.add_edges([(0, 1), (0, 2), (0, 3), (1, 3)])
+
+    def test_roles(self):
+        roles = RoleIndex(self.graph)
+        self.assertEqual(set([0, 1]), roles.users('coaches'))
+        self.assertEqual(set([1]), roles.users('studying_coaches'))
+        self.assertEqual(set([1, 2, 3, 4, 5]), roles.users('students'))
+        self.assertEqual([2, 1, 5], [roles.count(role) for role in ROLES])
+        self.assertTrue(roles.is_studying_coach(1))
+        self.assertFalse(roles.is_student(0))
+        with self.assertRaises(ValueError):
+            roles.count('teachers')
+
+    def test_histograms(self):
+        roles = RoleIndex(self.graph)
+        self.assertEqual({0: 4, 1: 1, 3: 1}, roles.histogram('students'))
+        self.assertEqual({0: 3, 1: 2, 2: 1}, roles.histogram('coaches'))
+
+    def test_follows_graph(self):
+        roles = RoleIndex(self.graph)
+        self.graph.add_edge(4, 0)
+        self.assertEqual(set([0, 1, 4]), roles.users('coaches'))
+        self.assertEqual(set([0, 1]), roles.users('studying_coaches'))
+        first = self.graph.add_users(2)
+        self.graph.add_edges([(first, first + 1)])
+        self.assertEqual(4, roles.count('coaches'))
+        self.assertEqual(4, roles.histogram('students')[0])
+        self.assertEqual(1, roles.students_count[first])
+
+    def test_top_coaches(self):
+        features = self.graph.features
+        features.grant('beta', [3])
+        roles = RoleIndex(self.graph, 'beta')
+        self.assertEqual([(0, 1), (1, 1)], roles.top_coaches(5))
+        features.grant('beta', [2, 3])
+        self.assertEqual([(0, 2), (1, 1)], roles.top_coaches(5))
+        self.assertEqual([(0, 2)], roles.top_coaches())
+        features.revoke('beta', [2, 3])
+        self.assertEqual([], roles.top_coaches())
+        features.grant('other', [1, 2, 3])
+        self.assertEqual([], roles.top_coaches())
+        features.grant_all('beta')
+        self.graph.add_edge(5, 4)
+        self.assertEqual([(0, 3), (1, 1), (5, 1)], roles.top_coaches(3))
+        features.revoke_all()
+        self.assertEqual(0, sum(roles.infected_students))
+
+    def test_matches_rebuild(self):
+        """An index kept current agrees with one built afterwards"""
+        graph = random_graph(300, infect_rate=0.2, feature='A', seed=5)
+        live = RoleIndex(graph, 'A')
+        graph.add_edges([(1, 2), (3, 4), (5, 6)])
+        graph.add_edge(7, 8)
+        graph.features.grant('A', range(0, 300, 7))
+        graph.features.revoke('A', range(0, 300, 11))
+        graph.remove_edge(7, 8)
+        graph.remove_edges([(coach, student) for coach in range(0, 300, 3)
+                            for student in graph.students_of(coach)][:40])
+        rebuilt = RoleIndex(graph, 'A')
+        for role in ROLES:
+            self.assertEqual(rebuilt.users(role), live.users(role))
+        self.assertEqual(rebuilt.histogram('coaches'), live.histogram('coaches'))
+        self.assertEqual(list(rebuilt.infected_students), list(live.infected_students))
+        self.assertEqual(rebuilt.top_coaches(20), live.top_coaches(20))
+
+
+if __name__ == "__main__":
+    unittest.main()
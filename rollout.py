@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Roll a feature out in stages, as SPEC.txt describes, and push grants to a sink
+
+A RolloutScheduler takes a ramp plan: a list of Stages, each with a target
+number (or fraction) of users and a pause to wait once it's out. Every stage
+grows the previous stage's infection by whole connected components, so no
+classroom is ever split, and hands the newly infected ids to a sink in batches.
+The sink is anything with a thread-safe write(feature, uids) that is happy to
+be told the same grant twice. MemorySink, SQLiteSink and PopulationSink are
+provided.
+
+Writes run on a pool of worker threads fed through a bounded queue, so no more
+than workers writes are in flight at once and the scheduler stops producing
+batches while the sink falls behind. Progress is saved to a Checkpoint after
+every batch, and a scheduler started again on the same checkpoint carries on
+from the first unwritten batch of the stage it was in.
+
+plan_ramp() works a whole ramp out up front instead: it reads component sizes
+once and returns a RampPlan of nested component selections, one per stage,
+with how far each stage lands from its target. A RampPlan can be handed to a
+RolloutScheduler in place of its stages to push exactly those selections.
+"""
+
+
+from array import array
+from collections import namedtuple
+import json
+import math
+import os
+import Queue
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+from graph import ID_TYPE
+
+
+BATCH_SIZE = 1000   # ids per sink write
+
+class Stage(namedtuple('Stage', 'target pause')):
+    """One step of a ramp plan
+
+    target is the number of users to have infected once the stage is out, or,
+    as a float no greater than 1.0, a fraction of the population. pause is the
+    number of seconds to wait before the next stage starts.
+    """
+    __slots__ = ()
+
+    def __new__(cls, target, pause=0):
+        return super(Stage, cls).__new__(cls, target, pause)
+
+
+def stage_target(target, size):
+    """Return the number of users a stage target means in a population of size"""
+    if isinstance(target, float) and target <= 1.0:
+        return int(math.ceil(target * size))
+    return int(target)
+
+
+class RampPlan(object):
+    """Nested component selections for every stage of a ramp
+
+    Stage k adds the components labelled in labels[k] to those of the stages
+    before it. targets[k] is the number of users stage k aimed for and
+    counts[k] the number it reaches; errors() gives the difference, positive
+    for overshoot and negative for undershoot. stages are the Stages planned
+    for, so a RolloutScheduler handed the plan keeps their pauses.
+    """
+
+    def __init__(self, population, index, targets, labels, counts, stages=None):
+        self.population = population
+        self.index = index
+        self.targets = targets
+        self.labels = labels
+        self.counts = counts
+        self.stages = stages or [Stage(target) for target in targets]
+
+    def __len__(self):
+        return len(self.targets)
+
+    def errors(self):
+        """Return counts[k] - targets[k] for every stage k"""
+        return [count - target for count, target in zip(self.counts, self.targets)]
+
+    def added(self, stage):
+        """Return an array of the ids stage adds"""
+        return self.index.component_members(self.labels[stage])
+
+    def infected(self, stage):
+        """Return an array of the ids infected once stage is out"""
+        labels = array(ID_TYPE)
+        for number in xrange(stage + 1):
+            labels.extend(self.labels[number])
+        return self.index.component_members(labels)
+
+    def apply(self, stage, feature, sink, batch_size=BATCH_SIZE):
+        """Write the ids stage adds to sink, batch_size at a time; return how many"""
+        uids = self.added(stage)
+        for start in xrange(0, len(uids), batch_size):
+            sink.write(feature, uids[start:start + batch_size].tolist())
+        return len(uids)
+
+
+def plan_ramp(population, stages, seeds=None, seed=0):
+    """Return a RampPlan growing an infection of population through stages
+
+    * stages is a list of Stages, (target, pause) tuples or bare targets, as for
+      RolloutScheduler; only their targets matter here.
+    * seeds are the users whose components go out in the first stage whatever
+      its target, population.infected by default.
+    * seed fixes which of several same-sized components are taken first.
+
+    Every stage takes the biggest components that still fit under its target,
+    so it never overshoots unless the seeds alone do, and undershoots only by
+    less than the smallest component left. Sizes are read once and kept as a
+    count of components per size, so each stage costs one walk over the
+    distinct sizes rather than over the components.
+    """
+    index = population.components()
+    size = len(index.labels)
+    stages = [Stage(*stage) if isinstance(stage, tuple) else Stage(stage) for stage in stages]
+    targets = [stage_target(stage.target, size) for stage in stages]
+    if seeds is None:
+        seeds = population.infected
+    forced = set(index.label(population.id_of(user)) for user in seeds)
+
+    by_size = {}
+    for label, members in index.sizes():
+        if label not in forced:
+            by_size.setdefault(members, []).append(label)
+    rng = random.Random(seed)
+    for labels in by_size.itervalues():
+        rng.shuffle(labels)
+    sizes = sorted(by_size, reverse=True)
+
+    infected = sum(index.size(label) for label in forced)
+    plan, counts = [], []
+    for number, target in enumerate(targets):
+        chosen = array(ID_TYPE, sorted(forced) if number == 0 else [])
+        for members in sizes:
+            if infected + members > target:
+                continue
+            labels = by_size[members]
+            take = min(len(labels), (target - infected) // members)
+            if take:
+                chosen.extend(labels[-take:])
+                del labels[-take:]
+                infected += take * members
+        sizes = [members for members in sizes if by_size[members]]
+        plan.append(chosen)
+        counts.append(infected)
+    return RampPlan(population, index, targets, plan, counts, stages)
+
+
+class MemorySink(object):
+    """Keep grants in a dict of feature -> set of ids; handy in tests"""
+
+    def __init__(self):
+        self.grants = {}
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def write(self, feature, uids):
+        with self._lock:
+            self.grants.setdefault(feature, set()).update(uids)
+            self.writes += 1
+
+
+class SQLiteSink(object):
+    """Keep grants in a (feature, uid) table of an SQLite database at path"""
+
+    def __init__(self, path=':memory:'):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS grants '
+                             '(feature TEXT NOT NULL, uid INTEGER NOT NULL, '
+                             'PRIMARY KEY (feature, uid))')
+
+    def write(self, feature, uids):
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR IGNORE INTO grants VALUES (?, ?)',
+                                 ((feature, uid) for uid in uids))
+
+    def users(self, feature):
+        """Return the set of ids holding feature"""
+        with self._lock:
+            rows = self._db.execute('SELECT uid FROM grants WHERE feature = ?', (feature,))
+            return set(uid for (uid,) in rows)
+
+    def close(self):
+        self._db.close()
+
+
+class PopulationSink(object):
+    """Grant features straight to the users of a Population"""
+
+    def __init__(self, population):
+        self.population = population
+        self._lock = threading.Lock()
+
+    def write(self, feature, uids):
+        with self._lock:
+            if self.population.graph is not None:
+                self.population.graph.features.grant(feature, uids)
+            else:
+                for uid in uids:
+                    self.population.user_of(uid).features.add(feature)
+
+
+class Checkpoint(object):
+    """The saved progress of a rollout, kept in memory or in a JSON file at path
+
+    Saves to a file are atomic: the new state is written alongside and renamed
+    over the old one.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.state = None
+
+    def load(self):
+        """Return the last state saved, or None if there isn't one"""
+        if self.state is None and self.path and os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                self.state = json.load(f)
+        return None if self.state is None else dict(self.state)
+
+    def save(self, state):
+        self.state = dict(state)
+        if self.path:
+            temporary = self.path + '.tmp'
+            with open(temporary, 'wb') as f:
+                json.dump(self.state, f)
+            os.rename(temporary, self.path)
+
+
+class RolloutScheduler(object):
+    """Roll feature out to population through stages, writing grants to sink
+
+    * stages is the ramp plan, a list of Stages or (target, pause) tuples, or a
+      RampPlan from plan_ramp(), whose selections are then pushed as they are;
+      seeds and seed are ignored for a RampPlan, which settled both already.
+    * seeds are the users the first stage starts from, the team, say; they
+      default to population.infected. Their components go out in stage one
+      whatever its target.
+    * batch_size is the number of ids per sink write, workers the number of
+      writes allowed in flight at once, and queue_size the number of batches
+      that may wait for a worker before the scheduler blocks.
+    * checkpoint is a Checkpoint to save progress to and resume from.
+    * seed fixes the order other components are taken in.
+    * sleep is called with each stage's pause; on_stage, if given, is called
+      with the stage's number and the number of users infected so far once it
+      is out, and stops the rollout if it returns False.
+
+    Components are taken in a random order, skipping any that would carry a
+    stage past its target; skipped ones are tried first in later stages. So a
+    stage never overshoots its target but may fall short of it when only big
+    components are left, and the last stage of a plan ending at 100% reaches
+    everyone. The checkpoint assumes the population's coaching graph doesn't
+    change while the rollout is under way.
+    """
+
+    def __init__(self, population, feature, stages, sink, seeds=None,
+                 batch_size=BATCH_SIZE, workers=4, queue_size=None, checkpoint=None,
+                 seed=0, sleep=time.sleep, on_stage=None):
+        self.population = population
+        self.feature = feature
+        self.ramp = stages if isinstance(stages, RampPlan) else None
+        if self.ramp is not None:
+            stages = self.ramp.stages
+        self.stages = [Stage(*stage) for stage in stages]
+        self.sink = sink
+        self.seeds = population.infected if seeds is None else seeds
+        self.batch_size = batch_size
+        self.workers = workers
+        self.queue_size = queue_size or 2 * workers
+        self.checkpoint = checkpoint or Checkpoint()
+        self.seed = seed
+        self.sleep = sleep
+        self.on_stage = on_stage
+
+    def _fresh(self, index):
+        seeds = sorted(set(index.label(self.population.id_of(u)) for u in self.seeds))
+        return dict(feature=self.feature, seed=self.seed, seeds=seeds, stage=0,
+                    cursor=0, deferred=[], infected=0, done=0)
+
+    def _order(self, index, state):
+        # every component's label but the seeds', in the same order on every run
+        seeds = set(state['seeds'])
+        order = [label for label, size in index.sizes() if label not in seeds]
+        random.Random(state['seed']).shuffle(order)
+        return order
+
+    def _choose(self, index, order, state):
+        """Return the labels state's stage adds and the state after it"""
+        number = state['stage']
+        if self.ramp is not None:
+            after = dict(state, stage=number + 1, infected=self.ramp.counts[number], done=0)
+            return list(self.ramp.labels[number]), after
+        target = stage_target(self.stages[number].target, len(index.labels))
+        cursor, infected = state['cursor'], state['infected']
+        chosen = list(state['seeds']) if number == 0 else []
+        infected += sum(index.size(label) for label in chosen)
+        deferred = []
+
+        def consider(label):
+            size = index.size(label)
+            if infected + size <= target:
+                chosen.append(label)
+                return size
+            deferred.append(label)
+            return 0
+
+        for label in state['deferred']:
+            infected += consider(label)
+        while infected < target and cursor < len(order):
+            infected += consider(order[cursor])
+            cursor += 1
+        after = dict(state, stage=number + 1, cursor=cursor, deferred=deferred,
+                     infected=infected, done=0)
+        return chosen, after
+
+    def plan(self):
+        """Return the number of users infected after each stage, without writing anything"""
+        index = self.population.components()
+        state = self._fresh(index)
+        order = self._order(index, state)
+        counts = []
+        for number in xrange(len(self.stages)):
+            chosen, state = self._choose(index, order, state)
+            counts.append(state['infected'])
+        return counts
+
+    def run(self):
+        """Push every remaining stage to the sink; return the number of users infected
+
+        Raises whatever the sink raised if a write fails; the checkpoint then
+        holds every batch written before it, and run() can be called again.
+        """
+        index = self.population.components()
+        state = self.checkpoint.load()
+        if state is None or state['feature'] != self.feature:
+            state = self._fresh(index)
+            self.checkpoint.save(state)
+        order = self._order(index, state)
+        while state['stage'] < len(self.stages):
+            number = state['stage']
+            chosen, after = self._choose(index, order, state)
+            self._push(index.component_members(chosen), state)
+            state = after
+            self.checkpoint.save(state)
+            if self.on_stage is not None and self.on_stage(number, state['infected']) is False:
+                break
+            if state['stage'] < len(self.stages):
+                self.sleep(self.stages[number].pause)
+        return state['infected']
+
+    def _push(self, uids, state):
+        """Write uids to the sink in batches, from batch state['done'] on"""
+        count = (len(uids) + self.batch_size - 1) // self.batch_size
+        queue = Queue.Queue(self.queue_size)
+        lock = threading.Lock()
+        written = set()
+        errors = []
+
+        def work():
+            while True:
+                item = queue.get()
+                if item is None:
+                    return
+                number, batch = item
+                if errors:
+                    continue  # something failed; just drain the queue
+                try:
+                    self.sink.write(self.feature, batch)
+                except Exception:
+                    errors.append(sys.exc_info())
+                    continue
+                with lock:
+                    written.add(number)
+                    # batches finish out of order; only save the unbroken run
+                    if state['done'] in written:
+                        while state['done'] in written:
+                            written.remove(state['done'])
+                            state['done'] += 1
+                        self.checkpoint.save(state)
+
+        threads = [threading.Thread(target=work) for i in xrange(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for number in xrange(state['done'], count):
+                if errors:
+                    break
+                start = number * self.batch_size
+                queue.put((number, uids[start:start + self.batch_size].tolist()))
+        finally:
+            for thread in threads:
+                queue.put(None)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for RolloutScheduler and its sinks"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from components import ComponentIndex
+from graph import Graph
+from population import Population
+from rollout import (Checkpoint, MemorySink, PopulationSink, RolloutScheduler, SQLiteSink,
+                     Stage, plan_ramp)
+from user import User
+
+
+class FlakySink(MemorySink):
+    """A MemorySink whose write number fail_at raises, once"""
+    def __init__(self, fail_at):
+        MemorySink.__init__(self)
+        self.fail_at = fail_at
+
+    def write(self, feature, uids):
+        if self.writes == self.fail_at:
+            self.fail_at = None
+            raise IOError("sink went away")
+        MemorySink.write(self, feature, uids)
+
+
+def _components_graph():
+    """Return a graph of 30 pairs, 10 triples and a classroom of 40: 140 users"""
+    graph = Graph(140)
+    pairs = [(2 * i, 2 * i + 1) for i in range(30)]
+    triples = [(60 + 3 * i, 60 + 3 * i + j) for i in range(10) for j in (1, 2)]
+    classroom = [(90, student) for student in range(91, 130)]
+    graph.add_edges(pairs + triples + classroom)
+    return graph
+
+
+class RolloutSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.graph = _components_graph()
+        self.population = Population(graph=self.graph)
+        self.stages = [(1,), Stage(10, 5), Stage(0.5, 1), (1.0,)]
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def scheduler(self, sink, **kwargs):
+        kwargs.setdefault('seeds', [self.graph.user(60)])
+        kwargs.setdefault('sleep', lambda seconds: None)
+        return RolloutScheduler(self.population, 'beta', self.stages, sink, batch_size=7,
+                                **kwargs)
+
+    def assertWholeComponents(self, uids):
+        index = ComponentIndex(self.graph)
+        self.assertEqual(set(uids), set(index.component_members(list(uids))))
+
+    def test_plan(self):
+        counts = self.scheduler(MemorySink()).plan()
+        self.assertEqual(3, counts[0])      # the seed's triple, over its target of 1
+        self.assertLessEqual(counts[1], 10)
+        self.assertLessEqual(counts[2], 70)
+        self.assertEqual(140, counts[3])
+        self.assertEqual(sorted(counts), counts)
+
+    def test_run(self):
+        sink = MemorySink()
+        pauses = []
+        seen = []
+        def on_stage(number, infected):
+            seen.append((number, infected, set(sink.grants['beta'])))
+        scheduler = self.scheduler(sink, sleep=pauses.append, on_stage=on_stage)
+        self.assertEqual(140, scheduler.run())
+        self.assertEqual(scheduler.plan(), [infected for number, infected, uids in seen])
+        self.assertEqual([0, 5, 1], pauses)
+        self.assertIn(60, seen[0][2])
+        for number, infected, uids in seen:
+            self.assertEqual(infected, len(uids))
+            self.assertWholeComponents(uids)
+        self.assertEqual(set(range(140)), sink.grants['beta'])
+        # nothing left to do
+        self.assertEqual(140, scheduler.run())
+
+    def test_resume_after_failure(self):
+        checkpoint = Checkpoint(os.path.join(self.tmp, 'checkpoint.json'))
+        sink = FlakySink(fail_at=12)
+        with self.assertRaises(IOError):
+            self.scheduler(sink, checkpoint=checkpoint, workers=1).run()
+        self.assertEqual(12, sink.writes)
+        state = Checkpoint(checkpoint.path).load()
+        self.assertEqual(3, state['stage'])
+        self.assertGreater(state['done'], 0)
+
+        # a fresh scheduler on the file carries on where that one stopped
+        resumed = self.scheduler(sink, checkpoint=Checkpoint(checkpoint.path), workers=1)
+        self.assertEqual(140, resumed.run())
+        self.assertEqual(set(range(140)), sink.grants['beta'])
+        # every batch was written exactly once
+        counts = [0] + resumed.plan()
+        batches = sum((b - a + 6) // 7 for a, b in zip(counts, counts[1:]))
+        self.assertEqual(batches, sink.writes)
+
+    def test_on_stage_stops(self):
+        checkpoint = Checkpoint()
+        sink = MemorySink()
+        scheduler = self.scheduler(sink, checkpoint=checkpoint,
+                                   on_stage=lambda number, infected: number != 1)
+        self.assertEqual(scheduler.plan()[1], scheduler.run())
+        self.assertEqual(2, checkpoint.load()['stage'])
+        scheduler.on_stage = None
+        self.assertEqual(140, scheduler.run())
+
+    def test_writes_in_flight(self):
+        class SlowSink(MemorySink):
+            def __init__(self):
+                MemorySink.__init__(self)
+                self.in_flight = self.most_in_flight = 0
+            def write(self, feature, uids):
+                with self._lock:
+                    self.in_flight += 1
+                    self.most_in_flight = max(self.most_in_flight, self.in_flight)
+                time.sleep(0.001)
+                with self._lock:
+                    self.in_flight -= 1
+                MemorySink.write(self, feature, uids)
+        sink = SlowSink()
+        self.scheduler(sink, workers=3, queue_size=1).run()
+        self.assertLessEqual(sink.most_in_flight, 3)
+        self.assertEqual(set(range(140)), sink.grants['beta'])
+
+    def test_sqlite_sink(self):
+        sink = SQLiteSink(os.path.join(self.tmp, 'grants.db'))
+        self.scheduler(sink).run()
+        self.assertEqual(set(range(140)), sink.users('beta'))
+        sink.write('beta', [1, 2])
+        self.assertEqual(140, len(sink.users('beta')))
+        sink.close()
+
+    def test_population_sink(self):
+        self.scheduler(PopulationSink(self.population)).run()
+        self.assertEqual(140, self.graph.features.count('beta'))
+
+    def test_plain_users(self):
+        users = [User() for i in range(6)]
+        users[0].add_student(users[1:3])
+        p = Population(users=users)
+        scheduler = RolloutScheduler(p, 'beta', [(3,), (1.0,)], PopulationSink(p),
+                                     seeds=[users[1]])
+        self.assertEqual([3, 6], scheduler.plan())
+        scheduler.run()
+        self.assertTrue(all('beta' in user.features for user in users))
+
+
+class PlanRampTestCase(unittest.TestCase):
+    def setUp(self):
+        self.graph = _components_graph()
+        self.population = Population(graph=self.graph)
+
+    def test_nested(self):
+        plan = plan_ramp(self.population, [0.01, 0.05, 0.25, 0.5, 1.0])
+        self.assertEqual([2, 7, 35, 70, 140], plan.targets)
+        self.assertEqual(plan.targets, plan.counts)
+        self.assertEqual([0] * 5, plan.errors())
+        before = set()
+        for stage in range(len(plan)):
+            infected = set(plan.infected(stage))
+            added = set(plan.added(stage))
+            self.assertEqual(before | added, infected)
+            self.assertFalse(before & added)
+            self.assertEqual(plan.counts[stage], len(infected))
+            before = infected
+        index = ComponentIndex(self.graph)
+        self.assertEqual(before, set(index.component_members(list(before))))
+
+    def test_errors(self):
+        """Seeds may overshoot the first stage; a gap smaller than any component undershoots"""
+        plan = plan_ramp(self.population, [1, (3,), Stage(5, 10), 100, 110],
+                         seeds=[self.graph.user(90)])
+        self.assertEqual([40, 40, 40, 100, 110], plan.counts)
+        self.assertEqual([39, 37, 35, 0, 0], plan.errors())
+        # no singletons: the pairs are the smallest components
+        graph = Graph(130)
+        graph.add_edges((coach, student) for coach in range(130)
+                        for student in self.graph.students_of(coach))
+        plan = plan_ramp(Population(graph=graph), [1, 2, 129])
+        self.assertEqual([0, 2, 128], plan.counts)
+        self.assertEqual([-1, 0, -1], plan.errors())
+
+    def test_seed(self):
+        one = plan_ramp(self.population, [10], seed=1)
+        two = plan_ramp(self.population, [10], seed=2)
+        self.assertEqual(one.counts, two.counts)
+        self.assertNotEqual(set(one.added(0)), set(two.added(0)))
+
+    def test_apply(self):
+        plan = plan_ramp(self.population, [0.25, 1.0])
+        sink = MemorySink()
+        self.assertEqual(35, plan.apply(0, 'beta', sink, batch_size=10))
+        self.assertEqual(4, sink.writes)
+        self.assertEqual(set(plan.infected(0)), sink.grants['beta'])
+        self.assertEqual(105, plan.apply(1, 'beta', PopulationSink(self.population)))
+        self.assertEqual(set(plan.added(1)), set(self.graph.features.users(['beta'])))
+
+    def test_scheduler(self):
+        """A RolloutScheduler handed a plan pushes its selections and keeps its pauses"""
+        plan = plan_ramp(self.population, [Stage(0.05, 3), Stage(0.5, 7), 1.0])
+        sink = MemorySink()
+        paused, seen = [], []
+        scheduler = RolloutScheduler(self.population, 'beta', plan, sink, sleep=paused.append,
+                                     on_stage=lambda number, infected: seen.append(
+                                         (infected, set(sink.grants['beta']))))
+        self.assertEqual(plan.counts, scheduler.plan())
+        self.assertEqual(140, scheduler.run())
+        self.assertEqual([3, 7], paused)
+        for stage, (infected, uids) in enumerate(seen):
+            self.assertEqual(plan.counts[stage], infected)
+            self.assertEqual(set(plan.infected(stage)), uids)
+
+    def test_plain_users(self):
+        users = [User() for i in range(6)]
+        users[0].add_student(users[1:3])
+        users[3].add_student(users[4])
+        plan = plan_ramp(Population(users), [3, 5, 6], seeds=[])
+        self.assertEqual([3, 5, 6], plan.counts)
+        self.assertEqual(set(range(6)), set(plan.infected(2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -27,7 +27,7 @@ setup(
     license='Apache 2.0',
     author='Joe Blaylock',
     author_email='jrbl@jrbl.org',
-    py_modules=['infection'],
+    py_modules=['infection', 'graph', 'buckets', 'builder', 'components', 'features', 'edgelist', 'journal', 'lookup', 'snapshot', 'population', 'roles', 'rollout', 'shards', 'user'],
     include_package_data=True,
     classifiers=[
         'Intended Audience :: Developers',
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Split a population into shards of whole components, and infect across them
+
+Infection never crosses a component boundary, so a population can be cut into
+shards that never need to talk to each other: put every component wholly in
+one shard. partition_edge_file() does that for an edge-list file too big to
+load, in two streaming passes: a UnionFind over the ids to find components,
+then a pass copying each edge into its shard's own file. Memory use is a few
+ints per user and nothing per edge. partition_population() does the same for
+a Population already in memory.
+
+Components go to shards largest first, each to the shard with the least work
+so far, weighing a component by its users plus its edges. Every shard is
+written to a directory as:
+
+* shard-K.bin, its edges in edgelist.py's binary format, renumbered 0..n-1
+* shard-K.features, its feature sidecar, under the same new ids
+* shard-K.ids, the original id of each new one, in increasing order, as
+  native 32-bit ints
+
+along with shards.map, the shard number of every original id as native
+16-bit unsigned ints, and manifest.json. Population.from_edges() reads any one
+shard back on its own; ShardedPopulation reads the lot, and runs infections on
+each shard in its own process.
+"""
+
+
+from array import array
+from bisect import bisect_left
+from heapq import heapify, heapreplace
+from itertools import izip
+import json
+import multiprocessing
+import os
+import random
+import sys
+
+from components import UnionFind
+from edgelist import CHUNK_SIZE, iter_edge_chunks, read_sidecar
+from graph import Graph, ID_TYPE, OFFSET_TYPE, to_array
+from infection import limited_infection
+from population import Population
+
+
+SHARD_TYPE = 'H'    # array typecode of shards.map entries
+MANIFEST = 'manifest.json'
+
+
+def shard_paths(directory, shard):
+    """Return the edge, sidecar and id file paths of shard in directory"""
+    stem = os.path.join(directory, 'shard-{}'.format(shard))
+    return stem + '.bin', stem + '.features', stem + '.ids'
+
+def _write_pairs(f, coaches, students):
+    pairs = array(ID_TYPE, [0]) * (2 * len(coaches))
+    pairs[0::2] = coaches
+    pairs[1::2] = students
+    if sys.byteorder == 'big':
+        pairs.byteswap()
+    pairs.tofile(f)
+
+def _partition(chunks, size, grants, directory, shards):
+    """Write shards of the edges chunks() yields over size users, and of grants
+
+    chunks is called once per pass and yields (coaches, students) arrays;
+    grants is a sequence of (user id, feature) pairs.
+    """
+    if not 0 < shards <= 1 << 16:
+        raise ValueError, "Can't make {} shards".format(shards)
+    # first pass: components, and how many edges each user coaches
+    components = UnionFind(Graph(size))
+    out_degree = array(OFFSET_TYPE, [0]) * size
+    union = components.union
+    for coaches, students in chunks():
+        for coach, student in izip(coaches, students):
+            out_degree[coach] += 1
+            union(coach, student)
+
+    # weigh components by users plus edges, and hand them out heaviest first
+    root_of = array(ID_TYPE, (components.find(uid) for uid in xrange(size)))
+    edges = array(OFFSET_TYPE, [0]) * size
+    for uid, root in enumerate(root_of):
+        edges[root] += out_degree[uid]
+    out_degree = None
+    weights = sorted((-(components.size(root) + edges[root]), root)
+                     for root in xrange(size) if root_of[root] == root)
+    loads = [(0, shard) for shard in xrange(shards)]
+    heapify(loads)
+    shard_of = array(SHARD_TYPE, [0]) * size
+    users = [0] * shards
+    shard_edges = [0] * shards
+    for weight, root in weights:
+        load, shard = loads[0]
+        heapreplace(loads, (load - weight, shard))
+        shard_of[root] = shard
+        users[shard] += components.size(root)
+        shard_edges[shard] += edges[root]
+    components = edges = weights = None
+
+    # new ids are handed out in order of old ones, so each shard's ids file is
+    # sorted, and bisecting it maps an old id to a new one
+    local = array(ID_TYPE, [0]) * size
+    counts = [0] * shards
+    id_files = [open(shard_paths(directory, shard)[2], 'wb') for shard in xrange(shards)]
+    try:
+        for start in xrange(0, size, CHUNK_SIZE):
+            ids = [array(ID_TYPE) for shard in xrange(shards)]
+            for uid in xrange(start, min(size, start + CHUNK_SIZE)):
+                shard = shard_of[uid] = shard_of[root_of[uid]]
+                local[uid] = counts[shard]
+                counts[shard] += 1
+                ids[shard].append(uid)
+            for f, chunk in izip(id_files, ids):
+                chunk.tofile(f)
+    finally:
+        for f in id_files:
+            f.close()
+    root_of = None
+    with open(os.path.join(directory, 'shards.map'), 'wb') as f:
+        shard_of.tofile(f)
+
+    # second pass: copy every edge into its shard, renumbered
+    edge_files = [open(shard_paths(directory, shard)[0], 'wb') for shard in xrange(shards)]
+    try:
+        for coaches, students in chunks():
+            out = [(array(ID_TYPE), array(ID_TYPE)) for shard in xrange(shards)]
+            for coach, student in izip(coaches, students):
+                shard_coaches, shard_students = out[shard_of[coach]]
+                shard_coaches.append(local[coach])
+                shard_students.append(local[student])
+            for f, (shard_coaches, shard_students) in izip(edge_files, out):
+                _write_pairs(f, shard_coaches, shard_students)
+    finally:
+        for f in edge_files:
+            f.close()
+    sidecars = [open(shard_paths(directory, shard)[1], 'wb') for shard in xrange(shards)]
+    try:
+        for uid, feature in grants:
+            sidecars[shard_of[uid]].write('{}\t{}\n'.format(local[uid], feature))
+    finally:
+        for f in sidecars:
+            f.close()
+
+    manifest = {'N': size, 'shards': shards, 'users': users, 'edges': shard_edges}
+    with open(os.path.join(directory, MANIFEST), 'wb') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+def partition_edge_file(path, directory, shards, binary=None, sidecar=None, size=None,
+                        chunk_size=CHUNK_SIZE):
+    """Partition the edge-list file at path, and its sidecar, into shards in directory
+
+    Arguments mean what they do for edgelist.read_graph(). Without size, one
+    more pass over the edges finds the largest id. Returns the manifest.
+    """
+    chunks = lambda: iter_edge_chunks(path, binary, chunk_size)
+    grants = list(read_sidecar(sidecar)) if sidecar else []
+    if size is None:
+        size = max([uid + 1 for uid, feature in grants] or [0])
+        for coaches, students in chunks():
+            size = max(size, max(coaches) + 1, max(students) + 1)
+    return _partition(chunks, size, grants, directory, shards)
+
+def partition_population(population, directory, shards, chunk_size=CHUNK_SIZE):
+    """Partition population, by its id_of() ids, into shards in directory
+
+    Returns the manifest.
+    """
+    graph = population.id_graph()
+    if population.graph is None:
+        # features of plain Users live on the Users themselves
+        grants = [(uid, feature) for uid in xrange(len(graph))
+                  for feature in population.user_of(uid).features]
+    else:
+        grants = [(uid, feature) for feature in graph.features
+                  for uid in graph.features.users([feature])]
+
+    def chunks():
+        coaches, students = array(ID_TYPE), array(ID_TYPE)
+        for coach in xrange(len(graph)):
+            row = graph.students_of(coach)
+            coaches.extend(array(ID_TYPE, [coach]) * len(row))
+            students.extend(to_array(ID_TYPE, row))
+            if len(coaches) >= chunk_size:
+                yield coaches, students
+                coaches, students = array(ID_TYPE), array(ID_TYPE)
+        if coaches:
+            yield coaches, students
+
+    return _partition(chunks, len(graph), grants, directory, shards)
+
+
+def open_shard(directory, shard):
+    """Return the Population of shard in directory and the original ids of its users"""
+    edges, sidecar, ids_path = shard_paths(directory, shard)
+    ids = array(ID_TYPE)
+    with open(ids_path, 'rb') as f:
+        ids.fromstring(f.read())
+    return Population.from_edges(edges, binary=True, sidecar=sidecar, size=len(ids)), ids
+
+def _local_ids(ids, uids):
+    return [bisect_left(ids, uid) for uid in uids]
+
+def _shard_total(args):
+    directory, shard, uids, include_infected = args
+    population, ids = open_shard(directory, shard)
+    seeds = _local_ids(ids, uids)
+    if include_infected:
+        seeds.extend(population.id_of(user) for user in population.infected)
+    found = population.components().component_members(seeds)
+    return array(ID_TYPE, (ids[uid] for uid in found)).tostring()
+
+def _shard_limited(args):
+    directory, shard, uid, max_infections, whole_classrooms, seed = args
+    population, ids = open_shard(directory, shard)
+    if uid is None:
+        uid = ids[random.Random(seed).randrange(len(ids))]
+    start = population.user_of(_local_ids(ids, [uid])[0])
+    infected = limited_infection(start, max_infections, population, whole_classrooms)
+    return array(ID_TYPE, (ids[user.id] for user in infected)).tostring()
+
+
+class ShardedPopulation(object):
+    """The shards written by partition_*() to directory, infected a process per shard
+
+    Results are arrays of the original user ids, sorted. workers is the number of
+    processes to run shards in; None means one per CPU. Shards are only ever
+    loaded in worker processes, never in this one, so its memory stays that of
+    the shard map however big the shards are.
+    """
+
+    def __init__(self, directory, workers=None):
+        self.directory = directory
+        self.workers = workers or multiprocessing.cpu_count()
+        with open(os.path.join(directory, MANIFEST), 'rb') as f:
+            self.manifest = json.load(f)
+        self.N = self.manifest['N']
+        self.shards = self.manifest['shards']
+        self.shard_of = array(SHARD_TYPE)
+        with open(os.path.join(directory, 'shards.map'), 'rb') as f:
+            self.shard_of.fromstring(f.read())
+
+    def __len__(self):
+        return self.N
+
+    def _map(self, function, tasks):
+        found = array(ID_TYPE)
+        if not tasks:
+            return found
+        pool = multiprocessing.Pool(min(self.workers, len(tasks)))
+        try:
+            results = pool.map(function, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        for result in results:
+            found.fromstring(result)
+        return array(ID_TYPE, sorted(found))
+
+    def total_infection(self, uids=(), include_infected=False):
+        """Return everyone connected to any of uids, and to pre-infected users if asked"""
+        by_shard = {}
+        for uid in uids:
+            by_shard.setdefault(self.shard_of[uid], []).append(uid)
+        if include_infected:
+            for shard in xrange(self.shards):
+                by_shard.setdefault(shard, [])
+        tasks = [(self.directory, shard, seeds, include_infected)
+                 for shard, seeds in sorted(by_shard.iteritems())]
+        return self._map(_shard_total, tasks)
+
+    def limited_infection(self, uid, max_infections, whole_classrooms=False, seed=None):
+        """Infect close to max_infections users starting from uid, as limited_infection() does
+
+        Random jumps stay within a shard, so once uid's shard is wholly infected we go
+        on to the next shard from a random user, until max_infections is reached.
+        Each shard runs in a worker process, one after another.
+        """
+        rng = random.Random(seed)
+        found = array(ID_TYPE)
+        shard = self.shard_of[uid]
+        for step in xrange(self.shards):
+            remaining = max_infections - len(found)
+            if remaining <= 0:
+                break
+            if not self.manifest['users'][(shard + step) % self.shards]:
+                continue
+            task = (self.directory, (shard + step) % self.shards, uid if step == 0 else None,
+                    remaining, whole_classrooms, rng.random())
+            found.extend(self._map(_shard_limited, [task]))
+        return array(ID_TYPE, sorted(found))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for sharding populations by component"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from components import ComponentIndex
+from infection import total_infection
+from population import Population
+from shards import (ShardedPopulation, open_shard, partition_edge_file,
+                    partition_population)
+from user import User
+
+
+class ShardTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.population = Population()
+        self.population.randomize_graph(600, infect_rate=0.05, feature='A', coach_rate=0.02,
+                                        seed=11)
+        self.graph = self.population.graph
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def directory(self, name):
+        path = os.path.join(self.tmp, name)
+        os.mkdir(path)
+        return path
+
+    def test_components_stay_whole(self):
+        directory = self.directory('shards')
+        manifest = partition_population(self.population, directory, 3)
+        self.assertEqual(600, sum(manifest['users']))
+        self.assertEqual(self.graph.E, sum(manifest['edges']))
+        sharded = ShardedPopulation(directory, workers=1)
+        index = ComponentIndex(self.graph)
+        for uid in xrange(600):
+            self.assertEqual(sharded.shard_of[index.label(uid)], sharded.shard_of[uid])
+        # every shard reads back as a population of its own, features and all
+        infected = 0
+        for shard in range(3):
+            population, ids = open_shard(directory, shard)
+            self.assertEqual(list(ids), sorted(ids))
+            self.assertEqual(manifest['users'][shard], len(population.graph))
+            infected += population.graph.features.count('A')
+        self.assertEqual(self.graph.features.count('A'), infected)
+
+    def test_balanced(self):
+        directory = self.directory('shards')
+        manifest = partition_population(self.population, directory, 3)
+        loads = [u + e for u, e in zip(manifest['users'], manifest['edges'])]
+        index = ComponentIndex(self.graph)
+        biggest = max(len(index.members(label)) +
+                      sum(len(self.graph.students_of(uid)) for uid in index.members(label))
+                      for label, size in index.sizes())
+        self.assertLessEqual(max(loads) - min(loads), biggest)
+
+    def test_total_infection(self):
+        directory = self.directory('shards')
+        partition_population(self.population, directory, 4)
+        seeds = [0, 17, 250, 599]
+        for workers in (1, 2):
+            sharded = ShardedPopulation(directory, workers=workers)
+            expected = set()
+            for uid in seeds:
+                expected.update(u.id for u in total_infection(self.graph.user(uid)))
+            self.assertEqual(sorted(expected), list(sharded.total_infection(seeds)))
+        everyone = total_infection(population=self.population)
+        self.assertEqual(sorted(u.id for u in everyone),
+                         list(sharded.total_infection(include_infected=True)))
+
+    def test_limited_infection(self):
+        directory = self.directory('shards')
+        partition_population(self.population, directory, 3)
+        sharded = ShardedPopulation(directory, workers=1)
+        found = sharded.limited_infection(5, 50, seed=1)
+        self.assertEqual(50, len(found))
+        self.assertEqual(len(found), len(set(found)))
+        self.assertIn(5, found)
+        self.assertEqual(600, len(sharded.limited_infection(5, 10 ** 6, seed=1)))
+
+    def test_edge_file(self):
+        edges = os.path.join(self.tmp, 'edges.bin')
+        sidecar = os.path.join(self.tmp, 'features.tsv')
+        self.population.to_edges(edges, sidecar=sidecar)
+        a = partition_population(self.population, self.directory('a'), 3)
+        b = partition_edge_file(edges, self.directory('b'), 3, sidecar=sidecar, size=600,
+                                chunk_size=100)
+        self.assertEqual(a, b)
+        for name in ('shards.map', 'shard-0.bin', 'shard-1.features', 'shard-2.ids'):
+            with open(os.path.join(self.tmp, 'a', name), 'rb') as f:
+                with open(os.path.join(self.tmp, 'b', name), 'rb') as g:
+                    self.assertEqual(f.read(), g.read())
+
+    def test_plain_users(self):
+        A = User(); B = User(); C = User()
+        B.add_coach(A)
+        C.features.add('X')
+        p = Population(users=[A, B, C])
+        directory = self.directory('shards')
+        partition_population(p, directory, 2)
+        sharded = ShardedPopulation(directory, workers=1)
+        self.assertEqual([p.id_of(A), p.id_of(B)], list(sharded.total_infection([p.id_of(B)])))
+        self.assertEqual([p.id_of(C)], list(sharded.total_infection(include_infected=True)))
+
+    def test_bad_shard_count(self):
+        with self.assertRaises(ValueError):
+            partition_population(self.population, self.directory('shards'), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Save Graphs to, and map them back from, versioned on-disk snapshots
+
+A snapshot is laid out as:
+
+* the magic string MAGIC, then the format VERSION and the length of a JSON
+  header, both as little-endian 32-bit unsigned ints
+* the JSON header, naming the user count, the byte order, the features in
+  bit order and, for every section, its array typecode, offset and length
+* the sections themselves, each aligned to 8 bytes: the graph's CSR arrays,
+  the ComponentIndex groups, and one bitmap per feature
+
+read_snapshot() maps the file copy-on-write and hands the Graph and index
+ctypes views straight onto the mapped pages, so there is nothing to parse and
+processes loading the same file share those pages until one of them writes.
+Feature bitmaps are the exception: they're small and expected to change, so
+each is copied out into a bytearray.
+"""
+
+
+import ctypes
+import json
+import mmap
+import struct
+import sys
+
+from components import ComponentIndex
+from graph import Graph, ID_TYPE, OFFSET_TYPE
+
+
+MAGIC = 'INFSNAP\x00'
+VERSION = 1
+_PREAMBLE = struct.Struct('<8sII')
+_CTYPES = {ID_TYPE: ctypes.c_int, OFFSET_TYPE: ctypes.c_long, 'B': ctypes.c_ubyte}
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+def write_snapshot(graph, index, path):
+    """Write graph and its ComponentIndex to a snapshot file at path"""
+    graph.compact()
+    labels, order, starts, slots = index.groups()
+    sections = [
+        ('student_offsets', OFFSET_TYPE, graph._students.offsets),
+        ('students', ID_TYPE, graph._students.targets),
+        ('coach_offsets', OFFSET_TYPE, graph._coaches.offsets),
+        ('coaches', ID_TYPE, graph._coaches.targets),
+        ('labels', ID_TYPE, labels),
+        ('component_order', ID_TYPE, order),
+        ('component_starts', OFFSET_TYPE, starts),
+        ('component_slots', ID_TYPE, slots),
+    ]
+    features = list(graph.features)
+    for bit, feature in enumerate(features):
+        sections.append(('feature.{}'.format(bit), 'B', graph.features.bitmap(feature)))
+
+    header = {'N': len(graph), 'components': len(index), 'byteorder': sys.byteorder,
+              'features': features, 'sections': {}}
+    # offsets depend on the header's length, which depends on the offsets, so
+    # lay the sections out once with a generous guess and check it held
+    guess = 0
+    while True:
+        offset = _align(_PREAMBLE.size + guess)
+        for name, typecode, data in sections:
+            header['sections'][name] = [typecode, offset, len(data)]
+            offset = _align(offset + len(buffer(data)))
+        encoded = json.dumps(header, sort_keys=True)
+        if _PREAMBLE.size + len(encoded) <= _align(_PREAMBLE.size + guess):
+            break
+        guess = len(encoded) + 64
+
+    with open(path, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(encoded)))
+        f.write(encoded)
+        for name, typecode, data in sections:
+            f.seek(header['sections'][name][1])
+            f.write(buffer(data))
+        f.truncate(offset)
+
+def read_snapshot(path):
+    """Map the snapshot at path and return its Graph and ComponentIndex"""
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, version, length = _PREAMBLE.unpack_from(mapped, 0)
+    if magic != MAGIC:
+        raise ValueError, "{} is not an infection snapshot".format(path)
+    if version != VERSION:
+        raise ValueError, "{} is snapshot version {}; we read version {}".format(
+            path, version, VERSION)
+    header = json.loads(mapped[_PREAMBLE.size:_PREAMBLE.size + length])
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError, "{} was written on a {}-endian machine".format(
+            path, header['byteorder'])
+
+    def section(name):
+        typecode, offset, count = header['sections'][name]
+        return (_CTYPES[typecode] * count).from_buffer(mapped, offset)
+
+    graph = Graph.from_csr(section('student_offsets'), section('students'),
+                           section('coach_offsets'), section('coaches'))
+    for bit, feature in enumerate(header['features']):
+        bitmap = graph.features.bitmap(feature)
+        bitmap[:] = bytearray(section('feature.{}'.format(bit)))
+    index = ComponentIndex.from_groups(graph, section('labels'), section('component_order'),
+                                       section('component_starts'),
+                                       section('component_slots'), header['components'])
+    return graph, index
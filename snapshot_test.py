@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2014 Joseph Blaylock <jrbl@jrbl.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test Cases for population snapshots"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from graph import Graph
+from infection import total_infection
+from population import Population
+import snapshot
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'population.snap')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def population(self):
+        g = Graph(7)
+        g.add_edges([(0, 1), (0, 2), (3, 2), (4, 5)])
+        g.features.grant('A', [1, 6])
+        g.features.grant('B', [6])
+        return Population(graph=g)
+
+    def test_round_trip(self):
+        before = self.population()
+        before.to_snapshot(self.path)
+        after = Population.from_snapshot(self.path)
+        a, b = before.graph, after.graph
+        self.assertEqual(len(a), len(b))
+        self.assertEqual(a.E, b.E)
+        for uid in range(len(a)):
+            self.assertEqual(sorted(a.students_of(uid)), sorted(b.students_of(uid)))
+            self.assertEqual(sorted(a.coaches_of(uid)), sorted(b.coaches_of(uid)))
+            self.assertEqual(a.features.features_of(uid), b.features.features_of(uid))
+        index = after.components()
+        self.assertEqual(3, len(index))
+        self.assertEqual(4, index.size(2))
+        self.assertEqual(set([4, 5]), set(index.members(5)))
+        self.assertEqual(set([b.user(6)]), total_infection(b.user(6)))
+        self.assertEqual(set([b.user(1), b.user(6)]), after.infected)
+
+    def test_mapped_population_still_changes(self):
+        self.population().to_snapshot(self.path)
+        p = Population.from_snapshot(self.path)
+        p.graph.user(6).add_coach(p.graph.user(5))
+        self.assertEqual(3, p.components().size(6))
+        new = p.graph.add_users(1)
+        p.graph.add_edge(new, 0)
+        self.assertEqual(5, p.components().size(new))
+        p.graph.compact()
+        self.assertEqual([new], list(p.graph.coaches_of(0)))
+        # nothing written through the mapping reaches the file
+        self.assertEqual(7, len(Population.from_snapshot(self.path).graph))
+
+    def test_plain_users_and_empty_graph(self):
+        Population().to_snapshot(self.path)
+        self.assertEqual(0, Population.from_snapshot(self.path).N)
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write('not a snapshot at all, no')
+        with self.assertRaises(ValueError):
+            Population.from_snapshot(self.path)
+        self.population().to_snapshot(self.path)
+        with open(self.path, 'r+b') as f:
+            f.seek(8)
+            f.write(snapshot._PREAMBLE.pack(snapshot.MAGIC, snapshot.VERSION + 1, 0)[8:12])
+        with self.assertRaises(ValueError):
+            Population.from_snapshot(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
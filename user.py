@@ -17,18 +17,21 @@
 
 
 from collections import Iterable
+from itertools import count
 
 
 class User(object):
-    AllUserCount = 0
+    # next() on an itertools.count runs in C under the GIL, so concurrent
+    # constructors can't be handed the same id
+    _ids = count(1)
+    population = None   # set by the Population holding this User, if any
 
     def __init__(self, *args, **kwargs):
         # XXX: this is convenient when we're still figuring out our API
         #      TODO: get rid of this
         for attr, value in kwargs.items():
             setattr(self, attr, value)
-        User.AllUserCount += 1        # XXX: Not Thread Safe
-        self.__id = User.AllUserCount # XXX: Still not thread safe
+        self.__id = next(User._ids)
         self.features = set()
         self.__coaching = set()
         self.__coached_by = set()
@@ -38,31 +41,54 @@ class User(object):
         
         If coach is an iterable, every member will be added.
         It is an error to add a coach which is not a User."""
-        self._add_user(coach, '_User__coached_by', '_User__coaching')
+        self._add_user(coach, True)
 
     def add_student(self, student):
         """Symmetrically add coaching to us and coached_by to them.
         
         If student is an iterable, every member will be added.
         It is an error to add a student which is not a User."""
-        self._add_user(student, '_User__coaching', '_User__coached_by')
-
-    def _add_user(self, userish, ourtarget, theirtarget):
-        def add_with_check(userish):
-            if isinstance(userish, User):
-                v = getattr(self, ourtarget)
-                v.add(userish)
-                setattr(self, ourtarget, v)
-                v = getattr(userish, theirtarget)
-                v.add(self)
-                setattr(userish, theirtarget, v)
-            else:
+        self._add_user(student, False)
+
+    def remove_coach(self, coach):
+        """Symmetrically remove coached_by from us and coaching from them.
+
+        If coach is an iterable, every member will be removed. Removing a coach
+        we don't have does nothing."""
+        self._remove_user(coach, True)
+
+    def remove_student(self, student):
+        """Symmetrically remove coaching from us and coached_by from them.
+
+        If student is an iterable, every member will be removed. Removing a
+        student we don't have does nothing."""
+        self._remove_user(student, False)
+
+    def _add_user(self, userish, as_coach):
+        # as_coach means userish coaches us; otherwise we coach userish
+        for user in (userish if isinstance(userish, Iterable) else (userish,)):
+            if not isinstance(user, User):
+                raise TypeError, "Only Users can be coaches."
+            coach, student = (user, self) if as_coach else (self, user)
+            coach.__coaching.add(student)
+            student.__coached_by.add(coach)
+            population = self.population or user.population
+            if population is not None:
+                population.edge_added(coach, student)
+
+    def _remove_user(self, userish, as_coach):
+        # as in _add_user(); copy first, since userish may be one of our own sets
+        for user in list(userish if isinstance(userish, Iterable) else (userish,)):
+            if not isinstance(user, User):
                 raise TypeError, "Only Users can be coaches."
-        if isinstance(userish, Iterable):
-            for u in userish:
-                add_with_check(u)
-        else:
-            add_with_check(userish)
+            coach, student = (user, self) if as_coach else (self, user)
+            if student not in coach.__coaching:
+                continue
+            coach.__coaching.discard(student)
+            student.__coached_by.discard(coach)
+            population = self.population or user.population
+            if population is not None:
+                population.edge_removed(coach, student)
 
     def coaches(self):
         """Return the set of coaches this user is coached_by"""
@@ -15,6 +15,7 @@
 # limitations under the License.
 """Test Cases for User objects"""
 
+import threading
 import unittest
 
 from user import User
@@ -23,10 +24,20 @@ from user import User
 class UserTestCase(unittest.TestCase):
     def test_user_id_unique(self):
         """Every user gets a unique id which is also its hashing key."""
-        # XXX: It's understood that these ids aren't threadsafe.
         users = [hash(User()) for i in range(100)]
         self.assertEqual(len(users), len(set(users)))
 
+    def test_user_id_unique_across_threads(self):
+        users = []
+        def make():
+            users.extend(hash(User()) for i in range(1000))
+        threads = [threading.Thread(target=make) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4000, len(set(users)))
+
     def test_add_coach_simple(self):
         """Using student.add_coach(coach) updates student *and* coach"""
         A = User()
@@ -50,6 +61,20 @@ class UserTestCase(unittest.TestCase):
         with self.assertRaises(TypeError):
             A.add_coach(B)
 
+    def test_remove_coach(self):
+        """Removing a coach updates student *and* coach, and ignores strangers"""
+        A, B, C = User(), User(), User()
+        B.add_coach([A, C])
+        B.remove_coach(A)
+        B.remove_coach(A)
+        self.assertEqual(set([C]), B.coaches())
+        self.assertEqual(set(), A.students())
+        A.add_student(B)
+        A.remove_student(A.students())
+        self.assertEqual(set(), A.students())
+        with self.assertRaises(TypeError):
+            A.remove_student("student")
+
     def test_coaches_accessor(self):
         A = User()
         coaches = [User() for user in range(5)]